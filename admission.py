@@ -0,0 +1,377 @@
+import fcntl
+import os
+import shutil
+import socket
+import tempfile
+import time
+from threading import Lock
+from logs import get_logger
+from result_cache import pid_alive
+
+log = get_logger('admission')
+
+# A download briefly needs room for its parts plus the merged or converted
+# file next to them, so it reserves twice its estimated size
+PEAK_FACTOR = 2
+
+
+class Overloaded(Exception):
+    """Raised when a budget (scratch disk, encoders) has no room for more work right now"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def estimate_size(info, default):
+    """Bytes the selected formats of an info dict will take, from their (approximate) sizes.
+
+    Formats without a size are estimated from their bitrate and the
+    duration. If even that is unknown, ``default`` is used.
+    """
+    total = 0
+    for fmt in info.get('requested_formats') or [info]:
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if not size and fmt.get('tbr') and info.get('duration'):
+            size = fmt['tbr'] * 1000 / 8 * info['duration']
+        if not size:
+            return default
+        total += size
+    return int(total)
+
+
+def _tree_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def _format_bytes(size):
+    return f'{size / 1024 ** 3:.1f} GB' if size >= 1024 ** 3 else f'{size / 1024 ** 2:.0f} MB'
+
+
+class ScratchSpace:
+    """Scratch directories for downloads, with a disk budget shared by every worker.
+
+    Each process keeps its directories under ``<root>/<host>-<pid>/``. A directory
+    starts with nothing reserved; once the formats (and so the size) of a
+    download are known, ``admit()`` reserves room for it and waits while
+    the reservations of all processes plus this one would exceed
+    ``max_bytes`` (0: no fixed budget) or leave less than ``min_free_bytes``
+    free on the disk. Reservations live in ``<dir>.reserved`` files next to
+    the directories, so any worker can add them up, and a directory that
+    outgrew its estimate counts with its real size.
+
+    Directories of processes on this host that are gone (a crashed or
+    killed worker) are removed when a ScratchSpace is created.
+
+    Work areas (``<root>/work/<name>/``) are scratch directories for one
+    download that outlive its process: ``claim(name)`` locks one for this
+    process, ``keep()`` leaves its partial files for a later attempt at the
+    same download and ``release()`` deletes it. A kept work area nobody
+    claims again is deleted after ``keep_ttl`` seconds.
+    """
+
+    def __init__(self, root, max_bytes=0, min_free_bytes=0, default_estimate=256 * 1024 ** 2,
+                 wait_timeout=600, retry_after=30, keep_ttl=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.default_estimate = default_estimate
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.host = socket.gethostname()
+        self.dir = os.path.join(root, f'{self.host}-{os.getpid()}')
+        self.work_dir = os.path.join(root, 'work')
+        self.keep_ttl = keep_ttl
+        self.lock = Lock()
+        self.reserved = {}  # path -> bytes reserved by this process
+        self.claimed = {}  # work area path -> its held lock file
+        self.last_expiry = 0
+        os.makedirs(root, exist_ok=True)
+        self.remove_orphans()
+        os.makedirs(self.dir, exist_ok=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self.remove_expired()
+
+    def remove_orphans(self):
+        """Delete scratch directories left behind by processes that no longer run"""
+        removed, freed = 0, 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            # Dot entries (the lock file, Slots directories) belong to everyone
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            host, _, pid = name.rpartition('-')
+            # Not a process directory (work areas expire on their own) or not one of this host
+            if host != self.host or not pid.isdigit():
+                continue
+            # Our own PID's directory is from an earlier process that had the same PID
+            if int(pid) != os.getpid() and pid_alive(int(pid)):
+                continue
+            freed += _tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        if removed:
+            log.info("🧹 Removed orphaned scratch directories", count=removed, size=freed)
+
+    def create(self):
+        """A new, empty scratch directory. Nothing is reserved for it yet."""
+        return tempfile.mkdtemp(dir=self.dir)
+
+    def claim(self, name):
+        """Work area ``name``, with whatever an earlier attempt kept in it, or None while another process has it"""
+        if time.monotonic() - self.last_expiry > 60:
+            self.remove_expired()
+        path = os.path.join(self.work_dir, name)
+        lock = self._lock_work_area(path)
+        if lock is None:
+            return None
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            self.claimed[path] = lock
+        return path
+
+    def _lock_work_area(self, path):
+        """The work area's lock file, held with flock, or None if another process holds it"""
+        lock_path = f'{path}.lock'
+        while True:
+            f = open(lock_path, 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return None
+            # The file may have been deleted with its work area since we opened it
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(lock_path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close()
+
+    def keep(self, path):
+        """Leave a claimed work area for a later attempt. Other scratch directories are released."""
+        with self.lock:
+            lock = self.claimed.pop(path, None)
+        if lock is None:
+            return self.release(path)
+        # Its files still count against the budget, but nothing more is reserved
+        self._write_reservation(path, 0)
+        with self.lock:
+            self.reserved.pop(path, None)
+        os.utime(path)
+        log.info("📌 Keeping partial download", path=path, size=_tree_size(path))
+        lock.close()
+
+    def remove_expired(self):
+        """Delete work areas kept longer than keep_ttl that nobody has claimed again"""
+        self.last_expiry = time.monotonic()
+        names = {name.rsplit('.', 1)[0] if name.endswith(('.lock', '.reserved')) else name
+                 for name in os.listdir(self.work_dir)}
+        for name in names:
+            path = os.path.join(self.work_dir, name)
+            try:
+                kept_since = os.path.getmtime(path if os.path.isdir(path) else f'{path}.lock')
+            except OSError:
+                kept_since = 0
+            if time.time() - kept_since < self.keep_ttl:
+                continue
+            lock = self._lock_work_area(path)
+            if lock is None:
+                continue
+            size = _tree_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+            for suffix in ('.reserved', '.lock'):
+                try:
+                    os.remove(f'{path}{suffix}')
+                except FileNotFoundError:
+                    pass
+            lock.close()
+            log.info("🧹 Removed expired partial download", name=name, size=size)
+
+    def _reservations(self):
+        """(path, reserved bytes, bytes on disk) of every live scratch directory"""
+        entries = []
+        for owner in os.listdir(self.root):
+            owner_dir = os.path.join(self.root, owner)
+            if owner.startswith('.') or not os.path.isdir(owner_dir):
+                continue
+            for name in os.listdir(owner_dir):
+                if not name.endswith('.reserved'):
+                    continue
+                path = os.path.join(owner_dir, name[:-len('.reserved')])
+                try:
+                    with open(os.path.join(owner_dir, name)) as f:
+                        reserved = int(f.read() or 0)
+                except (OSError, ValueError):
+                    continue
+                entries.append((path, reserved, _tree_size(path)))
+        return entries
+
+    def _room(self, needed):
+        """None if ``needed`` more bytes fit right now, else the reason they don't"""
+        entries = self._reservations()
+        if self.max_bytes:
+            committed = sum(max(reserved, used) for _, reserved, used in entries)
+            if committed + needed > self.max_bytes:
+                return f'{_format_bytes(committed)} of {_format_bytes(self.max_bytes)} scratch space in use'
+        # Reserved bytes that haven't been written yet will still come off the disk
+        outstanding = sum(max(0, reserved - used) for _, reserved, used in entries)
+        free = shutil.disk_usage(self.root).free - outstanding
+        if free - needed < self.min_free_bytes:
+            return f'only {_format_bytes(max(free, 0))} free on the scratch disk'
+        return None
+
+    def _locked(self):
+        """Exclusive lock across processes while reservations are checked and made"""
+        f = open(os.path.join(self.root, '.lock'), 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def check(self):
+        """Raise Overloaded if a download of the default size wouldn't fit now (for early 503s)"""
+        needed = self.default_estimate * PEAK_FACTOR
+        if self.max_bytes:
+            needed = min(needed, self.max_bytes)
+        with self._locked():
+            reason = self._room(needed)
+        if reason:
+            raise Overloaded(f'Server is short on disk space ({reason}), retry in {self.retry_after}s',
+                             self.retry_after)
+
+    def admit(self, path, estimate, on_wait=None, cancelled=None):
+        """Reserve room for a download of ``estimate`` bytes in scratch directory ``path``.
+
+        Waits up to wait_timeout seconds for room, calling ``on_wait(reason)``
+        when it has to wait and giving up early once ``cancelled()`` is true.
+        Raises Overloaded if the room doesn't come, or can never come.
+        """
+        needed = (estimate or self.default_estimate) * PEAK_FACTOR
+        if self.max_bytes and needed > self.max_bytes:
+            raise Overloaded(f'This download needs about {_format_bytes(needed)} of scratch space, '
+                             f'more than the {_format_bytes(self.max_bytes)} available', None)
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            with self._locked():
+                # Whatever this directory reserved before is replaced, not added to
+                self._write_reservation(path, 0)
+                reason = self._room(needed)
+                if reason is None:
+                    self._write_reservation(path, needed)
+                    if waiting:
+                        log.info("💽 Scratch space free again", size=needed)
+                    return needed
+            if cancelled and cancelled():
+                return None
+            if time.monotonic() >= deadline:
+                raise Overloaded(f'Timed out waiting for scratch space ({reason})', self.retry_after)
+            if not waiting:
+                log.warning("💽 Waiting for scratch space", size=needed, reason=reason)
+                waiting = True
+            if on_wait:
+                on_wait(reason)
+            time.sleep(1)
+
+    def _write_reservation(self, path, size):
+        with self.lock:
+            self.reserved[path] = size
+        with open(f'{path}.reserved', 'w') as f:
+            f.write(str(size))
+
+    def release(self, path):
+        """Delete a scratch directory (or claimed work area) and give back what it reserved"""
+        shutil.rmtree(path, ignore_errors=True)
+        with self.lock:
+            self.reserved.pop(path, None)
+            lock = self.claimed.pop(path, None)
+        for suffix in ('.reserved', '.lock') if lock else ('.reserved',):
+            try:
+                os.remove(f'{path}{suffix}')
+            except FileNotFoundError:
+                pass
+        if lock:
+            lock.close()
+
+    def stats(self):
+        with self.lock:
+            reserved = sum(self.reserved.values())
+            directories = len(self.reserved)
+        usage = shutil.disk_usage(self.root)
+        return {
+            'root': self.root,
+            'max_bytes': self.max_bytes,
+            'min_free_bytes': self.min_free_bytes,
+            'reserved_bytes': reserved,
+            'reserved_dirs': directories,
+            'disk_free_bytes': usage.free,
+        }
+
+
+class Slots:
+    """At most ``count`` holders at once across every worker process on this machine.
+
+    Each slot is a lock file under ``directory`` held with flock, so a slot
+    comes free by itself when the process holding it dies. ``count`` 0
+    means unlimited.
+    """
+
+    def __init__(self, directory, name, count, wait_timeout=600, retry_after=30):
+        self.directory = directory
+        self.name = name
+        self.count = count
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.lock = Lock()
+        self.held = 0  # by this process
+        os.makedirs(directory, exist_ok=True)
+
+    def try_acquire(self):
+        """A held slot (pass it to release()), or None if all are taken"""
+        if not self.count:
+            return True
+        for i in range(self.count):
+            f = open(os.path.join(self.directory, f'{self.name}-{i}.lock'), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            with self.lock:
+                self.held += 1
+            return f
+        return None
+
+    def acquire(self, on_wait=None, cancelled=None):
+        """Wait for a slot like ScratchSpace.admit() waits for room. Returns None if cancelled."""
+        deadline = time.monotonic() + self.wait_timeout
+        waiting = False
+        while True:
+            slot = self.try_acquire()
+            if slot is not None:
+                return slot
+            if cancelled and cancelled():
+                return None
+            if time.monotonic() >= deadline:
+                raise Overloaded(f'Timed out waiting for a free {self.name} slot', self.retry_after)
+            if not waiting and on_wait:
+                on_wait()
+            waiting = True
+            time.sleep(0.5)
+
+    def release(self, slot):
+        if slot is True or slot is None:
+            return
+        with self.lock:
+            self.held -= 1
+        slot.close()
+
+    def stats(self):
+        with self.lock:
+            return {'max': self.count, 'held_here': self.held}
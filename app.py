@@ -1,18 +1,146 @@
-from flask import Flask, request, render_template, Response, redirect, jsonify
-import yt_dlp
+from flask import Flask, request, render_template, Response, redirect, jsonify, g
 import tempfile
 import os
+import re
 import uuid
 import time
 import random
 import json
-from threading import Lock
+import copy
+from threading import BoundedSemaphore, Event, Lock, Thread
+from file_stream import send_download, zip_stream
+from result_cache import ResultCache, canonical_video_id, cache_key
+from singleflight import SingleFlight
+from jobs import Job, JobQueue, JobCancelled, QueueFull
+from batch import Batch
+from ttl_cache import TTLCache
+from progress import ProgressStore, TERMINAL_STATUSES
+from state_backend import create_backend, MemoryBackend
+from strategy_scheduler import StrategyScheduler
+from processing import format_selector, format_sort, normalize_mode
+from admission import ScratchSpace, Slots, Overloaded, estimate_size
+from rate_limit import RateLimiter, UpstreamBusy, upstream_host
+from logs import get_logger, bind_context, reset_context, setup_logging, YtDlpLogger
+from metrics import Registry, PhaseTimer, THROUGHPUT_BUCKETS
 
 app = Flask(__name__)
 
-# Global progress tracking
-progress_store = {}
-progress_lock = Lock()
+# Leveled log lines on stdout, tagged with the task they belong to.
+# LOG_FORMAT=json writes one JSON object per line for log shippers.
+setup_logging(os.environ.get('LOG_LEVEL', 'info'), os.environ.get('LOG_FORMAT', 'text'))
+log = get_logger('app')
+ytdlp_logger = YtDlpLogger(get_logger('yt-dlp'))
+
+# Prometheus metrics, served at /metrics. With several workers each one
+# writes its numbers to METRICS_DIR and a scrape adds them all up.
+metrics = Registry(os.environ.get('METRICS_DIR'))
+phase_seconds = metrics.histogram('ytdlp_web_phase_seconds', 'Time spent in each phase of a download attempt',
+                                  ('phase', 'strategy', 'outcome'))
+throughput = metrics.histogram('ytdlp_web_throughput_bytes_per_second', 'Transfer rate of the phases that move bytes',
+                               ('phase',), buckets=THROUGHPUT_BUCKETS)
+bytes_transferred = metrics.counter('ytdlp_web_bytes_total', 'Bytes moved by each phase', ('phase',))
+strategy_attempts = metrics.counter('ytdlp_web_strategy_attempts_total', 'Strategy attempts by outcome and error class',
+                                    ('strategy', 'outcome', 'error_class'))
+jobs_finished = metrics.counter('ytdlp_web_jobs_finished_total', 'Finished jobs by final status', ('status',))
+sse_connections = metrics.gauge('ytdlp_web_sse_connections', 'Open progress event streams')
+
+def phase_timer(strategy=None):
+    """PhaseTimer feeding the phase, throughput and byte metrics"""
+    return PhaseTimer(phase_seconds, throughput, bytes_transferred, strategy=strategy)
+
+@app.before_request
+def bind_request_context():
+    """Tag log lines written while handling a request with the task or batch it is about"""
+    view_args = request.view_args or {}
+    g.log_token = bind_context(task_id=view_args.get('task_id') or request.args.get('task_id'),
+                               batch_id=view_args.get('batch_id'))
+
+@app.teardown_request
+def reset_request_context(exc):
+    token = g.pop('log_token', None)
+    if token is not None:
+        reset_context(token)
+
+# Where progress and job state live. 'memory' is fine for a single process;
+# several gunicorn workers or instances need one they all share, e.g.
+# sqlite:////data/state.db or redis://host:6379/0 (see state_backend.py)
+state_backend = create_backend(os.environ.get('STATE_BACKEND'))
+
+# Global progress tracking. Finished tasks are forgotten after PROGRESS_TTL
+# seconds, ones that stop getting updates after PROGRESS_IDLE_TTL seconds.
+progress_store = ProgressStore(
+    state_backend,
+    ttl=int(os.environ.get('PROGRESS_TTL', 600)),
+    idle_ttl=int(os.environ.get('PROGRESS_IDLE_TTL', 3600)),
+)
+
+# Seconds between SSE heartbeats on an idle progress stream
+SSE_HEARTBEAT = 15
+
+# Each open progress stream holds a connection (and under gthread a request
+# thread) for as long as it runs, so at most SSE_MAX_STREAMS are served at once
+# (0: no limit) and further ones get a 503. gunicorn.conf.py sets it to 90% of
+# WEB_CONNECTIONS for its gevent workers, or half of WEB_THREADS for gthread,
+# which keeps the rest free for downloads and the other endpoints.
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 0))
+sse_slots = BoundedSemaphore(SSE_MAX_STREAMS) if SSE_MAX_STREAMS > 0 else None
+
+# Finished downloads, reused by repeat requests for the same video and settings
+# (CACHE_MAX_BYTES=0 turns the cache off)
+result_cache = ResultCache(
+    os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'yt-dlp-web-cache')),
+    int(os.environ.get('CACHE_MAX_BYTES', 2 * 1024 ** 3)),
+)
+
+# Extracted video metadata, shared by /info and downloads so a video is only
+# extracted once per INFO_CACHE_TTL seconds. Kept well below the few hours
+# YouTube's signed format URLs stay valid for.
+info_cache = TTLCache(ttl=int(os.environ.get('INFO_CACHE_TTL', 300)), max_entries=1024)
+
+# Each download fetches fragments or byte ranges over up to CONNECTIONS_PER_JOB
+# connections at once, and all downloads of every worker together use at most
+# MAX_CONNECTIONS
+CONNECTIONS_PER_JOB = int(os.environ.get('CONNECTIONS_PER_JOB', 4))
+MAX_CONNECTIONS = int(os.environ.get('MAX_CONNECTIONS', 16))
+
+# Extractions and playlist listings take turns per upstream host: on average
+# UPSTREAM_RATE requests per second with bursts of UPSTREAM_BURST, spaced with
+# UPSTREAM_JITTER randomness. 403/429 answers slow a host down (up to
+# UPSTREAM_MAX_SLOWDOWN times, halving again every UPSTREAM_RECOVERY seconds).
+# With a shared STATE_BACKEND all workers take turns together unless
+# UPSTREAM_RATE_SHARED=0.
+upstream_shared = os.environ.get('UPSTREAM_RATE_SHARED', '1' if state_backend.shared else '0').lower() in ('1', 'true', 'yes')
+upstream_limiter = RateLimiter(
+    state_backend if upstream_shared else MemoryBackend(),
+    rate=float(os.environ.get('UPSTREAM_RATE', 2.0)),
+    burst=int(os.environ.get('UPSTREAM_BURST', 4)),
+    jitter=float(os.environ.get('UPSTREAM_JITTER', 0.5)),
+    max_slowdown=float(os.environ.get('UPSTREAM_MAX_SLOWDOWN', 16)),
+    recovery=float(os.environ.get('UPSTREAM_RECOVERY', 60)),
+)
+
+# Downloads work in scratch directories under SCRATCH_DIR. Once its formats
+# are known a download waits until its estimated size fits in SCRATCH_MAX_BYTES
+# (0: no fixed budget) with SCRATCH_MIN_FREE_BYTES still free on the disk, and
+# new requests get a 503 while the disk is that full. Directories left behind
+# by crashed workers are removed at startup. Failed or cancelled downloads
+# keep their partial files for RESUME_TTL seconds, for the next attempt.
+scratch = ScratchSpace(
+    os.environ.get('SCRATCH_DIR', os.path.join(tempfile.gettempdir(), 'yt-dlp-web-scratch')),
+    max_bytes=int(os.environ.get('SCRATCH_MAX_BYTES', 0)),
+    min_free_bytes=int(os.environ.get('SCRATCH_MIN_FREE_BYTES', 512 * 1024 ** 2)),
+    default_estimate=int(os.environ.get('SCRATCH_DEFAULT_ESTIMATE', 256 * 1024 ** 2)),
+    wait_timeout=int(os.environ.get('ADMISSION_TIMEOUT', 600)),
+    keep_ttl=int(os.environ.get('RESUME_TTL', 3600)),
+)
+
+# Downloads and re-encodes that may run at once over every worker process.
+# MAX_DOWNLOADS=0 leaves downloads to DOWNLOAD_WORKERS per process.
+slots_dir = os.path.join(scratch.root, '.slots')
+download_slots = Slots(slots_dir, 'download', int(os.environ.get('MAX_DOWNLOADS', 0)),
+                       wait_timeout=scratch.wait_timeout)
+transcode_slots = Slots(slots_dir, 'transcode', int(os.environ.get('MAX_TRANSCODES', max(1, (os.cpu_count() or 2) // 2))),
+                        wait_timeout=scratch.wait_timeout)
 
 # Anti-detection: User agent rotation pool
 USER_AGENTS = [
@@ -54,399 +182,1451 @@ def index():
 
 @app.route('/progress/<task_id>')
 def get_progress(task_id):
-    """SSE endpoint for real-time progress updates"""
-    def generate():
-        while True:
-            with progress_lock:
-                progress_data = progress_store.get(task_id, {})
-            
-            # Send progress update
-            yield f"data: {json.dumps(progress_data)}\n\n"
-            
-            # Check if complete or error
-            if progress_data.get('status') in ['complete', 'error']:
-                break
-            
-            time.sleep(0.5)  # Update every 500ms
-    
-    return Response(generate(), mimetype='text/event-stream')
+    """SSE endpoint for real-time progress updates.
 
-@app.route('/download')
-def download():
-    video_url = request.args.get('url')
-    download_type = request.args.get('type', 'video')  # Default to video if not specified
-    task_id = request.args.get('task_id')  # Task ID for progress tracking
+    Events are pushed as soon as the task's state changes, each tagged with
+    an ID so a reconnecting EventSource (Last-Event-ID) only gets what it
+    missed. Idle streams get a comment line every SSE_HEARTBEAT seconds to
+    keep proxies from closing them. A task that is still unknown after a
+    heartbeat interval (it never existed or has expired) gets a final error
+    event and the stream ends. Past SSE_MAX_STREAMS open streams the answer
+    is a 503; clients can poll /jobs/<id> instead.
+    """
+    try:
+        last_version = int(request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0)
+    except ValueError:
+        last_version = 0
     
-    if not video_url:
-        return "Missing URL", 400
+    if sse_slots is not None and not sse_slots.acquire(blocking=False):
+        log.warning("🚧 Too many open progress streams", limit=SSE_MAX_STREAMS)
+        response = jsonify({'error': 'Too many open progress streams, poll /jobs/<task_id> instead',
+                            'retry_after': SSE_HEARTBEAT})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(SSE_HEARTBEAT)
+        return response
     
-    if not task_id:
-        task_id = str(uuid.uuid4())
+    def generate():
+        nonlocal last_version
+        sse_connections.inc()
+        try:
+            while True:
+                update = progress_store.wait(task_id, last_version, timeout=SSE_HEARTBEAT)
+                if update is None:
+                    # Streams may open just before their task starts, so give it one interval
+                    if not progress_store.get(task_id):
+                        yield f"data: {json.dumps({'status': 'error', 'message': 'Unknown or expired task'})}\n\n"
+                        break
+                    yield ": heartbeat\n\n"
+                    continue
+                last_version, progress_data = update
+                
+                # Send progress update
+                yield f"id: {last_version}\ndata: {json.dumps(progress_data)}\n\n"
+                
+                # Check if complete or error
+                if progress_data.get('status') in TERMINAL_STATUSES:
+                    break
+        finally:
+            sse_connections.dec()
+    
+    response = Response(generate(), mimetype='text/event-stream',
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if sse_slots is not None:
+        # Also runs when the client goes away before the stream has started
+        response.call_on_close(sse_slots.release)
+    return response
 
-    # Initialize progress
-    with progress_lock:
-        progress_store[task_id] = {
-            'status': 'starting',
-            'message': 'Initializing download...',
-            'progress': 0
+# Multiple strategies to bypass 403 errors
+STRATEGIES = [
+    # Strategy 1: Android client (most reliable)
+    {
+        'name': 'Android Client',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android'],
+                'skip': ['hls', 'dash'],
+            }
         }
+    },
+    # Strategy 2: iOS client
+    {
+        'name': 'iOS Client',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['ios'],
+                'skip': ['hls', 'dash'],
+            }
+        }
+    },
+    # Strategy 3: Web with tv_embedded
+    {
+        'name': 'TV Embedded',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['tv_embedded'],
+            }
+        }
+    },
+    # Strategy 4: Multiple clients fallback
+    {
+        'name': 'Multi-Client Fallback',
+        'extractor_args': {
+            'youtube': {
+                'player_client': ['android', 'ios', 'web'],
+            }
+        }
+    },
+]
+
+# Learns which strategy currently works and tries that one first
+strategy_scheduler = StrategyScheduler(STRATEGIES)
+
+# Options that decide what the output file looks like, and so are part of the cache key
+CACHE_SETTINGS = ('format', 'merge_output_format', 'postprocessors')
+
+# Concurrent requests for the same video share one download
+download_flights = SingleFlight()
+
+# Processing mode used when a request doesn't ask for one: 'compatible'
+# (H.264/AAC MP4 and MP3, re-encoding where needed) or 'fast' (stream copy)
+DEFAULT_MODE = normalize_mode(os.environ.get('PROCESSING_MODE'))
+
+def get_format_opts(download_type, mode=DEFAULT_MODE):
+    """yt-dlp options for the requested download type, minus per-download paths and hooks.
+
+    Converting to the final container is left to ProcessingPP, which has to
+    be added to each YoutubeDL instance.
+    """
+    if download_type == 'audio':
+        # Audio-only download with best quality
+        return {
+            'format': format_selector(download_type, mode),  # Best audio, preferring what the mode can copy
+            'quiet': True,
+            'no_warnings': True,
+            'writeinfojson': False,
+            'writesubtitles': False,
+            'writeautomaticsub': False,
+            'retries': 10,
+            'fragment_retries': 10,
+            'socket_timeout': 30,
+            'http_chunk_size': 10485760,
+            'prefer_ffmpeg': True,
+            'postprocessors': [{
+                'key': 'FFmpegMetadata',
+            }],
+            'extract_flat': False,
+            'ignoreerrors': False,
+        }
+    # Video download with highest quality
+    return {
+        'format': format_selector(download_type, mode),  # Best quality, preferring codecs the mode can copy
+        'format_sort': format_sort(download_type, mode),  # Highest resolution first, then codecs compatible mode can copy
+        'merge_output_format': 'mp4/mkv',  # Merge into mp4 when the codecs allow, ProcessingPP takes it from there
+        'quiet': True,  # Reduce console output for faster processing
+        'no_warnings': True,  # Suppress warnings
+        'writeinfojson': False,  # Don't write info files
+        'writesubtitles': False,  # Don't download subtitles
+        'writeautomaticsub': False,  # No auto subtitles
+        'retries': 10,  # More retries for failed downloads
+        'fragment_retries': 10,  # More retries for failed fragments
+        'socket_timeout': 30,  # Timeout for socket operations
+        'http_chunk_size': 10485760,  # 10MB chunks for stable download
+        'prefer_ffmpeg': True,  # Use ffmpeg for merging
+        'postprocessors': [{
+            'key': 'FFmpegMetadata',
+        }],
+        'extract_flat': False,  # Get full video info for best quality selection
+        'ignoreerrors': False,  # Don't ignore errors - we want best quality
+        'embed_subs': False,  # Don't embed subtitles to keep file size optimal
+    }
+
+def output_settings(download_type, mode):
+    """The settings that decide what the output file looks like, for cache keys"""
+    opts = get_format_opts(download_type, mode)
+    return {**{k: opts.get(k) for k in CACHE_SETTINGS}, 'mode': mode}
+
+# Options a request sets on a pooled YoutubeDL; everything else in
+# get_format_opts() is the same for every download
+REQUEST_OPTS = ('format', 'format_sort', 'merge_output_format')
+
+def request_opts(download_type, mode):
+    """Per-request options for YoutubeDLPool.acquire(). None unsets an option (audio has no merge format)."""
+    opts = get_format_opts(download_type, mode)
+    return {name: opts.get(name) for name in REQUEST_OPTS}
+
+def create_ydl(strategy_name):
+    """A new pooled YoutubeDL for a strategy: its client, fresh anti-detection headers and the shared options"""
+    from ydl_pool import PooledYoutubeDL
+    strategy = next(s for s in STRATEGIES if s['name'] == strategy_name)
+    opts = {name: value for name, value in get_format_opts('video').items() if name not in REQUEST_OPTS}
+    opts.update(get_anti_detection_opts())
+    opts['extractor_args'] = strategy['extractor_args']
+    opts['logger'] = ytdlp_logger
+    return PooledYoutubeDL(opts, limiter=connection_limiter, connections=CONNECTIONS_PER_JOB)
+
+# Warm YoutubeDL instances per strategy, kept between requests so extractors,
+# player code and keep-alive connections are reused (see ydl_pool.py). Up to
+# YDL_POOL_SIZE idle instances per strategy. yt-dlp is only imported once the
+# pool is first needed, so a fresh worker answers /healthz straight away.
+YDL_POOL_SIZE = int(os.environ.get('YDL_POOL_SIZE', 4))
+ydl_pool = None
+connection_limiter = None
+ydl_pool_lock = Lock()
+pool_warm = Event()
+
+def get_ydl_pool():
+    """The YoutubeDL pool, created (and yt-dlp imported) on first use"""
+    global ydl_pool, connection_limiter
+    with ydl_pool_lock:
+        if ydl_pool is None:
+            # Every module using yt-dlp is loaded here, by one thread: importing
+            # yt-dlp from several threads at once trips over its circular imports
+            import live_stream, postprocessors  # noqa: F401
+            from range_download import ConnectionLimiter
+            from ydl_pool import YoutubeDLPool
+            connection_limiter = ConnectionLimiter(slots_dir, MAX_CONNECTIONS)
+            ydl_pool = YoutubeDLPool(create_ydl, max_idle=YDL_POOL_SIZE)
+        return ydl_pool
+
+def warm_up():
+    """Load yt-dlp and build a YoutubeDL per strategy before the first download needs one"""
+    started = time.monotonic()
+    try:
+        pool = get_ydl_pool()
+        pool.warm([strategy['name'] for strategy in strategy_scheduler.order()], ie_keys=('Youtube',))
+        log.info("🔥 Ready", duration_ms=round((time.monotonic() - started) * 1000, 1))
+    except Exception as e:
+        log.warning("⚠️ Warm-up failed", error=str(e))
+    pool_warm.set()
 
-    # Clean URL - remove duplicates
+metrics.gauge('ytdlp_web_ydl_pool', 'Pooled YoutubeDL instances by state', ('state',),
+              collect=lambda: {('idle',): sum(ydl_pool.stats()['idle'].values()) if ydl_pool else 0,
+                               ('in_use',): ydl_pool.stats()['in_use'] if ydl_pool else 0})
+metrics.gauge('ytdlp_web_scratch_reserved_bytes', 'Scratch space reserved by running downloads',
+              collect=lambda: {(): scratch.stats()['reserved_bytes']})
+
+Thread(target=warm_up, name='ydl-warmup', daemon=True).start()
+
+def clean_url(video_url):
+    """Clean URL - remove duplicates"""
     if 'https://youtu.be/' in video_url:
         # Extract just the first video ID
         video_id = video_url.split('youtu.be/')[1].split('?')[0].split('&')[0]
         video_url = f'https://www.youtube.com/watch?v={video_id}'
+    return video_url
+
+def make_filename(title, ext, download_type):
+    """Clean filename for download"""
+    safe_title = "".join(c for c in (title or '') if c.isalnum() or c in (' ', '-', '_')).strip()
+    return f"{safe_title}{ext}" if safe_title else f"{download_type}_{uuid.uuid4().hex[:8]}{ext}"
+
+def get_mimetype(download_type, file_ext):
+    """Pick the MIME type for a finished file from its extension"""
+    if download_type == 'audio':
+        if file_ext == '.mp3':
+            return 'audio/mpeg'
+        elif file_ext == '.m4a':
+            return 'audio/mp4'
+        elif file_ext == '.aac':
+            return 'audio/aac'
+        elif file_ext == '.ogg':
+            return 'audio/ogg'
+        elif file_ext == '.wav':
+            return 'audio/wav'
+        elif file_ext == '.opus':
+            return 'audio/opus'
+        elif file_ext == '.flac':
+            return 'audio/flac'
+        return 'audio/mpeg'  # Default to MP3
+    if file_ext == '.webm':
+        return 'video/webm'
+    elif file_ext == '.mkv':
+        return 'video/x-matroska'
+    elif file_ext == '.avi':
+        return 'video/x-msvideo'
+    return 'video/mp4'
+
+def info_cache_key(video_url):
+    """Key for info_cache: the video ID where we can tell it from the URL, else the URL itself"""
+    return canonical_video_id(video_url) or ('url', video_url)
+
+def extract_info(ydl, video_url, strategy, timer, on_wait=None, cancelled=None, wait=True):
+    """Extract video info with a strategy, reusing a recent extraction by the same strategy.
+
+    Format URLs are tied to the player client that fetched them, so cached
+    info is only reused by the strategy that produced it. The info is the
+    extractor's raw result, before any format selection, so every request
+    picks formats for its own type and mode by passing it to
+    ``ydl.process_ie_result``. Returns a copy the caller is free to hand to
+    yt-dlp, and how long the extraction took (None when cached info was
+    reused). The wait for a turn upstream (see RateLimiter.acquire for
+    ``on_wait`` and ``cancelled``) and the extraction are timed as phases of
+    ``timer``. Request threads pass ``wait=False`` to get UpstreamBusy
+    instead of a wait when the host has no turn free.
+    """
+    key = info_cache_key(video_url)
+    cached = info_cache.get(key)
+    if cached and cached['strategy'] == strategy['name']:
+        log.info("♻️ Reusing extracted info", strategy=strategy['name'])
+        return copy.deepcopy(cached['info']), None
     
-    print(f"🔍 Cleaned URL: {video_url}")
+    # Take our turn with the upstream host
+    timer.enter('throttle')
+    host = upstream_host(video_url)
+    if not wait:
+        upstream_limiter.try_acquire(host)
+    elif upstream_limiter.acquire(host, on_wait=on_wait, cancelled=cancelled) is None:
+        raise JobCancelled('Download cancelled')
     
-    with progress_lock:
-        progress_store[task_id] = {
-            'status': 'processing',
-            'message': 'Analyzing video...',
-            'progress': 5
-        }
+    timer.enter('extract')
+    info = ydl.extract_info(video_url, download=False, process=False)
+    elapsed = timer.end()
+    info_cache.set(key, {'info': copy.deepcopy(info), 'strategy': strategy['name']})
+    return info, elapsed
 
-    # Multiple strategies to bypass 403 errors
-    strategies = [
-        # Strategy 1: Android client (most reliable)
-        {
-            'name': 'Android Client',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android'],
-                    'skip': ['hls', 'dash'],
-                }
-            }
-        },
-        # Strategy 2: iOS client
-        {
-            'name': 'iOS Client',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['ios'],
-                    'skip': ['hls', 'dash'],
-                }
-            }
-        },
-        # Strategy 3: Web with tv_embedded
-        {
-            'name': 'TV Embedded',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['tv_embedded'],
-                }
-            }
-        },
-        # Strategy 4: Multiple clients fallback
-        {
-            'name': 'Multi-Client Fallback',
-            'extractor_args': {
-                'youtube': {
-                    'player_client': ['android', 'ios', 'web'],
-                }
-            }
-        },
-    ]
+def summarize_info(info):
+    """The parts of an info dict the UI needs to offer download choices"""
+    formats = []
+    for f in info.get('formats') or []:
+        # Storyboards and other image "formats" aren't downloadable media
+        if f.get('vcodec') == 'none' and f.get('acodec') == 'none':
+            continue
+        formats.append({
+            'format_id': f.get('format_id'),
+            'ext': f.get('ext'),
+            'vcodec': f.get('vcodec'),
+            'acodec': f.get('acodec'),
+            'width': f.get('width'),
+            'height': f.get('height'),
+            'fps': f.get('fps'),
+            'abr': f.get('abr'),
+            'tbr': f.get('tbr'),
+            'filesize': f.get('filesize') or f.get('filesize_approx'),
+            'protocol': f.get('protocol'),
+            'format_note': f.get('format_note'),
+        })
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'duration': info.get('duration'),
+        # Unprocessed info only has the list of thumbnails, best last
+        'thumbnail': info.get('thumbnail') or ((info.get('thumbnails') or [{}])[-1]).get('url'),
+        'uploader': info.get('uploader'),
+        'webpage_url': info.get('webpage_url'),
+        'formats': formats,
+    }
+
+def claim_work_area(info, download_type, mode):
+    """Work area for downloading a video as a type and mode, with any partial files an earlier attempt kept.
+
+    Falls back to a fresh scratch directory when the video has no ID or
+    another worker is downloading it right now.
+    """
+    if info.get('id'):
+        name = f"{info.get('extractor_key') or info.get('extractor')}-{info['id']}-{download_type}-{mode}"
+        path = scratch.claim(re.sub(r'[^\w.-]', '_', name))
+        if path:
+            leftovers = os.listdir(path)
+            if leftovers:
+                log.info("⏯️ Resuming an earlier attempt", files=len(leftovers))
+            return path
+    return scratch.create()
+
+def record_attempt(strategy, success, latency=None, error=None, url=None):
+    """Tell the scheduler and the metrics how a strategy attempt went. Returns the error class.
+
+    A 403 or 429 also slows down further requests to the host of ``url``.
+    """
+    error_class = strategy_scheduler.record(strategy['name'], success, latency=latency, error=error)
+    strategy_attempts.inc(strategy=strategy['name'], outcome='success' if success else 'failure',
+                          error_class=error_class or 'none')
+    if url and error_class in ('forbidden', 'rate_limited'):
+        upstream_limiter.penalize(upstream_host(url))
+    return error_class
+
+def report(flight, status, message, progress):
+    """Record a progress update for every task attached to a download"""
+    for task_id in list(flight.task_ids):
+        progress_store.set(task_id, status, message, progress)
+
+def run_strategies(video_url, download_type, mode, key, flight):
+    """Download a video, trying each strategy until one works.
+
+    Returns a dict with the finished file's path, filename, mimetype and the
+    processing path that produced it (direct, remux or transcode), plus a
+    ``cleanup`` callable that removes the scratch directory or unpins the
+    result cache entry holding it. Raises when every strategy has failed.
+    """
+    get_ydl_pool()  # Loads yt-dlp, see there
+    from yt_dlp.utils import DownloadCancelled
+    from postprocessors import BeforeDownloadPP, ProcessingPP
+    from range_download import ProgressTally
+
+    # Scratch directory for this download, picked once the video is known
+    # (see claim_work_area). It is removed once the last response using it
+    # has closed, and kept for the next attempt if every strategy fails or
+    # the download is cancelled.
+    work_dir = None
+
+    def cleanup():
+        if work_dir:
+            scratch.release(work_dir)
 
     try:
-        # Create temporary directory for download
-        with tempfile.TemporaryDirectory() as temp_dir:
-            
-            # Progress tracking
-            download_complete = False
-            
-            def progress_hook(d):
-                nonlocal download_complete
-                if d['status'] == 'finished':
-                    download_complete = True
-                    with progress_lock:
-                        progress_store[task_id] = {
-                            'status': 'processing',
-                            'message': 'Converting file...',
-                            'progress': 90
-                        }
-                elif d['status'] == 'downloading':
-                    if 'total_bytes' in d and 'downloaded_bytes' in d:
-                        percent = (d['downloaded_bytes'] / d['total_bytes']) * 100
-                        
-                        # Update progress store
-                        with progress_lock:
-                            progress_store[task_id] = {
-                                'status': 'downloading',
-                                'message': f'Downloading from YouTube... {percent:.0f}%',
-                                'progress': 10 + (percent * 0.75)  # 10% to 85%
-                            }
-                        
-                        # Only show progress every 10% to reduce console spam
-                        if percent % 10 < 1:
-                            download_indicator = "🎵" if download_type == 'audio' else "📥"
-                            print(f"{download_indicator} Downloading: {percent:.0f}%")
-            
-            # Get anti-detection options
-            anti_detection = get_anti_detection_opts()
-            
-            # Configure options based on download type
-            if download_type == 'audio':
-                # Audio-only download with best quality
-                base_opts = {
-                    'format': 'bestaudio/best',  # Get best audio quality
-                    'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                    'quiet': True,
-                    'no_warnings': True,
-                    'writeinfojson': False,
-                    'writesubtitles': False,
-                    'writeautomaticsub': False,
-                    'retries': 10,
-                    'fragment_retries': 10,
-                    'socket_timeout': 30,
-                    'http_chunk_size': 10485760,
-                    'progress_hooks': [progress_hook],
-                    'prefer_ffmpeg': True,
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '320',  # Best MP3 quality
-                    }, {
-                        'key': 'FFmpegMetadata',
-                    }],
-                    'extract_flat': False,
-                    'ignoreerrors': False,
-                }
+        # Progress tracking
+        download_complete = False
+        tally = None
+        timer = None
+        
+        def progress_hook(d):
+            nonlocal download_complete
+            # Stop yt-dlp mid-download once nobody wants the file any more
+            if flight.cancelled:
+                raise DownloadCancelled()
+            if d['status'] == 'finished':
+                download_complete = True
+                # A merged download has more parts to fetch after the first one finishes
+                fraction = tally.update(d)
+                if fraction is None or fraction >= 1:
+                    report(flight, 'processing', 'Converting file...', 90)
+            elif d['status'] == 'downloading':
+                # Combined over every part of a merged download
+                fraction = tally.update(d)
+                if fraction is not None:
+                    percent = fraction * 100
+                    
+                    # Update progress store
+                    report(flight, 'downloading', f'Downloading from YouTube... {percent:.0f}%',
+                           10 + (percent * 0.75))  # 10% to 85%
+                    
+                    # Only show progress every 10% to reduce console spam
+                    if percent % 10 < 1:
+                        download_indicator = "🎵" if download_type == 'audio' else "📥"
+                        log.info(f"{download_indicator} Downloading", percent=round(percent))
+        
+        def postprocessor_hook(d):
+            # The first postprocessor to start after the download (merger, remux, ...) ends the download phase
+            if d['status'] == 'started' and download_complete and timer.phase == 'download':
+                timer.add(bytes=tally.downloaded())
+                timer.enter('postprocess')
+        
+        download_slot = None
+        
+        def admit(info):
+            # Formats are picked: wait until there is disk space and a download slot for them
+            nonlocal download_slot
+            timer.enter('admit')
+            estimate = estimate_size(info, scratch.default_estimate)
+            reserved = scratch.admit(work_dir, estimate, cancelled=lambda: flight.cancelled,
+                                     on_wait=lambda reason: report(flight, 'queued', f'Waiting for disk space ({reason})...', 8))
+            if reserved is not None:
+                download_slot = download_slots.acquire(cancelled=lambda: flight.cancelled,
+                                                       on_wait=lambda: report(flight, 'queued', 'Waiting for a free download slot...', 8))
+            if reserved is None or download_slot is None:
+                raise DownloadCancelled()
+            timer.enter('download', reserved_bytes=reserved)
+        
+        def upstream_waiting(seconds):
+            report(flight, 'queued', f'Waiting for our turn with the site... {seconds:.0f}s', 5)
+        
+        def transcode_waiting():
+            report(flight, 'processing', 'Waiting for a free encoder...', 91)
+        
+        def processing_started(path):
+            if path == 'transcode':
+                report(flight, 'processing', 'Re-encoding file...', 92)
             else:
-                # Video download with highest quality
-                base_opts = {
-                    'format': 'bestvideo*+bestaudio/best',  # Get absolute best quality regardless of format/codec
-                    'merge_output_format': 'mp4',  # Convert to mp4 for compatibility
-                    'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),  # Save to temp directory
-                    'quiet': True,  # Reduce console output for faster processing
-                    'no_warnings': True,  # Suppress warnings
-                    'writeinfojson': False,  # Don't write info files
-                    'writesubtitles': False,  # Don't download subtitles
-                    'writeautomaticsub': False,  # No auto subtitles
-                    'retries': 10,  # More retries for failed downloads
-                    'fragment_retries': 10,  # More retries for failed fragments
-                    'socket_timeout': 30,  # Timeout for socket operations
-                    'http_chunk_size': 10485760,  # 10MB chunks for stable download
-                    'progress_hooks': [progress_hook],  # Monitor download progress
-                    'prefer_ffmpeg': True,  # Use ffmpeg for merging
-                    'postprocessors': [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': 'mp4',
-                    }, {
-                        'key': 'FFmpegMetadata',
-                    }],  # Convert VP9/AV1/WebM/MKV/TS to MP4 for compatibility while preserving quality
-                    'extract_flat': False,  # Get full video info for best quality selection
-                    'ignoreerrors': False,  # Don't ignore errors - we want best quality
-                    'embed_subs': False,  # Don't embed subtitles to keep file size optimal
-                }
-            
-            # Try each strategy until one works
-            last_error = None
-            for strategy in strategies:
-                try:
-                    print(f"🔄 Trying strategy: {strategy['name']}")
+                report(flight, 'processing', 'Copying streams into the new container...', 92)
+        
+        # Configure options based on download type
+        request_options = request_opts(download_type, mode)
+        request_options['progress_hooks'] = [progress_hook]  # Monitor download progress
+        request_options['postprocessor_hooks'] = [postprocessor_hook]
+        request_options['cancelled'] = lambda: flight.cancelled  # Stops waiting for a connection
+        cache_settings = output_settings(download_type, mode)
+        
+        # Try each strategy until one works, best performing first
+        last_error = None
+        for strategy in strategy_scheduler.order():
+            if flight.cancelled:
+                raise JobCancelled('Download cancelled')
+            started = time.monotonic()
+            extract_time = None
+            timer = phase_timer(strategy['name'])
+            try:
+                log.info("🔄 Trying strategy", strategy=strategy['name'])
+                
+                # A warm instance of this strategy, with this download's options on top
+                tally = ProgressTally()
+                with get_ydl_pool().acquire(strategy['name'], **request_options) as ydl:
+                    tally.attach(ydl)
+                    ydl.add_post_processor(BeforeDownloadPP(admit), when='before_dl')
                     
-                    # Merge base options with anti-detection and strategy-specific options
-                    ydl_opts = {**base_opts, **anti_detection}
-                    ydl_opts['extractor_args'] = strategy['extractor_args']
+                    # Remux or transcode into the final format, whichever the codecs need
+                    processing = ProcessingPP(ydl, download_type, mode, on_start=processing_started,
+                                              transcodes=transcode_slots, on_wait=transcode_waiting,
+                                              cancelled=lambda: flight.cancelled)
+                    ydl.add_post_processor(processing)
                     
-                    # Add small delay to avoid rate limiting
-                    time.sleep(random.uniform(1.0, 2.5))
+                    # First, extract info to see available formats
+                    type_indicator = "🎵" if download_type == 'audio' else "🎬"
+                    log.info(f"{type_indicator} Processing", url=video_url)
+                    info, extract_time = extract_info(ydl, video_url, strategy, timer, on_wait=upstream_waiting,
+                                                      cancelled=lambda: flight.cancelled)
+                    title = info.get('title', 'video')
                     
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        # First, extract info to see available formats
-                        type_indicator = "🎵" if download_type == 'audio' else "🎬"
-                        print(f"{type_indicator} Processing: {video_url}")
-                        info = ydl.extract_info(video_url, download=False)
-                        title = info.get('title', 'video')
-                        
-                        # Show selected format only
-                        quality_text = "maximum audio quality" if download_type == 'audio' else "maximum video quality"
-                        print(f"🎯 Downloading {quality_text}...")
-                        
-                        # Now download
-                        info = ydl.extract_info(video_url, download=True)
-                        
-                        # Wait for completion
-                        time.sleep(1.0)
-                        
-                        # Ensure download is actually complete by checking multiple times
-                        for attempt in range(2):
-                            if download_complete:
+                    # Other sites only tell us the video ID after extraction
+                    if key is None and info.get('id'):
+                        key = cache_key(info.get('extractor_key', info.get('extractor', '')), info['id'],
+                                        download_type, cache_settings)
+                        entry = result_cache.get(key, pin=True)
+                        if entry:
+                            cleanup()
+                            return {**entry, 'cache': 'HIT', 'cleanup': lambda: result_cache.unpin(key)}
+                    
+                    # Files are named by video and format, so an attempt picks up the parts
+                    # an earlier one left in the same work area instead of starting over
+                    if work_dir is None:
+                        work_dir = claim_work_area(info, download_type, mode)
+                    ydl.params['outtmpl'] = {**ydl.params['outtmpl'],
+                                             'default': os.path.join(work_dir, '%(id)s.%(format_id)s.%(ext)s')}
+                    
+                    # Show selected format only
+                    quality_text = "maximum audio quality" if download_type == 'audio' else "maximum video quality"
+                    log.info(f"🎯 Downloading {quality_text}...")
+                    
+                    # Now download, reusing the info we already have instead of extracting again
+                    timer.enter('download')
+                    try:
+                        info = ydl.process_ie_result(info, download=True)
+                    finally:
+                        download_slots.release(download_slot)
+                        download_slot = None
+                    if timer.phase == 'download':
+                        timer.add(bytes=tally.downloaded())
+                    timer.end()
+                    
+                    # ProcessingPP knows where the file ended up, otherwise look for appropriate file extensions
+                    downloaded_file = processing.filepath
+                    if downloaded_file and not os.path.exists(downloaded_file):
+                        downloaded_file = None
+                    if not downloaded_file and download_type == 'audio':
+                        audio_extensions = ['.mp3', '.m4a', '.aac', '.ogg', '.opus', '.flac', '.wav']
+                        for file in os.listdir(work_dir):
+                            for ext in audio_extensions:
+                                if file.endswith(ext):
+                                    downloaded_file = os.path.join(work_dir, file)
+                                    break
+                            if downloaded_file:
+                                break
+                    elif not downloaded_file:
+                        video_extensions = ['.mp4', '.mkv', '.webm', '.avi']
+                        # First, try to find an mp4 file
+                        for file in os.listdir(work_dir):
+                            if file.endswith('.mp4'):
+                                downloaded_file = os.path.join(work_dir, file)
                                 break
-                            time.sleep(0.5)
                         
-                        # Find the downloaded file - look for appropriate file extensions
-                        downloaded_file = None
-                        if download_type == 'audio':
-                            audio_extensions = ['.mp3', '.m4a', '.aac', '.ogg', '.wav']
-                            for file in os.listdir(temp_dir):
-                                for ext in audio_extensions:
+                        # If no mp4, look for other video formats
+                        if not downloaded_file:
+                            for file in os.listdir(work_dir):
+                                for ext in video_extensions:
                                     if file.endswith(ext):
-                                        downloaded_file = os.path.join(temp_dir, file)
+                                        downloaded_file = os.path.join(work_dir, file)
                                         break
                                 if downloaded_file:
                                     break
-                        else:
-                            video_extensions = ['.mp4', '.mkv', '.webm', '.avi']
-                            # First, try to find an mp4 file
-                            for file in os.listdir(temp_dir):
-                                if file.endswith('.mp4'):
-                                    downloaded_file = os.path.join(temp_dir, file)
-                                    break
-                            
-                            # If no mp4, look for other video formats
-                            if not downloaded_file:
-                                for file in os.listdir(temp_dir):
-                                    for ext in video_extensions:
-                                        if file.endswith(ext):
-                                            downloaded_file = os.path.join(temp_dir, file)
-                                            break
-                                    if downloaded_file:
-                                        break
-                        
-                        if not downloaded_file or not os.path.exists(downloaded_file):
-                            raise Exception(f"{download_type.title()} download failed - no file found")
-                        
-                        # Verify file is complete and not corrupted
-                        file_size = os.path.getsize(downloaded_file)
-                        min_size = 50000 if download_type == 'audio' else 100000  # Different size thresholds
-                        if file_size < min_size:
-                            raise Exception(f"Download failed - file too small ({file_size:,} bytes), likely corrupted")
-                        
-                        # Basic file verification
-                        try:
-                            with open(downloaded_file, 'rb') as f:
-                                f.seek(0, 2)  # Seek to end
-                                actual_size = f.tell()
-                                if actual_size != file_size:
-                                    raise Exception("Download failed - file size mismatch")
-                        except Exception as e:
-                            raise Exception(f"Download failed - file verification error: {e}")
-                        
-                        success_indicator = "🎵" if download_type == 'audio' else "✅"
-                        print(f"✅ {strategy['name']} succeeded! Download complete: {file_size:,} bytes")
-                        
-                        # Read the entire file into memory before temp directory is cleaned up
-                        try:
-                            with open(downloaded_file, 'rb') as f:
-                                file_data = f.read()
-                        except Exception as e:
-                            raise Exception(f"Error reading file: {str(e)}")
-                        
-                        # Clean filename for download - preserve original extension
-                        safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-                        original_ext = os.path.splitext(downloaded_file)[1] or ('.mp3' if download_type == 'audio' else '.mp4')
-                        filename = f"{safe_title}{original_ext}" if safe_title else f"{download_type}_{uuid.uuid4().hex[:8]}{original_ext}"
-                        
-                        # Set proper MIME type based on file type and extension
-                        file_ext = os.path.splitext(downloaded_file)[1].lower()
-                        if download_type == 'audio':
-                            if file_ext == '.mp3':
-                                mimetype = 'audio/mpeg'
-                            elif file_ext == '.m4a':
-                                mimetype = 'audio/mp4'
-                            elif file_ext == '.aac':
-                                mimetype = 'audio/aac'
-                            elif file_ext == '.ogg':
-                                mimetype = 'audio/ogg'
-                            elif file_ext == '.wav':
-                                mimetype = 'audio/wav'
-                            else:
-                                mimetype = 'audio/mpeg'  # Default to MP3
-                        else:
-                            if file_ext == '.webm':
-                                mimetype = 'video/webm'
-                            elif file_ext == '.mkv':
-                                mimetype = 'video/x-matroska'
-                            elif file_ext == '.avi':
-                                mimetype = 'video/x-msvideo'
-                            else:
-                                mimetype = 'video/mp4'
-                        
-                        stream_indicator = "🎵" if download_type == 'audio' else "📡"
-                        print(f"{stream_indicator} Streaming: {len(file_data):,} bytes")
-                        
-                        # Mark as ready to stream
-                        with progress_lock:
-                            progress_store[task_id] = {
-                                'status': 'complete',
-                                'message': 'Download ready!',
-                                'progress': 100
-                            }
-                        
-                        # Stream the file data from memory
-                        def generate():
-                            try:
-                                # Stream in chunks from memory
-                                chunk_size = 64 * 1024  # 64KB chunks
-                                bytes_sent = 0
-                                total_size = len(file_data)
-                                for i in range(0, total_size, chunk_size):
-                                    chunk = file_data[i:i + chunk_size]
-                                    bytes_sent += len(chunk)
-                                    yield chunk
-                            except Exception as e:
-                                print(f"❌ Streaming error: {e}")
-                                raise
-                        
-                        return Response(
-                            generate(),
-                            mimetype=mimetype,
-                            headers={
-                                "Content-Disposition": f"attachment; filename=\"{filename}\"",
-                                "Content-Type": mimetype,
-                                "Content-Length": str(len(file_data)),
-                                "Accept-Ranges": "bytes",
-                                "Cache-Control": "no-cache, no-store, must-revalidate",
-                                "Pragma": "no-cache",
-                                "Expires": "0"
-                            }
-                        )
                     
-                except Exception as e:
-                    last_error = str(e)
-                    print(f"❌ {strategy['name']} failed: {last_error}")
+                    if not downloaded_file or not os.path.exists(downloaded_file):
+                        raise Exception(f"{download_type.title()} download failed - no file found")
+                    
+                    # Verify file is complete and not corrupted
+                    file_size = os.path.getsize(downloaded_file)
+                    min_size = 50000 if download_type == 'audio' else 100000  # Different size thresholds
+                    if file_size < min_size:
+                        # Not something a later attempt should pick up
+                        os.remove(downloaded_file)
+                        raise Exception(f"Download failed - file too small ({file_size:,} bytes), likely corrupted")
                     
-                    # Update progress with error for this strategy
-                    with progress_lock:
-                        progress_store[task_id] = {
-                            'status': 'retrying',
-                            'message': f'{strategy["name"]} failed, trying next...',
-                            'progress': 5
-                        }
+                    # Basic file verification
+                    try:
+                        with open(downloaded_file, 'rb') as f:
+                            f.seek(0, 2)  # Seek to end
+                            actual_size = f.tell()
+                            if actual_size != file_size:
+                                raise Exception("Download failed - file size mismatch")
+                    except Exception as e:
+                        raise Exception(f"Download failed - file verification error: {e}")
                     
-                    # If this is a 403 error, continue to next strategy
-                    if '403' in last_error or 'Forbidden' in last_error:
-                        print(f"⚠️ 403 Forbidden detected, trying next strategy...")
-                        continue
-                    # If it's another error, also try next strategy
+                    log.info(f"✅ {strategy['name']} succeeded! Download complete", size=file_size,
+                             processing=processing.path or 'direct')
+                    record_attempt(strategy, True, latency=extract_time)
+                    
+                    # Clean filename for download - preserve original extension
+                    original_ext = os.path.splitext(downloaded_file)[1] or ('.mp3' if download_type == 'audio' else '.mp4')
+                    filename = make_filename(title, original_ext, download_type)
+                    
+                    # Set proper MIME type based on file type and extension
+                    mimetype = get_mimetype(download_type, os.path.splitext(downloaded_file)[1].lower())
+                    
+                    # Keep a copy for repeat requests. If it fits in the cache we serve
+                    # from there and drop the scratch directory right away; the entry
+                    # is pinned until every job sharing it has been released.
+                    entry = None
+                    if key:
+                        try:
+                            entry = result_cache.publish(key, downloaded_file, filename, mimetype,
+                                                         extra={'processing': processing.path or 'direct'}, pin=True)
+                        except Exception as e:
+                            log.warning("⚠️ Could not cache download", error=str(e))
+                    if entry:
+                        cleanup()
+                        return {**entry, 'cache': 'MISS', 'cleanup': lambda: result_cache.unpin(key)}
+                    
+                    return {
+                        'path': downloaded_file,
+                        'filename': filename,
+                        'mimetype': mimetype,
+                        'size': file_size,
+                        'processing': processing.path or 'direct',
+                        'cache': 'MISS',
+                        'cleanup': cleanup,
+                    }
+                
+            except Exception as e:
+                if flight.cancelled or isinstance(e, (JobCancelled, DownloadCancelled)):
+                    timer.end('cancelled')
+                    raise JobCancelled('Download cancelled')
+                if isinstance(e, Overloaded):
+                    # The server is out of room, another strategy won't change that
+                    timer.end('error')
+                    raise
+                timer.end('error')
+                last_error = str(e)
+                log.warning(f"❌ {strategy['name']} failed", strategy=strategy['name'], error=last_error)
+                error_class = record_attempt(strategy, False,
+                                             latency=extract_time or time.monotonic() - started,
+                                             error=last_error, url=video_url)
+                
+                # Update progress with error for this strategy
+                report(flight, 'retrying', f'{strategy["name"]} failed, trying next...', 5)
+                
+                # If this is a 403 error, continue to next strategy
+                if error_class == 'forbidden':
+                    log.warning("⚠️ 403 Forbidden detected, trying next strategy...")
                     continue
+                # If it's another error, also try next strategy
+                continue
+        
+        # If all strategies failed
+        raise Exception(f"All download strategies failed. Last error: {last_error}")
+    
+    except Exception:
+        # Whatever got downloaded waits for the next attempt at this video
+        if work_dir:
+            scratch.keep(work_dir)
+        raise
+
+def process_job(job):
+    """Worker entry point: serve from the cache, join an identical download or run the strategies.
+
+    Returns the finished file and the callable that releases this job's
+    hold on it.
+    """
+    task_id = job.task_id
+    video_url = job.url
+    download_type = job.download_type
+    mode = normalize_mode(job.params.get('mode'), DEFAULT_MODE)
+    publish_job(job)
+
+    video_url = clean_url(video_url)
+    log.info("🔍 Cleaned URL", url=video_url)
+    
+    # The file may have been cached while the job waited in the queue
+    key, flight_key = job_keys(video_url, download_type, mode)
+    cached = cached_result(key)
+    if cached:
+        progress_store.set(task_id, 'complete', 'Download ready!', 100)
+        return cached
+    
+    # The first request for a video does the work. Identical ones arriving
+    # meanwhile usually follow it without a worker (see follow_download),
+    # those that were already queued wait for it here.
+    flight, leader = download_flights.join(flight_key, task_id)
+    job.on_cancel = lambda: download_flights.leave(flight, task_id)
+    if job.cancelled:
+        job.on_cancel()
+    
+    if leader:
+        progress_store.set(task_id, 'processing', 'Analyzing video...', 5)
+        try:
+            result = run_strategies(video_url, download_type, mode, key, flight)
+        except JobCancelled as e:
+            log.info("🛑 Download cancelled", url=video_url)
+            download_flights.finish(flight, error=str(e))
+        except Exception as e:
+            error_msg = str(e)
+            log.error(f"❌ {error_msg}")
+            report(flight, 'error', error_msg, 0)
+            download_flights.finish(flight, error=error_msg)
+        else:
+            stream_indicator = "🎵" if download_type == 'audio' else "📡"
+            log.info(f"{stream_indicator} Ready to stream", size=result['size'])
             
-            # If all strategies failed
-            error_msg = f"All download strategies failed. Last error: {last_error}"
-            print(f"❌ {error_msg}")
-            
-            with progress_lock:
-                progress_store[task_id] = {
-                    'status': 'error',
-                    'message': error_msg,
-                    'progress': 0
-                }
+            # Mark as ready to stream
+            report(flight, 'complete', 'Download ready!', 100)
+            download_flights.finish(flight, result=result, on_release=result.get('cleanup'))
+    else:
+        log.info("🔗 Joining in-flight download", waiting=len(flight.task_ids), url=video_url)
+        progress_store.copy(flight.task_ids[0], task_id)
+        # A cancelled job has left the flight, so it stops waiting straight away
+        while not flight.wait(0.25):
+            if job.cancelled:
+                break
+    
+    # Tasks that left before the result was published hold no reference to it
+    if task_id not in flight.task_ids:
+        raise JobCancelled('Download cancelled')
+    if flight.error:
+        raise Exception(flight.error)
+    return flight.result, flight.release
+
+def job_keys(video_url, download_type, mode):
+    """(result cache key, download flight key) for a cleaned URL. Only known video IDs have a cache key."""
+    identity = canonical_video_id(video_url)
+    key = cache_key(*identity, download_type, output_settings(download_type, mode)) if identity else None
+    return key, key or f'{download_type}:{mode}:{video_url}'
+
+def cached_result(key):
+    """(result, release) of a cached file, or None on a miss.
+
+    The entry stays pinned, so eviction can't take the file before the
+    client has fetched it, until release runs.
+    """
+    entry = result_cache.get(key, pin=True) if key else None
+    if not entry:
+        return None
+    log.info("💾 Cache hit", filename=entry['filename'], size=entry['size'])
+    return {**entry, 'cache': 'HIT'}, lambda: result_cache.unpin(key)
+
+def complete_from_cache(task_id, video_url, download_type, mode):
+    """A job completed on the spot from the result cache, or None on a miss"""
+    key, _ = job_keys(clean_url(video_url), download_type, mode)
+    cached = cached_result(key)
+    if cached is None:
+        return None
+    job = job_queue.add(task_id, video_url, download_type, mode=mode)
+    if job is None:
+        # The task is already under way
+        cached[1]()
+        return None
+    progress_store.set(task_id, 'complete', 'Download ready!', 100)
+    job_queue.finish(job, *cached)
+    return job
+
+def follow_download(task_id, video_url, download_type, mode):
+    """A job fed by the identical download another job is running, or None if there is none.
+
+    It takes no download worker: the job finishes when that download does,
+    and cancelling it just leaves the download to the others.
+    """
+    _, flight_key = job_keys(clean_url(video_url), download_type, mode)
+    flight = download_flights.follow(flight_key, task_id)
+    if flight is None:
+        return None
+    job = job_queue.add(task_id, video_url, download_type, mode=mode)
+    if job is None:
+        # The task is already under way
+        if not download_flights.leave(flight, task_id):
+            flight.release()
+        return None
+    log.info("🔗 Joining in-flight download", waiting=len(flight.task_ids), url=video_url, task_id=task_id)
+    progress_store.copy(flight.task_ids[0], task_id)
+    publish_job(job)
+    
+    def cancel():
+        if download_flights.leave(flight, task_id):
+            job_queue.finish(job, error='Download cancelled')
+    
+    def done(flight):
+        # Tasks that left before the result was published were finished by cancel()
+        if task_id not in flight.task_ids:
+            return
+        if flight.error:
+            job_queue.finish(job, error=flight.error)
+        else:
+            job_queue.finish(job, flight.result, flight.release)
+    
+    job.on_cancel = cancel
+    flight.add_done_callback(done)
+    return job
+
+def queue_job(task_id, video_url, download_type, mode):
+    """Queue a download for a worker. Raises Overloaded while the scratch disk is full, or QueueFull."""
+    scratch.check()
+    return job_queue.submit(task_id, video_url, download_type, mode=mode)
+
+def report_queued(job, position):
+    publish_job(job)
+    progress_store.set(job.task_id, 'queued', f'Waiting for a free download slot (position {position})...', 0)
+
+def report_finished(job):
+    """Share the outcome with the other workers and make sure failed and cancelled jobs end their progress stream"""
+    publish_job(job)
+    jobs_finished.inc(status=job.status)
+    if job.status not in ('error', 'cancelled'):
+        return
+    if progress_store.get(job.task_id).get('status') != job.status:
+        progress_store.set(job.task_id, job.status, job.error, 0)
+
+# Downloads run on a bounded pool of worker threads instead of the request
+# thread. DOWNLOAD_WORKERS run at once, up to MAX_QUEUED_JOBS wait for a slot
+# and finished files stay available for JOB_RESULT_TTL seconds.
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', 4))
+JOB_RESULT_TTL = int(os.environ.get('JOB_RESULT_TTL', 600))
+job_queue = JobQueue(
+    process_job,
+    workers=DOWNLOAD_WORKERS,
+    max_queued=int(os.environ.get('MAX_QUEUED_JOBS', 32)),
+    result_ttl=JOB_RESULT_TTL,
+    on_queued=report_queued,
+    on_finished=report_finished,
+)
+
+metrics.gauge('ytdlp_web_jobs', 'Jobs running or waiting for a download worker', ('state',),
+              collect=lambda: {(state,): job_queue.stats()[state] for state in ('running', 'queued')})
+
+def publish_job(job):
+    """Record a job in the state backend so any worker can report on it or serve its file"""
+    if state_backend.shared:
+        state_backend.put('job', job.task_id, job.to_record(), JOB_RESULT_TTL)
+
+def find_job(task_id):
+    """A job of this worker, or a read-only copy of one running in another worker"""
+    job = job_queue.get(task_id)
+    if job is None and state_backend.shared:
+        record = state_backend.get('job', task_id)
+        if record is not None:
+            job = Job.from_record(record)
+    return job
+
+def too_many_requests(e):
+    """429 response telling the client when to try again (a full queue or no turn upstream)"""
+    log.warning(f"⏳ {e}")
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def overloaded(e):
+    """503 response while the server has no room for more downloads"""
+    log.warning(f"💽 {e}")
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def send_job_file(job, on_close=None):
+    """Stream the finished file of a completed job"""
+    result = job.result
+    # The server may use sendfile, so only the time until it closes the file is known
+    timer = phase_timer().enter('send', task_id=job.task_id, size=result['size'])
+    
+    def closed():
+        timer.end()
+        if on_close:
+            on_close()
+    
+    return send_download(result['path'], result['filename'], result['mimetype'], on_close=closed,
+                         headers={"X-Cache": result.get('cache', 'MISS'),
+                                  "X-Processing-Path": result.get('processing', 'direct')})
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Queue a download and return its task_id straight away"""
+    params = request.get_json(silent=True) or request.form
+    video_url = params.get('url')
+    download_type = params.get('type', 'video')
+    mode = normalize_mode(params.get('mode'), DEFAULT_MODE)
+    task_id = params.get('task_id') or str(uuid.uuid4())
+    
+    if not video_url:
+        return jsonify({'error': 'Missing URL'}), 400
+    
+    # Cached files and downloads already under way don't wait for a worker
+    try:
+        job = (complete_from_cache(task_id, video_url, download_type, mode)
+               or follow_download(task_id, video_url, download_type, mode)
+               or queue_job(task_id, video_url, download_type, mode))
+    except QueueFull as e:
+        return too_many_requests(e)
+    except Overloaded as e:
+        return overloaded(e)
+    
+    response = jsonify(job.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job.task_id}'
+    return response
+
+@app.route('/jobs/<task_id>', methods=['GET'])
+def get_job(task_id):
+    job = find_job(task_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    data = job.to_dict()
+    data['progress'] = progress_store.get(task_id)
+    return jsonify(data)
+
+@app.route('/jobs/<task_id>', methods=['DELETE'])
+def cancel_job(task_id):
+    """Cancel a job. A download shared with other jobs keeps running for them."""
+    job = job_queue.cancel(task_id) or find_job(task_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.remote and not job.done.is_set():
+        # The worker running it picks this up within a second
+        state_backend.put('cancel', task_id, True, JOB_RESULT_TTL)
+    if not job.done.is_set():
+        progress_store.set(task_id, 'cancelled', 'Download cancelled', 0)
+    return jsonify(job.to_dict()), 202
+
+@app.route('/jobs/<task_id>/file')
+def get_job_file(task_id):
+    job = find_job(task_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job.status == 'error':
+        return f"Error: {job.error}", 500
+    if job.status == 'cancelled':
+        return jsonify(job.to_dict()), 410
+    if job.status != 'complete':
+        return jsonify(job.to_dict()), 409
+    # Another worker's cache may have evicted it
+    try:
+        return send_job_file(job)
+    except FileNotFoundError:
+        return jsonify({'error': 'The file is no longer available'}), 410
+
+# Live streams hold a request thread and an upstream connection for as long
+# as the transfer runs, so at most STREAM_SLOTS run at once. Requests beyond
+# that fall back to the queued, buffered path.
+stream_slots = BoundedSemaphore(int(os.environ.get('STREAM_SLOTS', DOWNLOAD_WORKERS)))
+
+def stream_download(video_url, download_type, mode, task_id):
+    """Start sending the file while it is still downloading.
+
+    Single formats already in the right container are forwarded as they
+    arrive; everything else goes through ffmpeg to its stdout (fragmented
+    MP4 for video, MP3 for audio). The size usually isn't known up front so
+    the response goes out chunked. Returns None when this video can't be
+    streamed and the caller should use the buffered path instead.
+    """
+    get_ydl_pool()  # Loads yt-dlp, see there
+    from live_stream import plan_stream, DirectBody, FFmpegBody
+    
+    video_url = clean_url(video_url)
+    
+    if not stream_slots.acquire(blocking=False):
+        log.info("⏳ No free stream slot")
+        return None
+    
+    def on_progress(sent, total):
+        if total:
+            percent = min(sent / total * 100, 100)
+            progress_store.set(task_id, 'downloading', f'Streaming... {percent:.0f}%', 10 + percent * 0.89)
+        else:
+            progress_store.set(task_id, 'downloading', f'Streaming... {sent / 1048576:.1f} MB', 50)
+    
+    transcode_slot = None
+    
+    def on_close(finished):
+        stream_slots.release()
+        transcode_slots.release(transcode_slot)
+        # Runs when the server closes the body, outside the request's log context
+        timer.add(bytes=body.sent, task_id=task_id)
+        timer.end('ok' if finished else 'error')
+        if finished:
+            log.info("📡 Stream complete", task_id=task_id, url=video_url)
+            progress_store.set(task_id, 'complete', 'Download complete!', 100)
+        else:
+            log.warning("⚠️ Stream closed early", task_id=task_id, url=video_url)
+            progress_store.set(task_id, 'error', 'Stream interrupted', 0)
+    
+    progress_store.set(task_id, 'processing', 'Analyzing video...', 5)
+    last_error = None
+    try:
+        for strategy in strategy_scheduler.order():
+            started = time.monotonic()
+            extract_time = None
+            ydl = get_ydl_pool().acquire(strategy['name'], **request_opts(download_type, mode))
+            body = None
+            timer = phase_timer(strategy['name'])
+            try:
+                log.info("🔄 Trying strategy for live stream", strategy=strategy['name'])
+                # Don't hold this thread for a turn upstream; the buffered path waits for it instead
+                info, extract_time = extract_info(ydl, video_url, strategy, timer, wait=False)
+                # Pick this request's formats; the cached info may have served another type
+                info = ydl.process_ie_result(info, download=False)
+                plan = plan_stream(info, download_type, mode)
+                if plan is None:
+                    ydl.close()
+                    stream_slots.release()
+                    return None
+                
+                # Re-encoding live needs an encoder right now; without one the
+                # buffered path queues for it instead
+                if plan['processing'] == 'transcode':
+                    transcode_slot = transcode_slots.try_acquire()
+                    if transcode_slot is None:
+                        log.info("⏳ No free encoder for a live stream")
+                        ydl.close()
+                        stream_slots.release()
+                        return None
+                
+                # Download and delivery to the client happen together
+                timer.enter('stream', kind=plan['kind'], processing=plan['processing'])
+                
+                # Fetch the first chunk before committing to a 200, so a source that
+                # fails straight away can still be retried with the next strategy
+                if plan['kind'] == 'direct':
+                    body = DirectBody(ydl, plan['format'], ydl.params['http_chunk_size'],
+                                      on_progress=on_progress)
+                else:
+                    body = FFmpegBody(plan['cmd'], ydl=ydl, on_progress=on_progress)
+                body.prime()
+            except Exception as e:
+                timer.end('error')
+                transcode_slots.release(transcode_slot)
+                transcode_slot = None
+                # Don't pool a session that just failed
+                ydl.reusable = False
+                if body is not None:
+                    body.close()
+                else:
+                    ydl.close()
+                if isinstance(e, UpstreamBusy):
+                    raise
+                last_error = str(e)
+                log.warning(f"❌ {strategy['name']} failed", strategy=strategy['name'], error=last_error)
+                record_attempt(strategy, False,
+                               latency=extract_time or time.monotonic() - started, error=last_error,
+                               url=video_url)
+                progress_store.set(task_id, 'retrying', f'{strategy["name"]} failed, trying next...', 5)
+                continue
             
-            return f"Error: {error_msg}", 500
+            record_attempt(strategy, True, latency=extract_time)
+            body.on_close = on_close
+            ext = '.' + plan['ext']
+            filename = make_filename(info.get('title'), ext, download_type)
+            mimetype = get_mimetype(download_type, ext)
+            log.info("📡 Live streaming", kind=plan['kind'], processing=plan['processing'], filename=filename)
             
-    except Exception as e:
-        error_msg = f"Unexpected error: {str(e)}"
-        print(f"❌ {error_msg}")
-        
-        with progress_lock:
-            progress_store[task_id] = {
-                'status': 'error',
-                'message': error_msg,
-                'progress': 0
-            }
-        return f"Error: {error_msg}", 500
+            response = Response(body, mimetype=mimetype, direct_passthrough=True, headers={
+                "Content-Disposition": f"attachment; filename=\"{filename}\"",
+                "Cache-Control": "no-cache, no-store, must-revalidate",
+                "X-Stream-Mode": plan['kind'],
+                "X-Processing-Path": plan['processing'],
+            })
+            if plan['kind'] == 'direct' and body.total:
+                response.content_length = body.total
+            return response
+    except Exception:
+        stream_slots.release()
+        raise
+    
+    stream_slots.release()
+    error_msg = f"All download strategies failed. Last error: {last_error}"
+    log.error(f"❌ {error_msg}")
+    progress_store.set(task_id, 'error', error_msg, 0)
+    return f"Error: {error_msg}", 500
+
+@app.route('/download')
+def download():
+    """Synchronous download: queue a job, wait for it and stream the file.
+
+    With ``stream=1`` the response starts while the download is still
+    running, where the selected formats allow it.
+    """
+    video_url = request.args.get('url')
+    download_type = request.args.get('type', 'video')  # Default to video if not specified
+    mode = normalize_mode(request.args.get('mode'), DEFAULT_MODE)  # fast (stream copy) or compatible
+    task_id = request.args.get('task_id')  # Task ID for progress tracking
+    
+    if not video_url:
+        return "Missing URL", 400
+    
+    if not task_id:
+        task_id = str(uuid.uuid4())
+
+    # A finished file beats a live stream
+    job = complete_from_cache(task_id, video_url, download_type, mode)
+    
+    # Pipe-through mode: start sending while the download is still running
+    if job is None and request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        try:
+            response = stream_download(video_url, download_type, mode, task_id)
+        except UpstreamBusy:
+            log.info("🚦 No turn upstream for a live stream, falling back to a buffered download")
+            response = None
+        else:
+            if response is None:
+                log.info("↩️ Can't stream this one, falling back to a buffered download")
+        if response is not None:
+            return response
+
+    try:
+        job = (job or follow_download(task_id, video_url, download_type, mode)
+               or queue_job(task_id, video_url, download_type, mode))
+    except QueueFull as e:
+        return too_many_requests(e)
+    except Overloaded as e:
+        return overloaded(e)
+    job.done.wait()
+    
+    if job.status != 'complete':
+        return f"Error: {job.error}", 500
+    
+    # Stream straight from disk. This request is the only consumer of the
+    # job, so its hold on the file goes as soon as the response closes.
+    return send_job_file(job, on_close=lambda: job_queue.discard(task_id))
+
+# Batches of videos fetched together and sent back as one ZIP. Each batch
+# keeps at most BATCH_CONCURRENCY of its videos in the job queue at a time and
+# is forgotten BATCH_TTL seconds after its last activity.
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 2))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+batches = TTLCache(ttl=int(os.environ.get('BATCH_TTL', 3600)), max_entries=256)
+
+def expand_playlist(url):
+    """List the videos of a playlist URL with flat extraction, without extracting each one.
+
+    Raises UpstreamBusy rather than wait when the site has no turn free.
+    """
+    if canonical_video_id(url) and 'list=' not in url:
+        return [{'url': url, 'title': None}]
+    
+    last_error = None
+    for strategy in strategy_scheduler.order():
+        started = time.monotonic()
+        timer = phase_timer(strategy['name'])
+        try:
+            # Entries only, no per-video extraction
+            with get_ydl_pool().acquire(strategy['name'], extract_flat='in_playlist') as ydl:
+                timer.enter('throttle')
+                upstream_limiter.try_acquire(upstream_host(url))
+                timer.enter('playlist')
+                info = ydl.extract_info(url, download=False)
+                timer.end()
+            record_attempt(strategy, True, latency=time.monotonic() - started)
+            break
+        except UpstreamBusy:
+            timer.end('error')
+            raise
+        except Exception as e:
+            timer.end('error')
+            last_error = str(e)
+            log.warning(f"❌ {strategy['name']} playlist extraction failed", strategy=strategy['name'], error=last_error)
+            record_attempt(strategy, False, latency=time.monotonic() - started, error=last_error, url=url)
+    else:
+        raise Exception(f"Could not read playlist. Last error: {last_error}")
+    
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        return [{'url': info.get('webpage_url') or url, 'title': info.get('title')}]
+    entries = []
+    for entry in info.get('entries') or []:
+        if not entry:
+            continue
+        entry_url = entry.get('url') or entry.get('webpage_url')
+        if entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if entry_url:
+            entries.append({'url': entry_url, 'title': entry.get('title')})
+    return entries
+
+def report_batch(batch):
+    """Publish a batch's overall progress, along with every item's, under the batch ID"""
+    batches.set(batch.batch_id, batch)  # Active batches don't expire
+    
+    items = []
+    for item in batch.items:
+        progress = 100 if item.finished else progress_store.get(item.task_id).get('progress', 0)
+        items.append(item.to_dict(progress))
+    total = len(items)
+    counts = batch.counts()
+    ready = counts.get('complete', 0)
+    failed = counts.get('error', 0) + counts.get('cancelled', 0)
+    
+    if ready + failed < total:
+        status = 'cancelled' if batch.cancelled.is_set() else 'downloading'
+        message = f'{ready} of {total} ready'
+    elif ready:
+        status, message = 'complete', f'{ready} of {total} ready'
+    else:
+        status = 'cancelled' if batch.cancelled.is_set() else 'error'
+        message = 'No videos could be downloaded'
+    if failed:
+        message += f', {failed} failed'
+    overall = sum(item['progress'] for item in items) / total
+    
+    state = {'status': status, 'message': message, 'progress': overall, 'items': items}
+    if progress_store.get(batch.batch_id) != state:
+        progress_store.set(batch.batch_id, status, message, overall, items=items)
+        if state_backend.shared:
+            state_backend.put('batch', batch.batch_id, batch.to_dict(), batches.ttl)
+
+@app.route('/batch', methods=['POST'])
+def create_batch():
+    """Queue a list of videos (``urls``) or a playlist (``url``) to be fetched as one ZIP"""
+    params = request.get_json(silent=True)
+    if params is None:
+        params = request.form.to_dict()
+        params['urls'] = request.form.getlist('urls')
+    urls = params.get('urls') or []
+    if isinstance(urls, str):
+        urls = urls.split()
+    playlist_url = params.get('url')
+    download_type = params.get('type', 'video')
+    mode = normalize_mode(params.get('mode'), DEFAULT_MODE)
+    batch_id = params.get('batch_id') or str(uuid.uuid4())
+    
+    if not urls and not playlist_url:
+        return jsonify({'error': 'Missing URL'}), 400
+    
+    try:
+        scratch.check()
+    except Overloaded as e:
+        return overloaded(e)
+    
+    if urls:
+        entries = [{'url': clean_url(url), 'title': None} for url in urls]
+    else:
+        progress_store.set(batch_id, 'processing', 'Reading playlist...', 0)
+        try:
+            entries = expand_playlist(playlist_url)
+        except UpstreamBusy as e:
+            progress_store.set(batch_id, 'error', str(e), 0)
+            return too_many_requests(e)
+        except Exception as e:
+            progress_store.set(batch_id, 'error', str(e), 0)
+            return jsonify({'error': str(e)}), 502
+    if not entries:
+        return jsonify({'error': 'No videos found'}), 400
+    if len(entries) > BATCH_MAX_ITEMS:
+        log.info("✂️ Batch trimmed", videos=len(entries), kept=BATCH_MAX_ITEMS)
+        entries = entries[:BATCH_MAX_ITEMS]
+    
+    def submit(item):
+        return (complete_from_cache(item.task_id, item.url, download_type, mode)
+                or follow_download(item.task_id, item.url, download_type, mode)
+                or job_queue.submit(item.task_id, item.url, download_type, mode=mode))
+    
+    def cancel(item):
+        job_queue.cancel(item.task_id)
+    
+    log.info("📦 New batch", videos=len(entries), batch_id=batch_id)
+    batch = Batch(batch_id, entries, submit, cancel, concurrency=BATCH_CONCURRENCY, report=report_batch)
+    report_batch(batch)  # Other workers know the batch from its first record
+    batch.start()
+    
+    response = jsonify(batch.to_dict())
+    response.status_code = 202
+    response.headers['Location'] = f'/batch/{batch_id}'
+    return response
+
+def find_remote_batch(batch_id):
+    """The shared record of a batch another worker is running, or None"""
+    return state_backend.get('batch', batch_id) if state_backend.shared else None
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = batches.get(batch_id)
+    if batch is None:
+        data = find_remote_batch(batch_id)
+        if data is None:
+            return jsonify({'error': 'Unknown batch'}), 404
+        for item in data['items']:
+            item['progress'] = progress_store.get(item['task_id'])
+    else:
+        data = batch.to_dict({item.task_id: progress_store.get(item.task_id) for item in batch.items})
+    data['progress'] = progress_store.get(batch_id)
+    return jsonify(data)
+
+@app.route('/batch/<batch_id>', methods=['DELETE'])
+def cancel_batch(batch_id):
+    batch = batches.get(batch_id)
+    if batch is None:
+        data = find_remote_batch(batch_id)
+        if data is None:
+            return jsonify({'error': 'Unknown batch'}), 404
+        # The worker running it picks this up within a second
+        state_backend.put('cancel', batch_id, True, batches.ttl)
+        return jsonify(data), 202
+    batch.cancel()
+    return jsonify(batch.to_dict()), 202
+
+def remote_batch_finished(batch_id):
+    """Finished items of a batch another worker runs, read from the shared records as they finish"""
+    seen = set()
+    while True:
+        data = find_remote_batch(batch_id)
+        if data is None:
+            return
+        for item in data['items']:
+            if item['task_id'] not in seen and item['status'] in TERMINAL_STATUSES:
+                seen.add(item['task_id'])
+                job = find_job(item['task_id'])
+                yield item['task_id'], item['url'], item['status'], item.get('error'), job and job.result
+        if len(seen) == len(data['items']):
+            return
+        time.sleep(0.5)
+
+@app.route('/batch/<batch_id>/zip')
+def get_batch_zip(batch_id):
+    """Stream the batch as a ZIP, adding each video as soon as it has finished downloading"""
+    batch = batches.get(batch_id)
+    if batch is None and find_remote_batch(batch_id) is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    if (batch is not None and not batch.claim_stream()) or \
+            (state_backend.shared and not state_backend.claim('zip', batch_id, batches.ttl)):
+        return jsonify({'error': 'This batch is already being downloaded'}), 409
+    
+    if batch is not None:
+        done_items = ((item.task_id, item.url, item.status, item.error, item.job.result if item.job is not None else None)
+                    for item in batch.completed())
+    else:
+        # Running in another worker: its files are on the same disk
+        done_items = remote_batch_finished(batch_id)
+    
+    def members():
+        names = set()
+        failures = []
+        for task_id, url, status, error, result in done_items:
+            if status == 'complete' and result and os.path.exists(result['path']):
+                base, ext = os.path.splitext(result['filename'])
+                name, n = result['filename'], 2
+                while name in names:
+                    name, n = f"{base} ({n}){ext}", n + 1
+                names.add(name)
+                log.info("📦 Adding to ZIP", name=name, batch_id=batch_id)
+                yield name, result['path']
+            else:
+                failures.append(f"{url}: {error or status}")
+            # Written to the archive (or failed), the job's file can go
+            job_queue.discard(task_id)
+        if failures:
+            yield 'errors.txt', ('\n'.join(failures) + '\n').encode()
+    
+    def generate():
+        finished = False
+        timer = phase_timer().enter('zip', batch_id=batch_id)
+        sent = 0
+        try:
+            for chunk in zip_stream(members()):
+                sent += len(chunk)
+                yield chunk
+            finished = True
+        finally:
+            timer.add(bytes=sent)
+            timer.end('ok' if finished else 'error')
+            if not finished:
+                log.warning("⚠️ Batch download closed early, cancelling", batch_id=batch_id)
+                if batch is None:
+                    state_backend.put('cancel', batch_id, True, batches.ttl)
+                else:
+                    batch.cancel()
+                    # Nobody is going to collect the files that already finished
+                    for item in batch.items:
+                        if item.finished:
+                            job_queue.discard(item.task_id)
+    
+    return Response(generate(), mimetype='application/zip', headers={
+        "Content-Disposition": f"attachment; filename=\"batch-{batch_id[:8]}.zip\"",
+        "Cache-Control": "no-cache, no-store, must-revalidate",
+        "X-Accel-Buffering": "no",
+    })
+
+def watch_remote_cancels():
+    """Carry out cancellations that other workers recorded for our jobs and batches"""
+    while True:
+        time.sleep(1)
+        try:
+            for job in job_queue.active():
+                if state_backend.get('cancel', job.task_id):
+                    state_backend.delete('cancel', job.task_id)
+                    log.info("🛑 Cancelled from another worker", task_id=job.task_id)
+                    job_queue.cancel(job.task_id)
+            for batch in batches.values():
+                if batch.thread.is_alive() and state_backend.get('cancel', batch.batch_id):
+                    state_backend.delete('cancel', batch.batch_id)
+                    log.info("🛑 Cancelled from another worker", batch_id=batch.batch_id)
+                    batch.cancel()
+        except Exception as e:
+            log.warning("⚠️ Cancel watcher error", error=str(e))
+
+if state_backend.shared:
+    Thread(target=watch_remote_cancels, name='cancel-watcher', daemon=True).start()
+
+@app.route('/info')
+def video_info():
+    """Title, duration, thumbnail and formats of a video, without downloading it"""
+    video_url = request.args.get('url')
+    if not video_url:
+        return jsonify({'error': 'Missing URL'}), 400
+    
+    video_url = clean_url(video_url)
+    cached = info_cache.get(info_cache_key(video_url))
+    if cached:
+        return jsonify(summarize_info(cached['info']))
+    
+    last_error = None
+    for strategy in strategy_scheduler.order():
+        started = time.monotonic()
+        timer = phase_timer(strategy['name'])
+        try:
+            with get_ydl_pool().acquire(strategy['name'], **request_opts('video', DEFAULT_MODE)) as ydl:
+                info, extract_time = extract_info(ydl, video_url, strategy, timer, wait=False)
+            record_attempt(strategy, True, latency=extract_time)
+            return jsonify(summarize_info(info))
+        except UpstreamBusy as e:
+            timer.end('error')
+            return too_many_requests(e)
+        except Exception as e:
+            timer.end('error')
+            last_error = str(e)
+            log.warning(f"❌ {strategy['name']} info extraction failed", strategy=strategy['name'], error=last_error)
+            record_attempt(strategy, False, latency=time.monotonic() - started, error=last_error, url=video_url)
+    
+    return jsonify({'error': f"Could not extract video info. Last error: {last_error}"}), 502
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Hit/miss counters and size of the result and metadata caches"""
+    return jsonify({**result_cache.stats(), 'info': info_cache.stats()})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Phase timings, throughput, strategy outcomes, jobs and open progress streams, for Prometheus"""
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/healthz')
+def healthz():
+    """Liveness check. Answers before yt-dlp is loaded; ``warm`` tells whether it is yet."""
+    return jsonify({'status': 'ok', 'warm': pool_warm.is_set()})
+
+@app.route('/admission')
+def admission_stats():
+    """Scratch space, download and encoder slots, and the YoutubeDL pool"""
+    return jsonify({
+        'scratch': scratch.stats(),
+        'downloads': download_slots.stats(),
+        'transcodes': transcode_slots.stats(),
+        'ydl_pool': ydl_pool.stats() if ydl_pool else None,
+    })
+
+@app.route('/strategies')
+def strategy_stats():
+    """Success rates, latency and backoff state of each download strategy"""
+    return jsonify(strategy_scheduler.snapshot())
 
 @app.route('/static/<path:filename>')
 def serve_static(filename):
@@ -0,0 +1,145 @@
+import queue
+import time
+from threading import Event, Lock, Thread
+from jobs import QueueFull
+
+
+class BatchItem:
+    """One video of a batch and the job downloading it"""
+
+    def __init__(self, index, url, title, task_id):
+        self.index = index
+        self.url = url
+        self.title = title
+        self.task_id = task_id
+        self.job = None
+        self.status = 'pending'
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.status in ('complete', 'error', 'cancelled')
+
+    def to_dict(self, progress=None):
+        data = {
+            'index': self.index,
+            'url': self.url,
+            'title': self.title,
+            'task_id': self.task_id,
+            'status': self.status,
+        }
+        if progress is not None:
+            data['progress'] = progress
+        if self.error:
+            data['error'] = self.error
+        return data
+
+
+class Batch:
+    """Downloads a list of videos, a few at a time, through the job queue.
+
+    ``submit(item)`` queues the job for an item and ``cancel(item)`` stops
+    it. At most ``concurrency`` items are in the queue at once, the rest
+    wait their turn, so a long playlist doesn't crowd out everyone else.
+    Items are handed out by ``completed()`` in the order they finish.
+    ``report(batch)`` is called whenever the batch should publish its
+    progress.
+    """
+
+    def __init__(self, batch_id, entries, submit, cancel, concurrency=2, report=None):
+        self.batch_id = batch_id
+        self.items = [BatchItem(i, entry['url'], entry.get('title'), f'{batch_id}-{i}')
+                      for i, entry in enumerate(entries)]
+        self.submit = submit
+        self.cancel_item = cancel
+        self.concurrency = max(1, concurrency)
+        self.report = report
+        self.created = time.time()
+        self.lock = Lock()
+        self.cancelled = Event()
+        self.wakeup = Event()
+        self.finished = queue.Queue()
+        self.streaming = False
+        self.thread = Thread(target=self._run, name=f'batch-{batch_id}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        pending = list(self.items)
+        active = []
+        retry_at = 0
+        while pending or active:
+            for item in list(active):
+                if item.job.done.is_set():
+                    active.remove(item)
+                    self._finish(item, item.job.status, item.job.error)
+                else:
+                    item.status = item.job.status
+
+            if self.cancelled.is_set():
+                for item in active:
+                    self.cancel_item(item)
+                for item in pending:
+                    self._finish(item, 'cancelled', 'Download cancelled')
+                pending = []
+
+            while pending and len(active) < self.concurrency and time.time() >= retry_at:
+                item = pending[0]
+                try:
+                    item.job = self.submit(item)
+                except QueueFull as e:
+                    # The shared queue is busy, try again once it expects a free slot
+                    retry_at = time.time() + e.retry_after
+                    break
+                pending.pop(0)
+                item.status = 'queued'
+                active.append(item)
+
+            if self.report:
+                self.report(self)
+            self.wakeup.wait(0.5)
+            self.wakeup.clear()
+        if self.report:
+            self.report(self)
+
+    def _finish(self, item, status, error=None):
+        with self.lock:
+            item.status = status
+            item.error = error
+        self.finished.put(item)
+
+    def completed(self):
+        """Yield every item once it has finished, in the order they finish"""
+        for _ in self.items:
+            yield self.finished.get()
+
+    def claim_stream(self):
+        """Only one client can consume the finished items"""
+        with self.lock:
+            if self.streaming:
+                return False
+            self.streaming = True
+            return True
+
+    def cancel(self):
+        self.cancelled.set()
+        self.wakeup.set()
+
+    def counts(self):
+        with self.lock:
+            counts = {}
+            for item in self.items:
+                counts[item.status] = counts.get(item.status, 0) + 1
+            return counts
+
+    def to_dict(self, progress=None):
+        progress = progress or {}
+        return {
+            'batch_id': self.batch_id,
+            'created': self.created,
+            'total': len(self.items),
+            'counts': self.counts(),
+            'items': [item.to_dict(progress.get(item.task_id)) for item in self.items],
+        }
@@ -0,0 +1,82 @@
+"""Compare benchmark results: ``python -m benchmarks.compare base.json other.json [...]``
+
+The first file is the baseline, every other one is shown with its change
+against it. Lower is better for everything but the job and throughput rows.
+"""
+import argparse
+import json
+import sys
+
+# (label, path into the summary, unit)
+ROWS = [
+    ('jobs ok', ('ok',), ''),
+    ('ttfb p50', ('ttfb_s', 'p50'), 's'),
+    ('ttfb p95', ('ttfb_s', 'p95'), 's'),
+    ('ttfb p99', ('ttfb_s', 'p99'), 's'),
+    ('total p50', ('total_s', 'p50'), 's'),
+    ('total p95', ('total_s', 'p95'), 's'),
+    ('total p99', ('total_s', 'p99'), 's'),
+    ('throughput', ('throughput_bytes_per_s',), 'MiB/s'),
+    ('peak RSS', ('peak_rss_bytes',), 'MiB'),
+    ('CPU per job', ('cpu_s_per_job',), 's'),
+    ('SSE events/job', ('sse', 'events_per_job', 'mean'), ''),
+    ('SSE bytes/job', ('sse', 'bytes_per_job', 'mean'), ''),
+    ('first event p50', ('sse', 'first_event_s', 'p50'), 's'),
+    ('final lag p50', ('sse', 'final_event_lag_s', 'p50'), 's'),
+]
+
+
+def lookup(summary, path):
+    value = summary
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def format_value(value, unit):
+    if value is None:
+        return '-'
+    if unit == 'MiB':
+        return f'{value / 1048576:.1f} MiB'
+    if unit == 'MiB/s':
+        return f'{value / 1048576:.2f} MiB/s'
+    if unit == 's':
+        return f'{value:.3f}s'
+    return f'{value:.1f}' if isinstance(value, float) else str(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='+', help='results files, the first one is the baseline')
+    args = parser.parse_args()
+
+    reports = []
+    for path in args.files:
+        with open(path) as f:
+            reports.append(json.load(f))
+
+    names = [f"{r.get('commit') or '?'}{'*' if r.get('dirty') else ''}" + (f" {r['label']}" if r.get('label') else '')
+             for r in reports]
+    width = max(22, *(len(name) + 4 for name in names))
+    print(f"{'':<16}" + ''.join(f'{name:>{width}}' for name in names))
+    for label, path, unit in ROWS:
+        base = lookup(reports[0]['summary'], path)
+        line = f'{label:<16}'
+        for i, report in enumerate(reports):
+            value = lookup(report['summary'], path)
+            cell = format_value(value, unit)
+            if i and isinstance(base, (int, float)) and isinstance(value, (int, float)) and base:
+                cell += f' ({(value - base) / base * 100:+.0f}%)'
+            line += f'{cell:>{width}}'
+        print(line)
+
+    configs = {json.dumps(r['config'], sort_keys=True) for r in reports}
+    if len(configs) > 1:
+        print('\n⚠️ The runs used different settings, compare with care')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,250 @@
+"""Load generator for the benchmarks: drives /download and /progress/<task_id>.
+
+Each job opens the progress stream first, like the web UI does, then
+requests the file and reads it to the end. Timings are taken on the client;
+memory and CPU of the server (including its workers and ffmpeg children)
+are sampled from /proc.
+"""
+import http.client
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+from urllib.parse import urlencode, urlparse
+
+READ_SIZE = 64 * 1024
+
+
+def percentile(values, p):
+    """Linear-interpolated percentile of a list (p in 0-100), None when empty"""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+def distribution(values):
+    """p50/p95/p99, mean and max of the values that aren't None"""
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'mean': sum(values) / len(values),
+        'max': max(values),
+        'count': len(values),
+    }
+
+
+class ProgressWatcher:
+    """Reads /progress/<task_id> on its own thread and times its events"""
+
+    def __init__(self, base_url, task_id, timeout):
+        self.base_url = base_url
+        self.task_id = task_id
+        self.timeout = timeout
+        self.opened = Event()
+        self.events = 0
+        self.bytes = 0
+        self.statuses = []
+        self.connected_at = None
+        self.first_event_at = None
+        self.final_event_at = None
+        self.error = None
+        self.thread = Thread(target=self._run, name=f'sse-{task_id[:8]}', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        # Give the request a moment to reach the server before the download starts
+        self.opened.wait(5)
+        return self
+
+    def join(self, timeout=None):
+        self.thread.join(timeout)
+
+    def _run(self):
+        url = urlparse(self.base_url)
+        conn = http.client.HTTPConnection(url.hostname, url.port, timeout=self.timeout)
+        try:
+            conn.request('GET', f'/progress/{self.task_id}', headers={'Accept': 'text/event-stream'})
+            self.opened.set()
+            response = conn.getresponse()
+            self.connected_at = time.monotonic()
+            while True:
+                line = response.fp.readline()
+                if not line:
+                    break
+                self.bytes += len(line)
+                if not line.startswith(b'data: '):
+                    continue
+                self.events += 1
+                now = time.monotonic()
+                if self.first_event_at is None:
+                    self.first_event_at = now
+                status = json.loads(line[6:]).get('status')
+                self.statuses.append(status)
+                if status in ('complete', 'error', 'cancelled'):
+                    self.final_event_at = now
+                    break
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.opened.set()
+            conn.close()
+
+
+def run_job(base_url, video_url, params, sse=True, timeout=600):
+    """Download one video through /download and return its timings"""
+    task_id = str(uuid.uuid4())
+    watcher = ProgressWatcher(base_url, task_id, timeout).start() if sse else None
+    query = urlencode({'url': video_url, 'task_id': task_id, **params})
+    url = urlparse(base_url)
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+    result = {'task_id': task_id, 'url': video_url, 'status': None, 'bytes': 0, 'error': None}
+    started = time.monotonic()
+    finished = None
+    try:
+        conn.request('GET', f'/download?{query}')
+        response = conn.getresponse()
+        result['status'] = response.status
+        result['headers_s'] = time.monotonic() - started
+        for header in ('X-Cache', 'X-Processing-Path', 'X-Stream-Mode'):
+            if response.getheader(header):
+                result[header.lower().replace('-', '_')[2:]] = response.getheader(header)
+        while True:
+            chunk = response.read1(READ_SIZE)
+            if not chunk:
+                break
+            if not result['bytes']:
+                result['ttfb_s'] = time.monotonic() - started
+            result['bytes'] += len(chunk)
+        finished = time.monotonic()
+        result['total_s'] = finished - started
+        if response.status != 200:
+            result['error'] = f'HTTP {response.status}'
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        conn.close()
+
+    if watcher:
+        watcher.join(30)
+        result['sse'] = {
+            'events': watcher.events,
+            'bytes': watcher.bytes,
+            'first_event_s': watcher.first_event_at - started if watcher.first_event_at else None,
+            # How long after the last byte arrived the stream said so (negative: before)
+            'final_event_lag_s': watcher.final_event_at - finished if watcher.final_event_at and finished else None,
+            'final_status': watcher.statuses[-1] if watcher.statuses else None,
+            'error': watcher.error,
+        }
+    return result
+
+
+class ProcessTreeSampler:
+    """Samples RSS and CPU time of a process and all its descendants (Linux /proc)"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.stopped = Event()
+        self.thread = Thread(target=self._run, name='proc-sampler', daemon=True)
+        self.clock_ticks = os.sysconf('SC_CLK_TCK')
+        self.page_size = os.sysconf('SC_PAGE_SIZE')
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak_rss = max(self.peak_rss, self.rss())
+            self.stopped.wait(self.interval)
+
+    def pids(self):
+        """The process and its live descendants"""
+        children = {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    # The command name may contain spaces, the fields after it don't
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(name))
+        found, todo = [], [self.pid]
+        while todo:
+            pid = todo.pop()
+            found.append(pid)
+            todo.extend(children.get(pid, ()))
+        return found
+
+    def rss(self):
+        total = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * self.page_size
+            except (OSError, IndexError, ValueError):
+                continue
+        return total
+
+    def cpu_seconds(self):
+        """User + system CPU time of the tree, including children that have exited"""
+        ticks = 0
+        for pid in self.pids():
+            try:
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                # utime, stime, cutime, cstime
+                ticks += sum(int(value) for value in fields[11:15])
+            except (OSError, IndexError, ValueError):
+                continue
+        return ticks / self.clock_ticks
+
+
+def run_load(base_url, video_urls, params, concurrency, sse=True, timeout=600):
+    """Run every video URL through run_job, ``concurrency`` at a time. Returns the results in order."""
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda video_url: run_job(base_url, video_url, params, sse, timeout), video_urls))
+
+
+def summarize(results, cpu_seconds, peak_rss, wall_seconds):
+    """The numbers worth comparing between runs"""
+    ok = [r for r in results if not r['error']]
+    sse = [r['sse'] for r in results if r.get('sse')]
+    total_bytes = sum(r['bytes'] for r in ok)
+    return {
+        'jobs': len(results),
+        'ok': len(ok),
+        'failed': len(results) - len(ok),
+        'wall_s': wall_seconds,
+        'ttfb_s': distribution([r.get('ttfb_s') for r in ok]),
+        'total_s': distribution([r.get('total_s') for r in ok]),
+        'bytes': total_bytes,
+        'throughput_bytes_per_s': total_bytes / wall_seconds if wall_seconds else None,
+        'peak_rss_bytes': peak_rss,
+        'cpu_s': cpu_seconds,
+        'cpu_s_per_job': cpu_seconds / len(results) if results else None,
+        'sse': {
+            'events_per_job': distribution([s['events'] for s in sse]),
+            'bytes_per_job': distribution([s['bytes'] for s in sse]),
+            'first_event_s': distribution([s['first_event_s'] for s in sse]),
+            'final_event_lag_s': distribution([s['final_event_lag_s'] for s in sse]),
+            'errors': sum(1 for s in sse if s['error']),
+        } if sse else None,
+    }
@@ -0,0 +1,320 @@
+"""Local HTTP media server for the benchmarks, so they never touch the internet.
+
+Serves synthetic H.264/AAC videos generated once with ffmpeg, in the shapes
+yt-dlp meets on real sites:
+
+- ``progressive``: one muxed MP4
+- ``split``: separate video-only MP4 and audio-only M4A, merged by yt-dlp
+- ``dash``: a DASH manifest with 2 second segments per stream
+- ``hls``: an HLS playlist of 2 second fragmented MP4 segments
+
+A video is asked for as ``/bench/<kind>-<size>-<anything>`` (e.g.
+``/bench/dash-10M-a1b2``), which the stub extractor in
+``yt_dlp_plugins/extractor/bench.py`` turns into formats through
+``/api/<video id>``. Files support byte ranges, and every response can be
+throttled to a bandwidth and delayed by a latency to look like a real CDN.
+
+Run standalone with ``python -m benchmarks.media_server --port 8765``.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+
+KINDS = ('progressive', 'split', 'dash', 'hls')
+VIDEO_BITRATE = 1_500_000
+AUDIO_BITRATE = 128_000
+CHUNK_SIZE = 64 * 1024
+# Bump when the generated files change so old ones get rebuilt
+MEDIA_VERSION = 2
+
+VIDEO_ID = re.compile(r'^(?P<kind>progressive|split|dash|hls)-(?P<size>\d+[KMG]?)-[\w-]+$')
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.m4s': 'video/iso.segment',
+    '.mpd': 'application/dash+xml',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+}
+
+
+def parse_size(text):
+    """'10M' -> 10485760. Plain numbers are bytes."""
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?)B?', str(text).strip().upper())
+    if not match:
+        raise ValueError(f'Invalid size: {text!r}')
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** ' KMG'.index(unit or ' '))
+
+
+class MediaLibrary:
+    """Synthetic videos by size label, generated on first use and kept in ``root``"""
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = Lock()
+        self.meta = {}  # size label -> metadata of the generated files
+
+    def get(self, label):
+        """Metadata of the videos for a size label, generating them if needed"""
+        with self.lock:
+            if label not in self.meta:
+                directory = os.path.join(self.root, label)
+                meta_path = os.path.join(directory, 'meta.json')
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    if meta.get('version') != MEDIA_VERSION:
+                        raise ValueError('stale media')
+                except (OSError, ValueError):
+                    meta = self._generate(label, directory)
+                self.meta[label] = meta
+            return self.meta[label]
+
+    def path(self, label, name):
+        """Absolute path of a generated file, or None if it isn't one"""
+        directory = os.path.realpath(os.path.join(self.root, label))
+        path = os.path.realpath(os.path.join(directory, name))
+        if not path.startswith(directory + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def _generate(self, label, directory):
+        size = parse_size(label)
+        duration = max(2.0, round(size * 8 / (VIDEO_BITRATE + AUDIO_BITRATE), 1))
+        print(f"🎞️ Generating {label} benchmark media ({duration:.0f}s)...")
+        os.makedirs(self.root, exist_ok=True)
+        work = tempfile.mkdtemp(prefix=f'{label}.', dir=self.root)
+        try:
+            def ffmpeg(*args):
+                subprocess.run(['ffmpeg', '-y', '-v', 'error', *args], check=True, cwd=work)
+
+            vbr = f'{VIDEO_BITRATE // 1000}k'
+            ffmpeg('-f', 'lavfi', '-i', 'testsrc2=size=640x360:rate=25',
+                   '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=44100', '-t', str(duration),
+                   '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                   '-b:v', vbr, '-minrate', vbr, '-maxrate', vbr, '-bufsize', vbr, '-x264-params', 'nal-hrd=cbr',
+                   '-g', '50', '-keyint_min', '50', '-sc_threshold', '0',
+                   '-c:a', 'aac', '-b:a', f'{AUDIO_BITRATE // 1000}k', '-movflags', '+faststart', 'progressive.mp4')
+            ffmpeg('-i', 'progressive.mp4', '-map', '0:v', '-c', 'copy', '-movflags', '+faststart', 'video.mp4')
+            ffmpeg('-i', 'progressive.mp4', '-map', '0:a', '-c', 'copy', '-movflags', '+faststart', 'audio.m4a')
+            os.mkdir(os.path.join(work, 'dash'))
+            ffmpeg('-i', 'progressive.mp4', '-map', '0:v', '-map', '0:a', '-c', 'copy', '-f', 'dash',
+                   '-seg_duration', '2', '-use_template', '1', '-use_timeline', '1',
+                   '-adaptation_sets', 'id=0,streams=v id=1,streams=a', 'dash/manifest.mpd')
+            os.mkdir(os.path.join(work, 'hls'))
+            ffmpeg('-i', 'progressive.mp4', '-c', 'copy', '-f', 'hls', '-hls_time', '2',
+                   '-hls_playlist_type', 'vod', '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', 'init.mp4',
+                   '-hls_segment_filename', 'hls/seg_%04d.m4s', 'hls/index.m3u8')
+
+            meta = {
+                'version': MEDIA_VERSION,
+                'label': label,
+                'duration': duration,
+                'sizes': {name: os.path.getsize(os.path.join(work, name))
+                          for name in ('progressive.mp4', 'video.mp4', 'audio.m4a')},
+            }
+            with open(os.path.join(work, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(work, directory)
+            return meta
+        except BaseException:
+            shutil.rmtree(work, ignore_errors=True)
+            raise
+
+    def describe(self, video_id):
+        """What /api/<video id> answers: title, duration and formats or a manifest"""
+        match = VIDEO_ID.match(video_id)
+        if not match:
+            return None
+        kind, label = match.group('kind', 'size')
+        meta = self.get(label)
+        media = f'/media/{label}'
+        info = {'id': video_id, 'title': f'Benchmark {kind} {label}', 'duration': meta['duration'], 'kind': kind}
+        sizes = meta['sizes']
+        if kind == 'progressive':
+            info['formats'] = [{
+                'format_id': 'progressive', 'url': f'{media}/progressive.mp4', 'ext': 'mp4',
+                'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'width': 640, 'height': 360, 'fps': 25,
+                'filesize': sizes['progressive.mp4'],
+            }]
+        elif kind == 'split':
+            info['formats'] = [{
+                'format_id': 'video', 'url': f'{media}/video.mp4', 'ext': 'mp4',
+                'vcodec': 'avc1', 'acodec': 'none', 'width': 640, 'height': 360, 'fps': 25,
+                'filesize': sizes['video.mp4'],
+            }, {
+                'format_id': 'audio', 'url': f'{media}/audio.m4a', 'ext': 'm4a',
+                'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': AUDIO_BITRATE / 1000,
+                'filesize': sizes['audio.m4a'],
+            }]
+        elif kind == 'dash':
+            info['manifest'] = f'{media}/dash/manifest.mpd'
+        else:
+            info['manifest'] = f'{media}/hls/index.m3u8'
+        return info
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'yt-dlp-web-bench'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        path = self.path.split('?')[0]
+        try:
+            if path.startswith('/api/'):
+                if server.error_rate and random.random() < server.error_rate:
+                    return self.send_bytes(403, b'Forbidden', 'text/plain', send_body)
+                info = server.library.describe(path[len('/api/'):])
+                if info is None:
+                    return self.send_bytes(404, b'Unknown video', 'text/plain', send_body)
+                return self.send_bytes(200, json.dumps(info).encode(), 'application/json', send_body)
+            if path.startswith('/bench/'):
+                page = f'<html><body>Benchmark video {path[len("/bench/"):]}</body></html>'
+                return self.send_bytes(200, page.encode(), 'text/html', send_body)
+            if path.startswith('/media/'):
+                label, _, name = path[len('/media/'):].partition('/')
+                file_path = server.library.path(label, name)
+                if file_path is None:
+                    return self.send_bytes(404, b'Not found', 'text/plain', send_body)
+                return self.send_file(file_path, send_body)
+            self.send_bytes(404, b'Not found', 'text/plain', send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send_bytes(self, status, data, content_type, send_body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def send_file(self, path, send_body):
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', '').strip())
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            if start > end or start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream'))
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not send_body:
+            return
+
+        # Each response gets the configured bandwidth on its own, like
+        # separate connections to a CDN would
+        started = time.monotonic()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                remaining -= len(chunk)
+                if self.server.bandwidth:
+                    delay = started + sent / self.server.bandwidth - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+        self.server.add_sent(sent)
+
+
+class MediaServer(ThreadingHTTPServer):
+    """The media server. ``bandwidth`` is bytes/s per response (0 = unlimited),
+    ``latency`` seconds before each response and ``error_rate`` the share of
+    extractions answered with 403."""
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, media_dir=None, bandwidth=0, latency=0, error_rate=0):
+        super().__init__((host, port), MediaRequestHandler)
+        self.library = MediaLibrary(media_dir or os.path.join(tempfile.gettempdir(), 'yt-dlp-web-bench-media'))
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats_lock = Lock()
+        self.bytes_sent = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def add_sent(self, count):
+        with self.stats_lock:
+            self.bytes_sent += count
+
+    def start(self):
+        Thread(target=self.serve_forever, name='media-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--media-dir', help='where generated videos are kept (default: <tmp>/yt-dlp-web-bench-media)')
+    parser.add_argument('--bandwidth', default='0', help='bytes/s per response, e.g. 5M (default: unlimited)')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before each response')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of extractions answered with 403')
+    parser.add_argument('--sizes', default='', help='comma separated sizes to generate up front, e.g. 5M,20M')
+    args = parser.parse_args()
+
+    server = MediaServer(args.host, args.port, args.media_dir, parse_size(args.bandwidth), args.latency,
+                         args.error_rate)
+    for label in filter(None, args.sizes.split(',')):
+        server.library.get(label.strip().upper())
+    print(f"🎬 Serving benchmark media on {server.base_url}, e.g. {server.base_url}/bench/split-5M-demo")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,254 @@
+"""Offline benchmark of the /download and /progress paths.
+
+Starts the local media server, starts the app against it (Flask's server or
+gunicorn) with the stub extractor plugin on its path, runs a batch of
+downloads with their progress streams and writes the results to a JSON file
+that benchmarks/compare.py can hold against other runs::
+
+    python -m benchmarks.run --jobs 20 --concurrency 4 --kind split --size 5M
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks.load import ProcessTreeSampler, run_job, run_load, summarize
+from benchmarks.media_server import KINDS, MediaServer, parse_size
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_DIR, 'benchmarks')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def git_revision():
+    """(commit, dirty) of the tree being benchmarked, (None, None) outside git"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                                check=True, capture_output=True, text=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def start_app(args, port, work_dir):
+    """Start the app as a child process with its logs going to work_dir/app.log"""
+    env = {
+        **os.environ,
+        'PORT': str(port),
+        # The stub extractor is a yt-dlp plugin found through the path
+        'PYTHONPATH': os.pathsep.join(filter(None, [BENCH_DIR, REPO_DIR, os.environ.get('PYTHONPATH')])),
+        # A fresh cache every run, so nothing is served from a previous one
+        'CACHE_DIR': os.path.join(work_dir, 'cache'),
+        'SCRATCH_DIR': os.path.join(work_dir, 'scratch'),
+        'METRICS_DIR': os.path.join(work_dir, 'metrics'),
+    }
+    if args.server == 'gunicorn':
+        env['WEB_CONCURRENCY'] = str(args.workers)
+        if args.workers > 1:
+            env.setdefault('STATE_BACKEND', f"sqlite:///{os.path.join(work_dir, 'state.db')}")
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app']
+    else:
+        command = [sys.executable, 'app.py']
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+
+    log_file = open(os.path.join(work_dir, 'app.log'), 'w')
+    process = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    log_file.close()
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'The app exited on startup, see {work_dir}/app.log')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/strategies')
+            if conn.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_app(process)
+    raise RuntimeError(f'The app did not answer within {args.startup_timeout}s, see {work_dir}/app.log')
+
+
+def stop_app(process):
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def video_urls(media_url, kinds, size, count, distinct, prefix):
+    """URLs of the videos to download. With ``distinct`` set they repeat, to exercise the cache."""
+    urls = []
+    for i in range(count):
+        kind = kinds[i % len(kinds)]
+        nonce = f'{prefix}{i % distinct}' if distinct else f'{prefix}{i}'
+        urls.append(f'{media_url}/bench/{kind}-{size}-{nonce}')
+    return urls
+
+
+def print_summary(summary):
+    def seconds(dist, name):
+        if not dist:
+            return f'  {name:<18} -'
+        return (f"  {name:<18} p50 {dist['p50']:.3f}s  p95 {dist['p95']:.3f}s  p99 {dist['p99']:.3f}s"
+                f"  max {dist['max']:.3f}s")
+
+    print(f"\n📊 {summary['ok']}/{summary['jobs']} jobs ok in {summary['wall_s']:.1f}s")
+    print(seconds(summary['ttfb_s'], 'time to first byte'))
+    print(seconds(summary['total_s'], 'total latency'))
+    print(f"  {'peak RSS':<18} {summary['peak_rss_bytes'] / 1048576:.1f} MiB")
+    print(f"  {'CPU per job':<18} {summary['cpu_s_per_job']:.3f}s")
+    sse = summary['sse']
+    if sse and sse['events_per_job']:
+        print(f"  {'SSE per job':<18} {sse['events_per_job']['mean']:.1f} events,"
+              f" {sse['bytes_per_job']['mean']:.0f} bytes")
+        print(seconds(sse['first_event_s'], 'first SSE event'))
+        print(seconds(sse['final_event_lag_s'], 'final event lag'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--server', choices=('dev', 'gunicorn'), default='dev',
+                        help="Flask's server in one process, or gunicorn.conf.py (default: dev)")
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes (default: 2)')
+    parser.add_argument('--jobs', type=int, default=20, help='downloads to measure (default: 20)')
+    parser.add_argument('--concurrency', type=int, default=4, help='downloads running at once (default: 4)')
+    parser.add_argument('--warmup', type=int, default=1, help='downloads run first and not measured (default: 1)')
+    parser.add_argument('--kind', default='split',
+                        help=f"media kind, or a comma separated mix: {', '.join(KINDS)} (default: split)")
+    parser.add_argument('--size', default='5M', help='size of each video, e.g. 500K, 5M (default: 5M)')
+    parser.add_argument('--type', choices=('video', 'audio'), default='video')
+    parser.add_argument('--mode', choices=('compatible', 'fast'), help="processing mode (default: the app's)")
+    parser.add_argument('--stream', action='store_true', help='ask for live streaming (stream=1)')
+    parser.add_argument('--no-sse', action='store_true', help="don't open progress streams, to measure their cost")
+    parser.add_argument('--distinct', type=int, default=0,
+                        help='cycle through this many videos instead of a new one per job (default: 0)')
+    parser.add_argument('--bandwidth', default='0', help='media bytes/s per connection, e.g. 10M (default: unlimited)')
+    parser.add_argument('--latency', type=float, default=0, help='media server seconds per response (default: 0)')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of extractions answered with 403 (default: 0)')
+    parser.add_argument('--media-dir', help='where generated videos are kept (default: <tmp>/yt-dlp-web-bench-media)')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the app, repeatable (e.g. DOWNLOAD_WORKERS=8)')
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--label', help='free text stored with the results')
+    parser.add_argument('--output', help='results file (default: benchmarks/results/<time>-<commit>.json)')
+    parser.add_argument('--keep', action='store_true', help="keep the run's scratch directory and app log")
+    args = parser.parse_args()
+
+    kinds = [kind.strip() for kind in args.kind.split(',')]
+    for kind in kinds:
+        if kind not in KINDS:
+            parser.error(f'unknown kind {kind!r}')
+    size = args.size.upper()
+    parse_size(size)
+    params = {'type': args.type}
+    if args.mode:
+        params['mode'] = args.mode
+    if args.stream:
+        params['stream'] = '1'
+
+    media = MediaServer(media_dir=args.media_dir, bandwidth=parse_size(args.bandwidth), latency=args.latency,
+                        error_rate=args.error_rate)
+    # Generate the media before anything is timed
+    media.library.get(size)
+    media.start()
+    work_dir = tempfile.mkdtemp(prefix='yt-dlp-web-bench-')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    print(f"🚀 Starting the app ({args.server}) on {base_url}, media on {media.base_url}")
+    process = start_app(args, port, work_dir)
+    try:
+        for url in video_urls(media.base_url, kinds, size, args.warmup, 0, 'warmup'):
+            warmup = run_job(base_url, url, params, sse=not args.no_sse)
+            if warmup['error']:
+                print(f"⚠️ Warmup download failed: {warmup['error']}")
+
+        urls = video_urls(media.base_url, kinds, size, args.jobs, args.distinct, 'job')
+        print(f"⏱️ Running {args.jobs} downloads, {args.concurrency} at a time...")
+        sampler = ProcessTreeSampler(process.pid).start()
+        cpu_before = sampler.cpu_seconds()
+        media_before = media.bytes_sent
+        started = time.monotonic()
+        results = run_load(base_url, urls, params, args.concurrency, sse=not args.no_sse)
+        wall = time.monotonic() - started
+        cpu = sampler.cpu_seconds() - cpu_before
+        sampler.stop()
+        summary = summarize(results, cpu, sampler.peak_rss, wall)
+        summary['media_bytes_served'] = media.bytes_sent - media_before
+    finally:
+        stop_app(process)
+        media.stop()
+
+    commit, dirty = git_revision()
+    report = {
+        'benchmark': 'download',
+        'format': 1,
+        'label': args.label,
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {
+            'server': args.server,
+            'workers': args.workers if args.server == 'gunicorn' else 1,
+            'jobs': args.jobs,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'kinds': kinds,
+            'size': size,
+            'params': params,
+            'sse': not args.no_sse,
+            'distinct': args.distinct,
+            'bandwidth': parse_size(args.bandwidth),
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'env': args.env,
+        },
+        'summary': summary,
+        'jobs': results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print_summary(summary)
+    for result in results:
+        if result['error']:
+            print(f"  ❌ {result['url']}: {result['error']}")
+    print(f"\n💾 Results saved to {output}")
+    if args.keep:
+        print(f"📁 App log and scratch files kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
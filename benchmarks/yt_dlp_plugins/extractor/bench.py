@@ -0,0 +1,32 @@
+"""yt-dlp extractor for the benchmark media server (benchmarks/media_server.py).
+
+yt-dlp picks it up as a plugin when ``benchmarks/`` is on PYTHONPATH, which
+the benchmark runner sets for the app it starts. The app's strategy loop
+then runs unchanged against local videos; the strategies' YouTube
+extractor_args simply don't apply here.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchIE(InfoExtractor):
+    IE_NAME = 'bench'
+    IE_DESC = 'yt-dlp-web benchmark media server'
+    _VALID_URL = r'(?P<base>https?://[^/]+)/bench/(?P<id>(?P<kind>progressive|split|dash|hls)-\d+[KMG]?-[\w-]+)'
+
+    def _real_extract(self, url):
+        base, video_id, kind = self._match_valid_url(url).group('base', 'id', 'kind')
+        # Extraction is one API round trip, so the server's latency and
+        # error injection apply to it like they would to a real site
+        info = self._download_json(f'{base}/api/{video_id}', video_id)
+        if kind == 'dash':
+            formats = self._extract_mpd_formats(base + info['manifest'], video_id, mpd_id='dash')
+        elif kind == 'hls':
+            formats = self._extract_m3u8_formats(base + info['manifest'], video_id, 'mp4', m3u8_id='hls')
+        else:
+            formats = [{**f, 'url': base + f['url']} for f in info['formats']]
+        return {
+            'id': video_id,
+            'title': info['title'],
+            'duration': info['duration'],
+            'formats': formats,
+        }
@@ -0,0 +1,253 @@
+import io
+import os
+import time
+import uuid
+import zipfile
+from werkzeug.http import http_date, parse_date
+from werkzeug.wsgi import wrap_file
+from flask import Response, request
+
+# Chunk size used when a range has to be streamed by hand
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def parse_byte_ranges(header, size):
+    """Parse a Range header into a list of (start, end) pairs, end exclusive.
+
+    Returns None when the header should be ignored (missing, malformed or not
+    a bytes range) and an empty list when no range is satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first.isdigit() or (not first and last.isdigit())):
+            return None
+        if last and not last.isdigit():
+            return None
+
+        if not first:
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                continue
+            ranges.append((max(size - length, 0), size))
+            continue
+
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = min(int(last) + 1, size) if last else size
+        ranges.append((start, end))
+
+    return _coalesce(ranges)
+
+
+def _coalesce(ranges):
+    """Merge overlapping or adjacent ranges so a client can't make us repeat bytes"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(if_range, etag, mtime):
+    """Check whether an If-Range validator still matches the file"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        # Strong comparison only, weak tags never match
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    date = parse_date(if_range)
+    return date is not None and int(mtime) == int(date.timestamp())
+
+
+class _CleanupFile(io.FileIO):
+    """Raw file that runs a callback once it has been closed.
+
+    The WSGI server closes the response body when it is done with it, so this
+    is where scratch files get removed. Being a real file keeps fileno()
+    available for sendfile.
+    """
+
+    def __init__(self, path, on_close=None):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+
+    def close(self):
+        super().close()
+        callback, self._on_close = self._on_close, None
+        if callback:
+            callback()
+
+
+class _RangeBody:
+    """Response body made of literal byte strings and (start, end) file slices"""
+
+    def __init__(self, f, parts):
+        self.f = f
+        self.parts = parts
+
+    def __iter__(self):
+        for part in self.parts:
+            if isinstance(part, bytes):
+                yield part
+                continue
+            start, end = part
+            self.f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = self.f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    def close(self):
+        self.f.close()
+
+
+def send_download(path, filename, mimetype, on_close=None, headers=None):
+    """Stream a file from disk as an attachment with HTTP Range support.
+
+    Full responses and ranges that run to the end of the file go through
+    wsgi.file_wrapper so servers that support it can use sendfile. Other
+    ranges are read from disk in small chunks. ``on_close`` runs once the
+    server has closed the response body, which is where callers delete
+    scratch files.
+    """
+    try:
+        f = _CleanupFile(path, on_close)
+    except Exception:
+        if on_close:
+            on_close()
+        raise
+
+    try:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+
+        response_headers = {
+            "Content-Disposition": f"attachment; filename=\"{filename}\"",
+            "Accept-Ranges": "bytes",
+            "ETag": etag,
+            "Last-Modified": http_date(stat.st_mtime),
+            "Cache-Control": "no-cache, no-store, must-revalidate",
+            "Pragma": "no-cache",
+            "Expires": "0"
+        }
+        if headers:
+            response_headers.update(headers)
+
+        ranges = None
+        if _if_range_matches(request.headers.get('If-Range'), etag, stat.st_mtime):
+            ranges = parse_byte_ranges(request.headers.get('Range'), size)
+
+        if ranges == []:
+            f.close()
+            response = Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+        elif not ranges or ranges == [(0, size)]:
+            response = Response(wrap_file(request.environ, f, STREAM_CHUNK_SIZE), mimetype=mimetype,
+                                headers=response_headers, direct_passthrough=True)
+            response.content_length = size
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            if end == size:
+                # Tail of the file, safe to hand to the server's file wrapper
+                f.seek(start)
+                body = wrap_file(request.environ, f, STREAM_CHUNK_SIZE)
+            else:
+                body = _RangeBody(f, [(start, end)])
+            response = Response(body, status=206, mimetype=mimetype,
+                                headers=response_headers, direct_passthrough=True)
+            response.headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+            response.content_length = end - start
+        else:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for start, end in ranges:
+                parts.append((f"\r\n--{boundary}\r\n"
+                              f"Content-Type: {mimetype}\r\n"
+                              f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode())
+                parts.append((start, end))
+            parts.append(f"\r\n--{boundary}--\r\n".encode())
+            length = sum(len(p) if isinstance(p, bytes) else p[1] - p[0] for p in parts)
+
+            response = Response(_RangeBody(f, parts), status=206,
+                                headers=response_headers, direct_passthrough=True)
+            response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+            response.content_length = length
+    except Exception:
+        f.close()
+        raise
+
+    return response
+
+
+class _ZipSink(io.RawIOBase):
+    """Unseekable buffer that zipfile writes into and zip_stream empties"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def zip_stream(members):
+    """Build a ZIP archive on the fly, yielding its bytes as they are produced.
+
+    ``members`` yields (name, source) pairs where source is a file path or
+    bytes, and may block until the next member is ready. Members are stored
+    uncompressed (media doesn't compress any further) and, as the output
+    can't seek, their sizes follow the data in data descriptors. Nothing
+    beyond one read chunk is held in memory.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name, source in members:
+            if isinstance(source, bytes):
+                zf.writestr(name, source)
+            else:
+                info = zipfile.ZipInfo(name, date_time=time.localtime(os.path.getmtime(source))[:6])
+                with open(source, 'rb') as src, zf.open(info, 'w', force_zip64=True) as dst:
+                    while True:
+                        chunk = src.read(STREAM_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
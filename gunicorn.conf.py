@@ -0,0 +1,61 @@
+import os
+import shutil
+import tempfile
+from logs import get_logger, setup_logging
+
+# Production server: gunicorn -c gunicorn.conf.py app:app
+#
+# Progress streams (SSE) hold a connection open for as long as a download
+# runs, so each worker is a gevent worker: an idle stream is a parked
+# greenlet rather than a thread, and a worker keeps thousands of them open.
+# gevent patches threading, sockets and subprocesses, which is all the job
+# queue, the state backends and the downloads block on.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('WEB_CONNECTIONS', 2000))
+threads = int(os.environ.get('WEB_THREADS', 32))
+
+# Streams past the cap get a 503 and the page polls /jobs/<id> instead. Under
+# gevent a tenth of the connections is left for downloads and the other
+# endpoints; a gthread worker (WEB_WORKER_CLASS=gthread) has a thread per
+# stream, so there half of its threads are.
+if worker_class == 'gthread':
+    os.environ.setdefault('SSE_MAX_STREAMS', str(max(1, threads // 2)))
+else:
+    os.environ.setdefault('SSE_MAX_STREAMS', str(max(1, worker_connections * 9 // 10)))
+
+# Only the worker's heartbeat is timed, a long download or stream is fine
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# Each worker builds its own job queue and threads, which don't survive a fork
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+# The same log lines as the app writes, so the master's notes below match them
+setup_logging(os.environ.get('LOG_LEVEL', 'info'), os.environ.get('LOG_FORMAT', 'text'))
+log = get_logger('gunicorn')
+
+# Workers only see each other's progress and jobs through a shared state
+# backend, so default to an SQLite file that every worker on this machine opens
+if workers > 1 and not os.environ.get('STATE_BACKEND'):
+    os.environ['STATE_BACKEND'] = f"sqlite:///{os.path.join(tempfile.gettempdir(), 'yt-dlp-web-state.db')}"
+    log.info("🗄️ Sharing state between workers", workers=workers, backend=os.environ['STATE_BACKEND'])
+elif workers > 1 and os.environ['STATE_BACKEND'] == 'memory':
+    log.warning("⚠️ STATE_BACKEND=memory with several workers: progress only works on the worker that runs the download",
+                workers=workers)
+
+# /metrics adds up the numbers every worker writes here
+if workers > 1 and not os.environ.get('METRICS_DIR'):
+    os.environ['METRICS_DIR'] = os.path.join(tempfile.gettempdir(), 'yt-dlp-web-metrics')
+
+
+def on_starting(server):
+    # Counters start from zero with every server start
+    if os.environ.get('METRICS_DIR'):
+        shutil.rmtree(os.environ['METRICS_DIR'], ignore_errors=True)
@@ -0,0 +1,285 @@
+import math
+import queue
+import time
+from threading import Event, Lock, Thread
+from logs import get_logger, log_context
+
+log = get_logger('jobs')
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when too many jobs are already waiting"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Download queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once it has been cancelled"""
+
+
+# Parts of a job's result that other worker processes need to serve its file
+RECORD_RESULT_FIELDS = ('path', 'filename', 'mimetype', 'size', 'cache', 'processing')
+
+
+class Job:
+    """A single queued download and its outcome"""
+
+    def __init__(self, task_id, url, download_type, params=None):
+        self.task_id = task_id
+        self.url = url
+        self.download_type = download_type
+        self.params = params or {}
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.release = None
+        self.on_cancel = None
+        self.remote = False
+        self.cancel_event = Event()
+        self.done = Event()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def to_dict(self):
+        data = {
+            'task_id': self.task_id,
+            'url': self.url,
+            'type': self.download_type,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            **self.params,
+        }
+        if self.error:
+            data['error'] = self.error
+        if self.result:
+            data['filename'] = self.result['filename']
+            data['size'] = self.result['size']
+            if self.result.get('processing'):
+                data['processing'] = self.result['processing']
+        return data
+
+    def to_record(self):
+        """JSON-friendly snapshot for the shared state backend"""
+        record = {'job': self.to_dict(), 'result': None}
+        if self.result:
+            record['result'] = {k: self.result[k] for k in RECORD_RESULT_FIELDS if k in self.result}
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """Read-only copy of a job that runs in another worker process"""
+        data = dict(record['job'])
+        job = cls(data.pop('task_id'), data.pop('url'), data.pop('type'))
+        job.status = data.pop('status')
+        job.error = data.pop('error', None)
+        job.created = data.pop('created')
+        job.started = data.pop('started')
+        job.finished = data.pop('finished')
+        for field in ('filename', 'size', 'processing'):
+            data.pop(field, None)
+        job.params = data
+        job.result = record.get('result')
+        job.remote = True
+        if job.status in ('complete', 'error', 'cancelled'):
+            job.done.set()
+        return job
+
+
+class JobQueue:
+    """Bounded pool of worker threads running download jobs.
+
+    ``handler(job)`` does the actual work and returns ``(result, release)``:
+    a dict describing the finished file and a callable that frees it (or
+    None). Finished jobs are kept for ``result_ttl`` seconds so the file
+    can be fetched, then released and forgotten.
+
+    Jobs that need no worker (a cached file, or a download another job is
+    already running) are tracked with ``add()`` and get their outcome from
+    ``finish()``.
+    """
+
+    def __init__(self, handler, workers=4, max_queued=32, result_ttl=600, on_queued=None, on_finished=None):
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self.on_queued = on_queued
+        self.on_finished = on_finished
+        self.queue = queue.Queue()
+        self.jobs = {}
+        self.lock = Lock()
+        self.queued = 0
+        self.running = 0
+        # Rolling average of job durations, used to estimate Retry-After
+        self.avg_duration = None
+
+        for i in range(workers):
+            Thread(target=self._worker, name=f'download-worker-{i}', daemon=True).start()
+        Thread(target=self._reaper, name='job-reaper', daemon=True).start()
+
+    def submit(self, task_id, url, download_type, **params):
+        """Queue a job, raising QueueFull when the queue is at its limit"""
+        with self.lock:
+            existing = self.jobs.get(task_id)
+            if existing is not None and not existing.done.is_set():
+                return existing
+            if self.queued >= self.max_queued:
+                raise QueueFull(self._retry_after())
+            job = Job(task_id, url, download_type, params)
+            self.jobs[task_id] = job
+            self.queued += 1
+            position = self.queued
+        if existing is not None:
+            # Reusing the task_id of a finished job replaces it
+            self._release(existing)
+        if self.on_queued:
+            self.on_queued(job, position)
+        self.queue.put(job)
+        return job
+
+    def add(self, task_id, url, download_type, **params):
+        """Track a running job without queueing it. Returns None if an unfinished job already has task_id."""
+        with self.lock:
+            existing = self.jobs.get(task_id)
+            if existing is not None and not existing.done.is_set():
+                return None
+            job = Job(task_id, url, download_type, params)
+            job.status = 'running'
+            job.started = time.time()
+            self.jobs[task_id] = job
+        if existing is not None:
+            self._release(existing)
+        return job
+
+    def finish(self, job, result=None, release=None, error=None):
+        """Record the outcome of a job from add(): its result, or the error it failed with.
+
+        Only the first call counts, later ones are ignored.
+        """
+        with self.lock:
+            if job.finished is not None:
+                return
+            job.finished = time.time()
+        job.result, job.release = result, release
+        if error is None:
+            job.status = 'complete'
+        else:
+            job.status = 'cancelled' if job.cancelled else 'error'
+            job.error = error
+        self._done(job)
+
+    def get(self, task_id):
+        with self.lock:
+            return self.jobs.get(task_id)
+
+    def active(self):
+        """Jobs that haven't finished yet"""
+        with self.lock:
+            return [job for job in self.jobs.values() if not job.done.is_set()]
+
+    def cancel(self, task_id):
+        """Ask a job to stop. Queued jobs never start, running ones stop at the next check."""
+        job = self.get(task_id)
+        if job is None:
+            return None
+        job.cancel_event.set()
+        if job.on_cancel:
+            job.on_cancel()
+        return job
+
+    def discard(self, task_id):
+        """Forget a job right away and free its result"""
+        with self.lock:
+            job = self.jobs.pop(task_id, None)
+        if job is not None:
+            job.cancel_event.set()
+            self._release(job)
+
+    def _retry_after(self):
+        """Rough guess at how long until a queue slot frees up. Caller holds the lock."""
+        duration = self.avg_duration or 30.0
+        waves = (self.queued + 1) / max(self.workers, 1)
+        return min(max(int(math.ceil(duration * waves)), 1), 300)
+
+    def _release(self, job):
+        release, job.release = job.release, None
+        if release:
+            try:
+                release()
+            except Exception as e:
+                log.warning("⚠️ Error releasing job", task_id=job.task_id, error=str(e))
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            # Everything the job logs, down to yt-dlp's own output, carries its task_id
+            with log_context(task_id=job.task_id):
+                self._run(job)
+
+    def _run(self, job):
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+        job.started = time.time()
+        try:
+            if job.cancelled:
+                raise JobCancelled('Download cancelled')
+            job.status = 'running'
+            job.result, job.release = self.handler(job)
+            job.status = 'complete'
+        except JobCancelled as e:
+            job.status = 'cancelled'
+            job.error = str(e)
+        except Exception as e:
+            job.status = 'error'
+            job.error = str(e)
+        finally:
+            job.finished = time.time()
+            with self.lock:
+                self.running -= 1
+                if job.status == 'complete':
+                    duration = job.finished - job.started
+                    self.avg_duration = duration if self.avg_duration is None else \
+                        0.8 * self.avg_duration + 0.2 * duration
+            self._done(job)
+
+    def _done(self, job):
+        # A job cancelled while it was finishing has no use for the file
+        if job.cancelled and job.status == 'complete':
+            job.status = 'cancelled'
+            job.error = 'Download cancelled'
+            self._release(job)
+        if self.on_finished:
+            self.on_finished(job)
+        job.done.set()
+
+    def _reaper(self):
+        while True:
+            time.sleep(min(self.result_ttl, 30))
+            cutoff = time.time() - self.result_ttl
+            with self.lock:
+                expired = [job for job in self.jobs.values()
+                           if job.done.is_set() and job.finished < cutoff]
+                for job in expired:
+                    del self.jobs[job.task_id]
+            for job in expired:
+                self._release(job)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'running': self.running,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'jobs': len(self.jobs),
+            }
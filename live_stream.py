@@ -0,0 +1,217 @@
+import shutil
+import subprocess
+from threading import Thread
+from yt_dlp.networking import Request
+from processing import plan_output
+from logs import get_logger
+
+log = get_logger('live_stream')
+
+# Protocols we can read ourselves, and the ones ffmpeg can read as inputs
+DIRECT_PROTOCOLS = ('http', 'https')
+FFMPEG_PROTOCOLS = ('http', 'https', 'm3u8', 'm3u8_native')
+
+READ_SIZE = 64 * 1024
+
+# ffmpeg muxer for each output extension, where the names differ
+PIPE_MUXERS = {'m4a': 'mp4', 'mkv': 'matroska'}
+
+
+def _selected_formats(info):
+    """The format(s) yt-dlp picked for this info dict"""
+    return info.get('requested_formats') or [info]
+
+
+def _has_video(fmt):
+    return fmt.get('vcodec') not in (None, 'none') or (fmt.get('vcodec') is None and fmt.get('acodec') is None)
+
+
+def _stream_codec(formats, field):
+    """The codec of the selected formats that carry this kind of stream"""
+    codecs = [f.get(field) for f in formats]
+    return next((c for c in codecs if c not in (None, 'none')), None if None in codecs else 'none')
+
+
+def plan_stream(info, download_type, mode='compatible'):
+    """Work out how to stream the selected formats while they download.
+
+    Returns None when streaming isn't possible (e.g. DASH segments or no
+    ffmpeg), otherwise a dict with ``kind`` ('direct' or 'ffmpeg'), the
+    output ``ext``, the ``processing`` path (see processing.plan_output)
+    and what's needed to produce it.
+    """
+    formats = _selected_formats(info)
+    if any(not f.get('url') for f in formats):
+        return None
+
+    vcodec, acodec = _stream_codec(formats, 'vcodec'), _stream_codec(formats, 'acodec')
+    ext = formats[0].get('ext') if len(formats) == 1 else None
+    processing, target_ext, codec_args = plan_output(download_type, mode, vcodec, acodec, ext)
+
+    if processing == 'direct':
+        fmt = formats[0]
+        # Already in the container the client asked for: forward the bytes as they are
+        if fmt.get('protocol') in DIRECT_PROTOCOLS and (download_type == 'audio' or _has_video(fmt)):
+            return {'kind': 'direct', 'ext': target_ext, 'format': fmt,
+                    'size': fmt.get('filesize'), 'processing': processing}
+        processing = 'remux'
+
+    if any(f.get('protocol') not in FFMPEG_PROTOCOLS for f in formats):
+        return None
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+
+    # -xerror makes ffmpeg exit non-zero on input errors instead of ending the output quietly
+    cmd = [ffmpeg, '-hide_banner', '-loglevel', 'error', '-xerror', '-nostdin']
+    for fmt in formats:
+        headers = ''.join(f'{k}: {v}\r\n' for k, v in (fmt.get('http_headers') or {}).items())
+        if headers:
+            cmd += ['-headers', headers]
+        cmd += ['-reconnect', '1', '-i', fmt['url']]
+    if info.get('title'):
+        cmd += ['-metadata', f"title={info['title']}"]
+
+    if download_type != 'audio' and len(formats) > 1:
+        cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    cmd += codec_args
+    if target_ext in ('mp4', 'm4a'):
+        # Fragmented MP4 can be written front to back without seeking
+        cmd += ['-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+    cmd += ['-f', PIPE_MUXERS.get(target_ext, target_ext), 'pipe:1']
+    return {'kind': 'ffmpeg', 'ext': target_ext, 'cmd': cmd, 'size': None, 'processing': processing}
+
+
+class LiveBody:
+    """WSGI response body that produces bytes while the download runs.
+
+    Subclasses provide ``_chunks()``, a generator of the bytes to send.
+    ``prime()`` fetches the first chunk before the response is committed,
+    so a source that fails straight away (e.g. a 403 on the media URL) can
+    still be retried with another strategy. ``on_progress(sent, total)``
+    is called as bytes go out and ``on_close(ok)`` once the body is closed.
+    """
+
+    def __init__(self, on_progress=None, on_close=None):
+        self.on_progress = on_progress
+        self.on_close = on_close
+        self.sent = 0
+        self.total = None
+        self.finished = False
+        self._pending = None
+        self._closed = False
+
+    def _cleanup(self):
+        pass
+
+    def prime(self):
+        self._iter = self._chunks()
+        self._pending = next(self._iter, b'')
+        return self
+
+    def __iter__(self):
+        try:
+            chunk = self._pending
+            self._pending = None
+            while chunk:
+                self.sent += len(chunk)
+                if self.on_progress:
+                    self.on_progress(self.sent, self.total)
+                yield chunk
+                chunk = next(self._iter, b'')
+            self.finished = True
+        except Exception as e:
+            log.error("❌ Streaming error", error=str(e))
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._cleanup()
+        if self.on_close:
+            self.on_close(self.finished)
+
+
+class DirectBody(LiveBody):
+    """Forward a single progressive format straight from the source.
+
+    The file is fetched in ``chunk_size`` ranges like yt-dlp's own
+    http_chunk_size, which avoids per-connection throttling on YouTube.
+    Servers that ignore Range just send the whole file in one go.
+    """
+
+    def __init__(self, ydl, fmt, chunk_size, **kwargs):
+        super().__init__(**kwargs)
+        self.ydl = ydl
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.total = fmt.get('filesize')
+        self._response = None
+
+    def _open(self, start):
+        headers = dict(self.fmt.get('http_headers') or {})
+        if self.chunk_size:
+            headers['Range'] = f'bytes={start}-{start + self.chunk_size - 1}'
+        self._response = self.ydl.urlopen(Request(self.fmt['url'], headers=headers))
+        return self._response
+
+    def _chunks(self):
+        start = 0
+        while True:
+            response = self._open(start)
+            ranged = response.status == 206
+            content_range = response.headers.get('Content-Range') or ''
+            if ranged and '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+                self.total = int(content_range.rsplit('/', 1)[1])
+            received = 0
+            while True:
+                data = response.read(READ_SIZE)
+                if not data:
+                    break
+                received += len(data)
+                yield data
+            response.close()
+            start += received
+            if not ranged or received == 0 or (self.total is not None and start >= self.total):
+                return
+
+    def _cleanup(self):
+        if self._response is not None:
+            self._response.close()
+        self.ydl.close()
+
+
+class FFmpegBody(LiveBody):
+    """Stream whatever ffmpeg writes to stdout"""
+
+    def __init__(self, cmd, ydl=None, **kwargs):
+        super().__init__(**kwargs)
+        self.ydl = ydl
+        self.proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                     stdin=subprocess.DEVNULL)
+        self.stderr = b''
+        # Drain stderr in the background so ffmpeg never blocks on it
+        self._stderr_thread = Thread(target=self._read_stderr, daemon=True)
+        self._stderr_thread.start()
+
+    def _read_stderr(self):
+        self.stderr = self.proc.stderr.read()
+
+    def _chunks(self):
+        while True:
+            data = self.proc.stdout.read1(READ_SIZE)
+            if not data:
+                break
+            yield data
+        if self.proc.wait() != 0:
+            self._stderr_thread.join(timeout=1)
+            raise Exception(f"ffmpeg failed: {self.stderr.decode(errors='replace').strip()[-500:]}")
+
+    def _cleanup(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdout.close()
+        if self.ydl is not None:
+            self.ydl.close()
@@ -0,0 +1,123 @@
+import contextvars
+import json
+import logging
+import sys
+import time
+from contextlib import contextmanager
+
+# Fields such as task_id that every log line written in this context carries
+_context = contextvars.ContextVar('log_context', default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (e.g. task_id) to every log line written inside the block.
+
+    The context belongs to the current thread; threads started inside the
+    block don't inherit it.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind_context(**fields):
+    """Add fields to the current context until reset_context(token) is called"""
+    return _context.set({**_context.get(), **fields})
+
+
+def reset_context(token):
+    _context.reset(token)
+
+
+class StructuredLogger:
+    """Logger taking a message plus keyword fields: ``log.info('✅ Done', size=123)``"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, message, fields, exc_info=False):
+        if self.logger.isEnabledFor(level):
+            self.logger.log(level, message, exc_info=exc_info, extra={'fields': fields})
+
+    def debug(self, message, **fields):
+        self._log(logging.DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        self._log(logging.INFO, message, fields)
+
+    def warning(self, message, **fields):
+        self._log(logging.WARNING, message, fields)
+
+    def error(self, message, **fields):
+        self._log(logging.ERROR, message, fields)
+
+    def exception(self, message, **fields):
+        self._log(logging.ERROR, message, fields, exc_info=True)
+
+
+def get_logger(name):
+    return StructuredLogger(f'yt-dlp-web.{name}')
+
+
+class StructuredFormatter(logging.Formatter):
+    """One line per record: readable text with key=value fields, or a JSON object"""
+
+    def __init__(self, json_lines=False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record):
+        fields = {**_context.get(), **getattr(record, 'fields', {})}
+        fields = {k: v for k, v in fields.items() if v is not None}
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z'
+        if self.json_lines:
+            data = {'ts': timestamp, 'level': record.levelname.lower(), 'logger': record.name,
+                    'msg': record.getMessage(), **fields}
+            if record.exc_info:
+                data['exc'] = self.formatException(record.exc_info)
+            return json.dumps(data, default=str, ensure_ascii=False)
+        line = f"{timestamp} {record.levelname:<7} {record.getMessage()}"
+        if fields:
+            line += '  ' + ' '.join(f'{k}={_text_value(v)}' for k, v in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def _text_value(value):
+    text = str(value)
+    return json.dumps(text, ensure_ascii=False) if not text or any(c in text for c in ' "=') else text
+
+
+def setup_logging(level='info', fmt='text'):
+    """Send the app's logs to stdout at ``level``, as 'text' or 'json' lines"""
+    logger = logging.getLogger('yt-dlp-web')
+    if logger.handlers:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StructuredFormatter(json_lines=fmt == 'json'))
+    logger.addHandler(handler)
+    logger.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    logger.propagate = False
+
+
+class YtDlpLogger:
+    """Route yt-dlp's own output through our logs (its screen output is debug-level noise to us)"""
+
+    def __init__(self, log):
+        self.log = log
+
+    def debug(self, message):
+        self.log.debug(message.removeprefix('[debug] '))
+
+    def info(self, message):
+        self.log.debug(message)
+
+    def warning(self, message):
+        self.log.warning(message)
+
+    def error(self, message):
+        self.log.error(message)
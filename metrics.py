@@ -0,0 +1,282 @@
+import json
+import math
+import os
+import time
+from threading import Lock, Thread
+from logs import get_logger
+from result_cache import pid_alive
+
+log = get_logger('metrics')
+
+# Bucket bounds for phase durations (seconds) and transfer rates (bytes/s)
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+THROUGHPUT_BUCKETS = tuple(64 * 1024 * 4 ** i for i in range(10))  # 64 KiB/s .. 16 GiB/s
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.lock = Lock()
+        self.values = {}  # label values -> value
+        registry.add(self)
+
+    def _key(self, labels):
+        return tuple('' if labels.get(name) is None else str(labels[name]) for name in self.label_names)
+
+    def snapshot(self):
+        with self.lock:
+            return {json.dumps(key): value for key, value in self.values.items()}
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Gauge set directly, or read from ``collect()`` (returning {labels tuple: value}) at scrape time"""
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, help_text, labels=(), collect=None):
+        super().__init__(registry, name, help_text, labels)
+        self.collect = collect
+        if not self.label_names:
+            self.values[()] = 0
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self):
+        if self.collect is not None:
+            try:
+                values = self.collect()
+            except Exception as e:
+                log.warning("⚠️ Gauge collection failed", metric=self.name, error=str(e))
+                values = {}
+            with self.lock:
+                self.values = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {json.dumps(key): [list(counts), total, count] for key, (counts, total, count) in self.values.items()}
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format.
+
+    With ``shared_dir`` set, every worker process writes its snapshot to
+    ``<shared_dir>/<pid>.json`` and the rendering merges all of them, so a
+    scrape that lands on any worker sees the whole server. Counters and
+    histograms of workers that have exited keep counting (Prometheus expects
+    them never to go down), their gauges are dropped.
+    """
+
+    def __init__(self, shared_dir=None, write_interval=5):
+        self.metrics = []
+        self.shared_dir = shared_dir
+        self.write_interval = write_interval
+        self.last_write = 0
+        self.lock = Lock()
+        if shared_dir:
+            os.makedirs(shared_dir, exist_ok=True)
+            Thread(target=self._writer, name='metrics-writer', daemon=True).start()
+
+    def add(self, metric):
+        self.metrics.append(metric)
+
+    def counter(self, name, help_text, labels=()):
+        return Counter(self, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=(), collect=None):
+        return Gauge(self, name, help_text, labels, collect)
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return Histogram(self, name, help_text, labels, buckets)
+
+    def snapshot(self):
+        return {metric.name: metric.snapshot() for metric in self.metrics}
+
+    def write(self, force=False):
+        """Publish this process's snapshot for the other workers, at most every write_interval seconds"""
+        if not self.shared_dir:
+            return
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_write < self.write_interval:
+                return
+            self.last_write = now
+        path = os.path.join(self.shared_dir, f'{os.getpid()}.json')
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'snapshot': self.snapshot(), 'written': time.time()}, f)
+        os.replace(tmp, path)
+
+    def _writer(self):
+        while True:
+            time.sleep(self.write_interval)
+            try:
+                self.write()
+            except Exception as e:
+                log.warning("⚠️ Could not write metrics snapshot", error=str(e))
+
+    def _snapshots(self):
+        """(snapshot, alive) of every process, this one first"""
+        snapshots = [(self.snapshot(), True)]
+        if not self.shared_dir:
+            return snapshots
+        self.write(force=True)
+        for name in os.listdir(self.shared_dir):
+            pid, ext = os.path.splitext(name)
+            if ext != '.json' or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(os.path.join(self.shared_dir, name)) as f:
+                    snapshots.append((json.load(f)['snapshot'], pid_alive(int(pid))))
+            except (OSError, ValueError, KeyError):
+                continue
+        return snapshots
+
+    def render(self):
+        snapshots = self._snapshots()
+        lines = []
+        for metric in self.metrics:
+            merged = {}
+            for snapshot, alive in snapshots:
+                if metric.kind == 'gauge' and not alive:
+                    continue
+                for key, value in snapshot.get(metric.name, {}).items():
+                    if metric.kind == 'histogram':
+                        entry = merged.setdefault(key, [[0] * len(metric.buckets), 0.0, 0])
+                        entry[0] = [a + b for a, b in zip(entry[0], value[0])]
+                        entry[1] += value[1]
+                        entry[2] += value[2]
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for key, value in sorted(merged.items()):
+                labels = list(zip(metric.label_names, json.loads(key)))
+                if metric.kind == 'histogram':
+                    counts, total, count = value
+                    for bound, bucket_count in zip(metric.buckets, counts):
+                        lines.append(f'{metric.name}_bucket{_labels(labels + [("le", _number(bound))])} {bucket_count}')
+                    lines.append(f'{metric.name}_bucket{_labels(labels + [("le", "+Inf")])} {count}')
+                    lines.append(f'{metric.name}_sum{_labels(labels)} {_number(total)}')
+                    lines.append(f'{metric.name}_count{_labels(labels)} {count}')
+                else:
+                    lines.append(f'{metric.name}{_labels(labels)} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+    return '{' + escaped + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class PhaseTimer:
+    """Times the consecutive phases of one piece of work.
+
+    ``enter(phase)`` ends the current phase and starts the next, ``end()``
+    ends the last one. Each finished phase is observed in ``histogram`` with
+    the timer's labels and logged as a span with its duration. Fields given
+    to ``enter`` or ``add`` (e.g. bytes) go into that phase's log line, and
+    ``bytes`` also feeds ``throughput`` when the phase ends.
+    """
+
+    def __init__(self, histogram, throughput=None, transferred=None, **labels):
+        self.histogram = histogram
+        self.throughput = throughput
+        self.transferred = transferred
+        self.labels = labels
+        self.phase = None
+        self.started = None
+        self.fields = {}
+
+    def enter(self, phase, **fields):
+        self.end()
+        self.phase = phase
+        self.started = time.monotonic()
+        self.fields = fields
+        return self
+
+    def add(self, **fields):
+        self.fields.update(fields)
+
+    def end(self, outcome='ok'):
+        """Finish the current phase, if any. Returns its duration."""
+        if self.phase is None:
+            return None
+        duration = time.monotonic() - self.started
+        phase, fields = self.phase, self.fields
+        self.phase = None
+        self.histogram.observe(duration, phase=phase, outcome=outcome, **self.labels)
+        size = fields.get('bytes')
+        if size and duration > 0:
+            fields['bytes_per_second'] = round(size / duration)
+            if self.throughput is not None:
+                self.throughput.observe(size / duration, phase=phase)
+            if self.transferred is not None:
+                self.transferred.inc(size, phase=phase)
+        log.info("⏱️ span", phase=phase, outcome=outcome, duration_ms=round(duration * 1000, 1),
+                 **self.labels, **fields)
+        return duration
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end('error' if exc_type else 'ok')
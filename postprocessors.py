@@ -0,0 +1,100 @@
+import os
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor, FFmpegPostProcessorError
+from yt_dlp.utils import DownloadCancelled, PostProcessingError, prepend_extension, replace_extension
+from processing import plan_output
+
+
+class ProcessingPP(FFmpegPostProcessor):
+    """Final step of every download: produce the output the mode asks for.
+
+    Probes the downloaded file for its codecs and then either leaves it
+    alone, copies the streams into the target container or re-encodes only
+    the streams that need it. The path taken ends up in ``self.path`` and
+    the resulting file in ``self.filepath``. ``on_start(path)`` is called
+    before ffmpeg runs.
+
+    Re-encoding takes a slot from ``transcodes`` (see admission.Slots) for
+    as long as ffmpeg runs, ``on_wait()`` is called when it has to wait for one.
+    The wait ends with DownloadCancelled once ``cancelled()`` is true.
+    """
+
+    def __init__(self, downloader, download_type, mode, on_start=None, transcodes=None, on_wait=None,
+                 cancelled=None):
+        super().__init__(downloader)
+        self.download_type = download_type
+        self.mode = mode
+        self.on_start = on_start
+        self.transcodes = transcodes
+        self.on_wait = on_wait
+        self.cancelled = cancelled
+        self.path = None
+        self.filepath = None
+
+    def _probe_codecs(self, info):
+        """(vcodec, acodec) of the downloaded file, from ffprobe where we have it"""
+        filepath = info['filepath']
+        try:
+            streams = self.get_metadata_object(filepath).get('streams', [])
+        except Exception:
+            # No ffprobe: trust the format's codecs, asking ffmpeg about the audio
+            return info.get('vcodec'), self.get_audio_codec(filepath) or info.get('acodec')
+        vcodec = next((s.get('codec_name') for s in streams
+                       if s.get('codec_type') == 'video' and not (s.get('disposition') or {}).get('attached_pic')), 'none')
+        acodec = next((s.get('codec_name') for s in streams if s.get('codec_type') == 'audio'), 'none')
+        return vcodec, acodec
+
+    def run(self, info):
+        filepath, ext = info['filepath'], info['ext'].lower()
+        vcodec, acodec = self._probe_codecs(info)
+        self.path, target, args = plan_output(self.download_type, self.mode, vcodec, acodec, ext)
+        self.filepath = filepath
+        if self.path == 'direct':
+            self.to_screen(f'Keeping {ext} file as it is')
+            return [], info
+
+        slot = None
+        if self.path == 'transcode' and self.transcodes is not None:
+            slot = self.transcodes.acquire(on_wait=self.on_wait, cancelled=self.cancelled)
+            if slot is None:
+                raise DownloadCancelled()
+        try:
+            if self.on_start:
+                self.on_start(self.path)
+            self.to_screen(f'{self.path.title()} {ext} ({vcodec}/{acodec}) to {target}')
+            outpath = replace_extension(filepath, target, ext)
+            if outpath == filepath:
+                outpath = prepend_extension(filepath, 'temp')
+            opts = ['-map', '0', '-dn', '-ignore_unknown', *args]
+            if target in ('mp4', 'm4a'):
+                opts += ['-movflags', '+faststart']
+            try:
+                self.run_ffmpeg(filepath, outpath, opts)
+            except FFmpegPostProcessorError as e:
+                raise PostProcessingError(f'{self.path} to {target} failed: {e.msg}')
+        finally:
+            if slot is not None:
+                self.transcodes.release(slot)
+
+        final = replace_extension(filepath, target, ext)
+        os.replace(outpath, final)
+        files_to_delete = [filepath] if final != filepath else []
+        info['filepath'] = self.filepath = final
+        info['ext'] = target
+        return files_to_delete, info
+
+
+class BeforeDownloadPP(PostProcessor):
+    """Calls ``callback(info)`` once the formats are picked and before anything is downloaded.
+
+    Added with ``when='before_dl'``. The callback may block (e.g. until
+    there is room for the download) or raise to stop it.
+    """
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+
+    def run(self, info):
+        self.callback(info)
+        return [], info
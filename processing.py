@@ -0,0 +1,109 @@
+# 'compatible' makes files that play everywhere (H.264/AAC MP4, MP3 audio) and
+# re-encodes whatever isn't already in that shape. 'fast' copies the streams
+# into a container that can hold them and never re-encodes unless it has to.
+MODES = ('compatible', 'fast')
+
+# Codecs that can be copied into an MP4/M4A container as they are
+MP4_VIDEO_CODECS = ('h264', 'hevc', 'av1', 'vp9')
+MP4_AUDIO_CODECS = ('aac', 'mp3', 'opus', 'flac', 'ac3', 'eac3')
+
+# What the 'compatible' mode produces
+COMPATIBLE_VIDEO_CODECS = ('h264',)
+COMPATIBLE_AUDIO_CODECS = ('aac', 'mp3')
+
+# Containers a lone audio stream can be copied into
+NATIVE_AUDIO_EXTS = {'aac': 'm4a', 'mp3': 'mp3', 'opus': 'opus', 'vorbis': 'ogg', 'flac': 'flac'}
+
+# Both yt-dlp's codec strings (avc1.64001F, mp4a.40.2, vp09.00.40.08) and
+# ffprobe's codec names (h264, aac, vp9) map onto the same families
+_CODEC_PREFIXES = (
+    ('avc', 'h264'), ('h264', 'h264'),
+    ('hev', 'hevc'), ('hvc', 'hevc'), ('h265', 'hevc'),
+    ('av01', 'av1'), ('av1', 'av1'),
+    ('vp09', 'vp9'), ('vp9', 'vp9'), ('vp08', 'vp8'), ('vp8', 'vp8'),
+    ('mp4a', 'aac'), ('aac', 'aac'),
+    ('mp3', 'mp3'), ('opus', 'opus'), ('vorbis', 'vorbis'), ('flac', 'flac'),
+    ('ac-3', 'ac3'), ('ac3', 'ac3'), ('ec-3', 'eac3'), ('eac3', 'eac3'),
+)
+
+
+def codec_family(codec):
+    """Normalise a codec name. 'none' means there is no such stream, None that we can't tell."""
+    if not codec:
+        return None
+    codec = codec.lower()
+    if codec == 'none':
+        return 'none'
+    for prefix, family in _CODEC_PREFIXES:
+        if codec.startswith(prefix):
+            return family
+    return codec
+
+
+def normalize_mode(mode, default='compatible'):
+    mode = (mode or '').lower()
+    return mode if mode in MODES else default
+
+
+def format_selector(download_type, mode):
+    """yt-dlp format string that favours formats the mode can use without re-encoding"""
+    if download_type == 'audio':
+        if mode == 'fast':
+            # AAC copies straight into M4A
+            return 'bestaudio[acodec^=mp4a]/bestaudio/best'
+        return 'bestaudio/best'
+    if mode == 'fast':
+        copyable_video = "vcodec~='^(avc|h264|hev|hvc|av01|vp0?9)'"
+        copyable_audio = "acodec~='^(mp4a|aac|mp3|opus)'"
+        return f'bestvideo*[{copyable_video}]+bestaudio[{copyable_audio}]/best[{copyable_video}][{copyable_audio}]/bestvideo*+bestaudio/best'
+    # Any codec: format_sort() picks H.264/AAC only where nothing sharper exists
+    return 'bestvideo*+bestaudio/best'
+
+
+def format_sort(download_type, mode):
+    """yt-dlp format_sort for the mode, or None for yt-dlp's own order.
+
+    Sites often stop offering H.264 above 1080p, so 'compatible' ranks
+    resolution first and only then prefers the codecs it can copy. A
+    sharper source is re-encoded by ProcessingPP instead.
+    """
+    if download_type == 'video' and mode == 'compatible':
+        return ['res', 'vcodec:h264', 'acodec:aac']
+    return None
+
+
+def plan_output(download_type, mode, vcodec, acodec, ext):
+    """Decide how to turn a download with these codecs into what the mode asks for.
+
+    Returns (path, ext, codec_args). path is 'direct' when the file can be
+    sent as it is, 'remux' when its streams only need copying into another
+    container and 'transcode' when something has to be re-encoded. Unknown
+    codecs are assumed to be copyable.
+    """
+    video, audio = codec_family(vcodec), codec_family(acodec)
+
+    if download_type == 'audio':
+        if mode == 'fast' and audio in NATIVE_AUDIO_EXTS:
+            path, target, args = 'remux', NATIVE_AUDIO_EXTS[audio], ['-c:a', 'copy']
+        elif audio == 'mp3' or (audio is None and ext == 'mp3'):
+            path, target, args = 'remux', 'mp3', ['-c:a', 'copy']
+        else:
+            # Same output as ever for compatible mode: 320 kbps MP3
+            path, target, args = 'transcode', 'mp3', ['-c:a', 'libmp3lame', '-b:a', '320k']
+        args = ['-vn', *args]
+    elif mode == 'fast':
+        if video in (*MP4_VIDEO_CODECS, None) and audio in (*MP4_AUDIO_CODECS, 'none', None):
+            target = 'mp4'
+        else:
+            # e.g. VP8/Vorbis: keep a container that takes them rather than re-encode
+            target = ext if ext in ('webm', 'mkv') else 'mkv'
+        path, args = 'remux', ['-c', 'copy']
+    else:
+        video_args = ['-c:v', 'copy'] if video in (*COMPATIBLE_VIDEO_CODECS, None) else ['-c:v', 'libx264']
+        audio_args = ['-c:a', 'copy'] if audio in (*COMPATIBLE_AUDIO_CODECS, 'none', None) else ['-c:a', 'aac', '-b:a', '192k']
+        path = 'remux' if video_args[1] == audio_args[1] == 'copy' else 'transcode'
+        target, args = 'mp4', [*video_args, *audio_args]
+
+    if path == 'remux' and target == ext:
+        path = 'direct'
+    return path, target, args
@@ -0,0 +1,84 @@
+import time
+from threading import Lock
+from state_backend import MemoryBackend
+
+# Statuses after which a task's progress never changes again
+TERMINAL_STATUSES = ('complete', 'error', 'cancelled')
+
+
+class ProgressStore:
+    """Per-task progress state that waiters are woken up for when it changes.
+
+    Every accepted update bumps the task's version, which doubles as the SSE
+    event ID. Repeated updates with the same status that arrive within
+    ``min_interval`` of each other are dropped, so chatty yt-dlp progress
+    hooks don't turn into a flood of events. Finished tasks are forgotten
+    ``ttl`` seconds after they finish, and tasks that stop getting updates
+    after ``idle_ttl`` seconds.
+
+    The states live in ``backend`` (see state_backend), so with a shared
+    backend any worker process can serve a task's progress stream.
+    """
+
+    def __init__(self, backend=None, ttl=600, idle_ttl=3600, min_interval=0.25, sweep_interval=30):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.idle_ttl = idle_ttl
+        self.min_interval = min_interval
+        self.sweep_interval = sweep_interval
+        self.lock = Lock()
+        self.last = {}  # task_id -> (status, time) of the last update from this process
+        self.last_sweep = time.monotonic()
+
+    def set(self, task_id, status, message, progress, force=False, **extra):
+        """Record a progress update. Returns False if it was throttled away.
+
+        Any ``extra`` fields are sent along with the status, message and progress.
+        """
+        now = time.monotonic()
+        with self.lock:
+            previous, updated = self.last.get(task_id, (None, 0))
+            if not force and previous == status and status not in TERMINAL_STATUSES \
+                    and now - updated < self.min_interval:
+                return False
+            self.last[task_id] = (status, now)
+            self._maybe_sweep(now)
+        state = {
+            'status': status,
+            'message': message,
+            'progress': progress,
+            **extra
+        }
+        self.backend.publish(task_id, state, self.ttl if status in TERMINAL_STATUSES else self.idle_ttl)
+        return True
+
+    def copy(self, src_task_id, dst_task_id):
+        """Start dst off with src's current state"""
+        state = self.get(src_task_id)
+        if state:
+            self.set(dst_task_id, force=True, **state)
+
+    def get(self, task_id):
+        current = self.backend.read(task_id)
+        return dict(current[1]) if current else {}
+
+    def wait(self, task_id, last_version=0, timeout=None):
+        """Block until the task has a version newer than last_version.
+
+        Returns (version, state), or None if the timeout ran out first.
+        """
+        # Versions restart when a task is recreated (e.g. after a server
+        # restart), so an ID from the future means "send everything"
+        current = self.backend.read(task_id)
+        if last_version > (current[0] if current else 0):
+            last_version = 0
+        update = self.backend.wait(task_id, last_version, timeout)
+        return (update[0], dict(update[1])) if update else None
+
+    def _maybe_sweep(self, now):
+        """Forget throttling state of tasks that went quiet. Caller holds the lock."""
+        if now - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = now
+        for task_id in [t for t, (_, updated) in self.last.items() if now - updated > self.sweep_interval]:
+            del self.last[task_id]
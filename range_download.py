@@ -0,0 +1,351 @@
+import json
+import math
+import os
+import time
+from threading import Event, Lock, Thread
+import yt_dlp
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.http import HttpFD
+from yt_dlp.networking import Request
+from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.utils import ContentTooShortError, DownloadCancelled, DownloadError
+from admission import Slots
+
+# Pieces smaller than this aren't worth an extra connection
+MIN_PIECE_SIZE = 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class ConnectionLimiter:
+    """Caps the number of upstream connections all downloads use together.
+
+    Connections are ``Slots`` under ``directory``, so the cap holds across
+    every worker process on this machine. ``acquire(wanted)`` waits until
+    at least one connection is free and then takes as many as it can, up
+    to ``wanted``, so a busy server gives each job fewer connections
+    instead of making it wait. ``max_connections`` 0 means unlimited.
+    """
+
+    def __init__(self, directory, max_connections, wait_timeout=600, retry_after=30):
+        self.slots = Slots(directory, 'connection', max_connections,
+                           wait_timeout=wait_timeout, retry_after=retry_after)
+
+    def acquire(self, wanted, on_wait=None, cancelled=None):
+        """Held connections (pass them to release()), or None if ``cancelled()`` came true while waiting.
+
+        Raises Overloaded if none comes free within wait_timeout.
+        """
+        first = self.slots.acquire(on_wait=on_wait, cancelled=cancelled)
+        if first is None:
+            return None
+        held = [first]
+        while len(held) < wanted:
+            slot = self.slots.try_acquire()
+            if slot is None:
+                break
+            held.append(slot)
+        return held
+
+    def release(self, held):
+        for slot in held:
+            self.slots.release(slot)
+
+    def stats(self):
+        stats = self.slots.stats()
+        return {'max_connections': stats['max'], 'held_here': stats['held_here']}
+
+
+class RangeFD(HttpFD):
+    """Download a single-URL format over several connections at once.
+
+    The file is preallocated and split into byte ranges no bigger than
+    http_chunk_size. ``range_connections`` workers take ranges off a shared
+    list and write them in place, so faster connections simply end up doing
+    more of them. Servers that don't honour Range requests and small files
+    go through the normal HttpFD.
+
+    With ``continuedl`` (yt-dlp's default) a failed or cancelled download
+    keeps its partial file along with a ``.ranges`` file listing the ranges
+    still missing, and the next attempt fetches only those. Partial files
+    without one were written by HttpFD, which resumes them itself.
+    """
+
+    def _probe_size(self, info_dict):
+        """Total size if the server answers range requests, else None"""
+        headers = {'Accept-Encoding': 'identity', **(info_dict.get('http_headers') or {}), 'Range': 'bytes=0-0'}
+        try:
+            response = self.ydl.urlopen(Request(info_dict['url'], headers=headers))
+        except Exception:
+            return None
+        try:
+            content_range = response.headers.get('Content-Range') or ''
+            if response.status != 206 or '/' not in content_range:
+                return None
+            total = content_range.rsplit('/', 1)[1]
+            return int(total) if total.isdigit() else None
+        finally:
+            response.close()
+
+    def real_download(self, filename, info_dict):
+        connections = self.params.get('range_connections') or 1
+        tmpfilename = self.temp_name(filename)
+        continuedl = self.params.get('continuedl', True)
+        saved = self._load_ranges(tmpfilename) if continuedl and os.path.isfile(tmpfilename) else None
+        if saved is None and (connections < 2 or info_dict.get('request_data') or self.params.get('test')
+                              or (continuedl and os.path.isfile(tmpfilename))):
+            return super().real_download(filename, info_dict)
+
+        size = self._probe_size(info_dict)
+        if saved is not None and saved[0] != size:
+            # The source changed since, start over
+            self.to_screen('[download] Partial file is for a different size, starting over')
+            self._discard(tmpfilename)
+            saved = None
+        if saved is None and (not size or size < 2 * MIN_PIECE_SIZE):
+            return super().real_download(filename, info_dict)
+
+        if saved is None:
+            chunk_size = self.params.get('http_chunk_size') or size
+            piece_size = max(MIN_PIECE_SIZE, min(chunk_size, math.ceil(size / connections)))
+            pieces = [[start, min(start + piece_size, size) - 1] for start in range(0, size, piece_size)]
+        else:
+            pieces = saved[1]
+        remaining = sum(end - start + 1 for start, end in pieces)
+        connections = max(1, min(connections, len(pieces)))
+        if saved is None:
+            self.to_screen(f'[download] {size:,} bytes in {len(pieces)} ranges over {connections} connections')
+        else:
+            self.to_screen(f'[download] Resuming: {remaining:,} of {size:,} bytes left in {len(pieces)} ranges '
+                           f'over {connections} connections')
+        self.report_destination(filename)
+
+        self._started = time.time()
+        if saved is None and continuedl:
+            # Before the file exists, so a preallocated partial file never lacks its ranges
+            self._save_ranges(tmpfilename, size, pieces)
+        fd = os.open(tmpfilename, os.O_RDWR | os.O_CREAT | (0 if saved else os.O_TRUNC), 0o644)
+        try:
+            if saved is None:
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except (AttributeError, OSError):
+                    os.ftruncate(fd, size)
+            self._download_pieces(fd, filename, info_dict, pieces, size, connections, size - remaining)
+        except BaseException:
+            os.close(fd)
+            if continuedl:
+                self._save_ranges(tmpfilename, size, pieces)
+            else:
+                self._discard(tmpfilename)
+            raise
+        os.close(fd)
+
+        self.try_remove(f'{tmpfilename}.ranges')
+        self.try_rename(tmpfilename, filename)
+        self._hook_progress({
+            'downloaded_bytes': size,
+            'total_bytes': size,
+            'filename': filename,
+            'status': 'finished',
+            'elapsed': time.time() - self._started,
+        }, info_dict)
+        return True
+
+    def _load_ranges(self, tmpfilename):
+        """(size, missing [start, end] ranges) of a partial file we left, or None"""
+        try:
+            with open(f'{tmpfilename}.ranges') as f:
+                state = json.load(f)
+            return state['size'], [[start, end] for start, end in state['remaining']]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _save_ranges(self, tmpfilename, size, pieces):
+        """Record which ranges the partial file still misses. Pieces start where their data ends."""
+        path = f'{tmpfilename}.ranges'
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'size': size, 'remaining': [[start, end] for start, end in pieces if start <= end]}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def _discard(self, tmpfilename):
+        self.try_remove(tmpfilename)
+        self.try_remove(f'{tmpfilename}.ranges')
+
+    def _download_pieces(self, fd, filename, info_dict, pieces, size, connections, resumed=0):
+        """Fetch ``pieces``, moving each one's start up as its bytes are written"""
+        lock = Lock()
+        stop = Event()
+        errors = []
+        queue = list(pieces)
+        state = {'downloaded': resumed}
+        headers = {'Accept-Encoding': 'identity', **(info_dict.get('http_headers') or {})}
+        retries = self.params.get('retries', 10)
+        tmpfilename = self.temp_name(filename)
+        continuedl = self.params.get('continuedl', True)
+
+        def fetch(piece):
+            """Fetch one range, picking up where a dropped connection left off"""
+            start, end = piece
+            attempt = 0
+            while piece[0] <= end and not stop.is_set():
+                try:
+                    response = self.ydl.urlopen(Request(info_dict['url'], headers={
+                        **headers, 'Range': f'bytes={piece[0]}-{end}'}))
+                    try:
+                        if response.status != 206:
+                            raise DownloadError(f'server ignored the range request (HTTP {response.status})')
+                        while piece[0] <= end and not stop.is_set():
+                            data = response.read(min(READ_SIZE, end - piece[0] + 1))
+                            if not data:
+                                raise ContentTooShortError(piece[0] - start, end - start + 1)
+                            os.pwrite(fd, data, piece[0])
+                            piece[0] += len(data)
+                            with lock:
+                                state['downloaded'] += len(data)
+                    finally:
+                        response.close()
+                except DownloadError:
+                    raise
+                except Exception as e:
+                    attempt += 1
+                    if attempt > retries:
+                        raise
+                    self.report_retry(e, attempt, retries)
+                    time.sleep(min(2 ** attempt, 30) / 10)
+
+        def worker():
+            while not stop.is_set():
+                with lock:
+                    if not queue:
+                        return
+                    piece = queue.pop(0)
+                try:
+                    fetch(piece)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    stop.set()
+
+        threads = [Thread(target=worker, daemon=True) for _ in range(connections)]
+        for thread in threads:
+            thread.start()
+        try:
+            # Report the combined progress of all connections from this thread,
+            # so a progress hook that cancels the download stops all of them
+            while any(thread.is_alive() for thread in threads):
+                stop.wait(0.5)
+                with lock:
+                    downloaded = state['downloaded']
+                elapsed = time.time() - self._started
+                speed = (downloaded - resumed) / elapsed if elapsed > 0 else None
+                # Kept up to date so even a killed worker leaves a resumable file
+                if continuedl:
+                    self._save_ranges(tmpfilename, size, pieces)
+                self._hook_progress({
+                    'status': 'downloading',
+                    'downloaded_bytes': downloaded,
+                    'total_bytes': size,
+                    'tmpfilename': tmpfilename,
+                    'filename': filename,
+                    'elapsed': elapsed,
+                    'speed': speed,
+                    'eta': (size - downloaded) / speed if speed else None,
+                }, info_dict)
+                if errors:
+                    break
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
+
+
+class ParallelYoutubeDL(yt_dlp.YoutubeDL):
+    """YoutubeDL that downloads over several connections per format.
+
+    Each format download takes up to ``connections`` connections from the
+    shared ``limiter`` for as long as it runs. Fragmented formats (DASH,
+    HLS) fetch that many fragments at once, single-URL formats are split
+    into byte ranges by RangeFD. Once ``cancelled()`` is true a download
+    waiting for a connection stops with DownloadCancelled.
+    """
+
+    def __init__(self, params=None, *args, limiter=None, connections=1, cancelled=None, **kwargs):
+        super().__init__(params, *args, **kwargs)
+        self.limiter = limiter
+        self.connections = connections
+        self.cancelled = cancelled
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if test or subtitle or name == '-' or self.limiter is None:
+            return super().dl(name, info, subtitle, test)
+
+        held = self.limiter.acquire(self.connections, cancelled=self.cancelled)
+        if held is None:
+            raise DownloadCancelled()
+        try:
+            self.params['concurrent_fragment_downloads'] = len(held)
+            self.params['range_connections'] = len(held)
+            if get_suitable_downloader(info, self.params) is not HttpFD or not info.get('url'):
+                return super().dl(name, info, subtitle, test)
+
+            fd = RangeFD(self, self.params)
+            for ph in self._progress_hooks:
+                fd.add_progress_hook(ph)
+            new_info = self._copy_infodict(info)
+            if new_info.get('http_headers') is None:
+                new_info['http_headers'] = self._calc_headers(new_info)
+            return fd.download(name, new_info, subtitle)
+        finally:
+            self.limiter.release(held)
+
+
+class ProgressTally:
+    """Combines yt-dlp progress reports for every part of a download.
+
+    Merged downloads fetch video and audio one after the other, each with
+    its own 0-100%. ``attach(ydl)`` learns the expected size of every part
+    once the formats are selected, so ``update(d)`` can return the fraction
+    of the whole download that is done, or None while it can't tell.
+    """
+
+    def __init__(self):
+        self.parts = {}  # format_id -> [downloaded, total]
+
+    def attach(self, ydl):
+        ydl.add_post_processor(_ExpectPartsPP(self), when='before_dl')
+
+    def expect(self, info):
+        for fmt in info.get('requested_formats') or [info]:
+            self.parts.setdefault(fmt.get('format_id'), [0, fmt.get('filesize') or fmt.get('filesize_approx')])
+
+    def downloaded(self):
+        """Bytes fetched so far over every part"""
+        return sum(done for done, _ in self.parts.values())
+
+    def update(self, d):
+        part = self.parts.setdefault((d.get('info_dict') or {}).get('format_id'), [0, None])
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        if total:
+            part[1] = total
+        if d.get('downloaded_bytes') is not None:
+            part[0] = d['downloaded_bytes']
+        elif part[1] and d.get('fragment_count'):
+            part[0] = part[1] * (d.get('fragment_index') or 0) / d['fragment_count']
+        if d.get('status') == 'finished' and part[1]:
+            part[0] = part[1]
+
+        if any(not total for _, total in self.parts.values()):
+            return None
+        return min(sum(done for done, _ in self.parts.values()) / sum(total for _, total in self.parts.values()), 1.0)
+
+
+class _ExpectPartsPP(PostProcessor):
+    def __init__(self, tally):
+        super().__init__()
+        self.tally = tally
+
+    def run(self, info):
+        self.tally.expect(info)
+        return [], info
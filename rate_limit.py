@@ -0,0 +1,118 @@
+import math
+import random
+import time
+from urllib.parse import urlparse
+from logs import get_logger
+
+log = get_logger('rate_limit')
+
+# Host prefixes that reach the same site as the bare domain
+_HOST_PREFIXES = ('www.', 'm.', 'music.')
+
+
+def upstream_host(url):
+    """The site a URL's requests go to, counting youtu.be and www./m. variants as one host"""
+    try:
+        host = (urlparse(url).hostname or '').lower()
+    except ValueError:
+        return ''
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return 'youtube.com' if host == 'youtu.be' else host
+
+
+class UpstreamBusy(Exception):
+    """Raised by RateLimiter.try_acquire when a host has no turn free right now"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(f"Too many requests to {host} right now, retry in {retry_after}s")
+        self.host = host
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """Token bucket per upstream host for the requests we make to it.
+
+    A host allows ``rate`` requests per second on average and up to
+    ``burst`` back to back. ``acquire()`` returns straight away while there
+    is capacity; otherwise it books the next free turn, so waiters go in the
+    order they came, and sleeps until then. Turns are spaced by a random
+    ``jitter`` fraction more or less than 1/rate so they don't tick like a
+    clock. ``try_acquire()`` is for requests a client is waiting on: it
+    takes a turn only if one is free now and otherwise raises UpstreamBusy
+    with the seconds until there will be one, so no request thread sleeps.
+
+    ``penalize(host)`` after a 403 or 429 doubles the spacing for that host,
+    up to ``max_slowdown`` times. The slowdown halves again every
+    ``recovery`` seconds without another one.
+
+    Buckets and slowdowns are records in ``backend`` (see state_backend.py):
+    a MemoryBackend keeps them to this process, a shared one to every
+    worker using it.
+    """
+
+    def __init__(self, backend, rate=1.0, burst=3, jitter=0.5, max_slowdown=16, recovery=60):
+        self.backend = backend
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.jitter = min(max(jitter, 0), 1)
+        self.max_slowdown = max(1, max_slowdown)
+        self.recovery = recovery
+
+    def slowdown(self, host):
+        """How many times slower than ``rate`` requests to host go right now"""
+        state = self.backend.get('upstream-slowdown', host)
+        if not state:
+            return 1.0
+        factor, since = state
+        return max(1.0, factor * 0.5 ** ((time.time() - since) / self.recovery))
+
+    def penalize(self, host):
+        """Slow down requests to a host that has started refusing them. Returns the new slowdown."""
+        factor = min(self.max_slowdown, self.slowdown(host) * 2)
+        # Kept until it would have decayed back to 1
+        ttl = self.recovery * (math.log2(factor) + 1)
+        self.backend.put('upstream-slowdown', host, [factor, time.time()], ttl)
+        log.warning("🐢 Upstream is pushing back, slowing down", host=host, slowdown=round(factor, 1))
+        return factor
+
+    def _interval(self, host):
+        return self.slowdown(host) / self.rate * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def try_acquire(self, host):
+        """Take a turn to send a request to host if one is free now, else raise UpstreamBusy"""
+        if not self.rate:
+            return
+        interval = self._interval(host)
+        start = self.backend.reserve_slot('upstream-rate', host, interval, (self.burst - 1) * interval, 60,
+                                          max_delay=0)
+        delay = start - time.time()
+        if delay > 0:
+            raise UpstreamBusy(host, math.ceil(delay))
+
+    def acquire(self, host, on_wait=None, cancelled=None):
+        """Wait for a turn to send a request to host.
+
+        Calls ``on_wait(seconds_left)`` about once a second while waiting and
+        gives up once ``cancelled()`` is true (the booked turn goes unused).
+        Returns the seconds waited, or None if cancelled.
+        """
+        if not self.rate:
+            return 0.0
+        interval = self._interval(host)
+        start = self.backend.reserve_slot('upstream-rate', host, interval, (self.burst - 1) * interval, 60)
+        delay = start - time.time()
+        if delay <= 0:
+            return 0.0
+        log.info("🚦 Waiting for a turn upstream", host=host, wait_ms=round(delay * 1000))
+        while True:
+            remaining = start - time.time()
+            if remaining <= 0:
+                return delay
+            if cancelled and cancelled():
+                return None
+            if on_wait:
+                on_wait(remaining)
+            time.sleep(min(remaining, 1))
@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+from urllib.parse import urlparse, parse_qs
+
+# A data file without its sidecar may still be mid-publish in another process
+ORPHAN_GRACE = 60
+
+# YouTube video IDs are always 11 characters from this alphabet
+_YOUTUBE_ID = re.compile(r'^[0-9A-Za-z_-]{11}$')
+_YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com', 'music.youtube.com',
+                  'youtube-nocookie.com', 'www.youtube-nocookie.com')
+
+
+def canonical_video_id(url):
+    """Return (extractor, video_id) for URLs we can identify without yt-dlp, else None"""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return None
+    host = (parsed.hostname or '').lower()
+
+    candidate = None
+    if host == 'youtu.be':
+        candidate = parsed.path.lstrip('/').split('/')[0]
+    elif host in _YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            candidate = parse_qs(parsed.query).get('v', [None])[0]
+        else:
+            parts = parsed.path.strip('/').split('/')
+            if len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live', 'v'):
+                candidate = parts[1]
+
+    if candidate and _YOUTUBE_ID.match(candidate):
+        return 'youtube', candidate
+    return None
+
+
+def cache_key(extractor, video_id, download_type, settings):
+    """Build a cache key from the video identity and the effective output settings"""
+    material = json.dumps({
+        'extractor': extractor.lower(),
+        'id': video_id,
+        'type': download_type,
+        'settings': settings,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResultCache:
+    """Size-bounded LRU cache of finished downloads on disk.
+
+    Each entry is a ``<key>.data`` file with a ``<key>.json`` sidecar holding
+    the filename and MIME type. Both are written to a temp file first and
+    renamed into place, data before metadata, so a crash can only leave
+    behind files that the startup rebuild throws away. The sidecar's mtime
+    records the last access, which lets the rebuild restore the LRU order.
+
+    Several worker processes can share one cache directory: each writes its
+    temp files under its own PID, and an entry another process published is
+    picked up from its sidecar the first time it is asked for. Each process
+    only counts the entries it knows about towards ``max_bytes``.
+
+    ``get(..., pin=True)`` and ``publish(..., pin=True)`` keep an entry from
+    being evicted until a matching ``unpin(key)``, so a finished job's file
+    stays put until the client has fetched it. Pins only hold within this
+    process.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.tmp_root = os.path.join(root, 'tmp')
+        self.tmp_dir = os.path.join(self.tmp_root, str(os.getpid()))
+        self.lock = Lock()
+        self.entries = OrderedDict()  # key -> entry dict, least recently used first
+        self.pins = {}  # key -> number of holders
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled:
+            self._rebuild()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _data_path(self, key):
+        return os.path.join(self.root, f'{key}.data')
+
+    def _meta_path(self, key):
+        return os.path.join(self.root, f'{key}.json')
+
+    def _rebuild(self):
+        """Rebuild the index from disk, dropping anything a crash left half written"""
+        os.makedirs(self.tmp_root, exist_ok=True)
+        for name in os.listdir(self.tmp_root):
+            if not (name.isdigit() and int(name) != os.getpid() and pid_alive(int(name))):
+                shutil.rmtree(os.path.join(self.tmp_root, name), ignore_errors=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        found = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            key, ext = os.path.splitext(name)
+            if ext == '.json':
+                try:
+                    with open(path) as f:
+                        meta = json.load(f)
+                    size = os.path.getsize(self._data_path(key))
+                    if size != meta['size']:
+                        raise ValueError('size mismatch')
+                    found.append((os.path.getmtime(path), key, meta))
+                except Exception:
+                    self._remove_files(key)
+            elif ext == '.data' and not os.path.exists(self._meta_path(key)):
+                try:
+                    if time.time() - os.stat(path).st_ctime > ORPHAN_GRACE:
+                        self._remove_files(key)
+                except FileNotFoundError:
+                    pass
+
+        for _, key, meta in sorted(found):
+            meta['path'] = self._data_path(key)
+            self.entries[key] = meta
+            self.total_bytes += meta['size']
+        self._evict()
+
+    def _load(self, key):
+        """Entry for a key published by another process, or None. Caller holds the lock."""
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+            if os.path.getsize(self._data_path(key)) != meta['size']:
+                return None
+        except (OSError, ValueError, KeyError):
+            return None
+        meta['path'] = self._data_path(key)
+        self.entries[key] = meta
+        self.total_bytes += meta['size']
+        self._evict()
+        return self.entries.get(key)
+
+    def _remove_files(self, key):
+        for path in (self._meta_path(key), self._data_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _evict(self, keep=None):
+        """Drop least recently used entries until we are within budget. Caller holds the lock.
+
+        Pinned entries and ``keep`` are skipped, so the cache can run over
+        budget while they are held.
+        """
+        for key in list(self.entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if key in self.pins or key == keep:
+                continue
+            entry = self.entries.pop(key)
+            self.total_bytes -= entry['size']
+            self.evictions += 1
+            # Open file handles keep streaming fine after the unlink
+            self._remove_files(key)
+
+    def get(self, key, pin=False):
+        """Return the entry for key and mark it as recently used, or None"""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(key) or self._load(key)
+            if entry is None or not os.path.exists(entry['path']):
+                if entry is not None:
+                    self.total_bytes -= self.entries.pop(key)['size']
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if pin:
+                self._pin(key)
+        try:
+            os.utime(self._meta_path(key))
+        except OSError:
+            pass
+        return dict(entry)
+
+    def publish(self, key, src_path, filename, mimetype, extra=None, pin=False):
+        """Move a finished file into the cache and return its entry.
+
+        ``extra`` holds any other details to keep in the sidecar. Returns None when the cache is disabled or the file is larger than
+        the whole budget, in which case src_path is left untouched.
+        """
+        size = os.path.getsize(src_path)
+        if not self.enabled or size > self.max_bytes:
+            return None
+
+        meta = {**(extra or {}), 'filename': filename, 'mimetype': mimetype, 'size': size, 'created': time.time()}
+        tmp_data = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        tmp_meta = tmp_data + '.json'
+        try:
+            shutil.move(src_path, tmp_data)
+            with open(tmp_meta, 'w') as f:
+                json.dump(meta, f)
+            os.replace(tmp_data, self._data_path(key))
+            os.replace(tmp_meta, self._meta_path(key))
+        except Exception:
+            for path in (tmp_data, tmp_meta):
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+        meta['path'] = self._data_path(key)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old['size']
+            self.entries[key] = meta
+            self.total_bytes += size
+            if pin:
+                self._pin(key)
+            self._evict(keep=key)
+        return dict(meta)
+
+    def _pin(self, key):
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        """Drop one hold on an entry, evicting whatever the pins kept over budget"""
+        with self.lock:
+            count = self.pins.pop(key, 0) - 1
+            if count > 0:
+                self.pins[key] = count
+            self._evict()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self.entries),
+                'pinned': len(self.pins),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+            }
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,121 @@
+from threading import Event, Lock
+
+
+class Flight:
+    """One in-progress piece of work and the tasks waiting on it.
+
+    The first task to join runs the work; the rest wait on ``done``, or
+    register a callback with ``add_done_callback()``, and then read
+    ``result`` or ``error``. A shared result that needs cleaning up
+    (e.g. a scratch file) is released once per task, and the cleanup runs
+    after the last task has released it.
+    """
+
+    def __init__(self, key, task_id):
+        self.key = key
+        self.task_ids = [task_id]
+        self.done = Event()
+        self.result = None
+        self.error = None
+        self._refs = 0
+        self._on_release = None
+        self._published = False
+        self._callbacks = []
+        self._lock = Lock()
+
+    @property
+    def cancelled(self):
+        """True once every task has left, so nobody wants the result any more"""
+        return not self.task_ids
+
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """Call ``callback(flight)`` once the outcome is published, straight away if it already is"""
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def release(self):
+        """Drop one task's reference to the result"""
+        with self._lock:
+            self._refs -= 1
+            callback = self._on_release if self._refs <= 0 else None
+            if callback:
+                self._on_release = None
+        if callback:
+            callback()
+
+
+class SingleFlight:
+    """Coalesce concurrent work with the same key into a single run"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.flights = {}
+
+    def join(self, key, task_id):
+        """Attach task_id to the flight for key. Returns (flight, is_leader)."""
+        with self.lock:
+            flight = self.flights.get(key)
+            # A flight everyone has left is only winding down, start afresh
+            if flight is not None and flight.task_ids:
+                flight.task_ids.append(task_id)
+                return flight, False
+            flight = self.flights[key] = Flight(key, task_id)
+            return flight, True
+
+    def follow(self, key, task_id):
+        """Attach task_id to the flight for key if one is under way. Returns it, or None."""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is None or not flight.task_ids:
+                return None
+            flight.task_ids.append(task_id)
+            return flight
+
+    def leave(self, flight, task_id):
+        """Detach a task that no longer wants the result.
+
+        Returns False if the result had already been published, in which
+        case the task still holds a reference and must release it.
+        """
+        with self.lock:
+            if flight._published:
+                return False
+            if task_id in flight.task_ids:
+                flight.task_ids.remove(task_id)
+            return True
+
+    def finish(self, flight, result=None, error=None, on_release=None):
+        """Publish the outcome to every waiting task.
+
+        New requests for the same key start a fresh flight from here on, so
+        the set of tasks sharing this result is fixed and each of them must
+        call ``flight.release()`` once it is done with the result. If every
+        task has already left, ``on_release`` runs straight away.
+        """
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+            with flight._lock:
+                flight._refs = len(flight.task_ids)
+                orphaned = not flight.task_ids
+                flight._on_release = None if orphaned else on_release
+                flight._published = True
+        flight.result = result
+        flight.error = error
+        with flight._lock:
+            flight.done.set()
+            callbacks, flight._callbacks = flight._callbacks, []
+        for callback in callbacks:
+            callback(flight)
+        if orphaned and on_release:
+            on_release()
+
+    def in_flight(self):
+        with self.lock:
+            return {key: len(flight.task_ids) for key, flight in self.flights.items()}
@@ -0,0 +1,492 @@
+import json
+import math
+import socket
+import sqlite3
+import time
+from threading import Condition, Lock, RLock, Thread, local
+from urllib.parse import urlparse, unquote
+from logs import get_logger
+
+log = get_logger('state_backend')
+
+# Shared state lives under this prefix in Redis
+REDIS_PREFIX = 'yt-dlp-web'
+
+
+def create_backend(url=None):
+    """Build the state backend described by STATE_BACKEND.
+
+    ``memory`` (the default) keeps state in this process only. For several
+    worker processes or instances use ``sqlite:///path/to/state.db`` on a
+    volume they share, or ``redis://[:password@]host:port/db``.
+    """
+    url = url or 'memory'
+    if url == 'memory':
+        return MemoryBackend()
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(unquote(parsed.path))
+    if parsed.scheme == 'redis':
+        db = parsed.path.lstrip('/')
+        return RedisBackend(parsed.hostname or 'localhost', parsed.port or 6379,
+                            password=unquote(parsed.password) if parsed.password else None,
+                            db=int(db) if db else 0)
+    raise ValueError(f"Unknown STATE_BACKEND: {url}")
+
+
+class _Waiter:
+    """Wakeups for the waiters on one task. ``seq`` counts them so none is missed."""
+
+    def __init__(self):
+        self.cond = Condition(Lock())
+        self.count = 0
+        self.seq = 0
+
+
+class MemoryBackend:
+    """Progress and records in this process's memory.
+
+    Every backend stores versioned progress states, which waiters can block
+    on, and plain records (job details, cancel requests). Both expire after
+    the TTL they were written with.
+
+    Waiters sleep on a condition of their own task, so an update only wakes
+    the streams that follow it. Subclasses call ``_wake(task_id)`` when
+    they learn that a task changed and inherit ``wait()``.
+    """
+
+    shared = False
+
+    def __init__(self, sweep_interval=30):
+        self.sweep_interval = sweep_interval
+        self.lock = RLock()
+        self.progress = {}  # task_id -> [version, state, expires]
+        self.records = {}  # (kind, key) -> (value, expires)
+        self.last_sweep = time.time()
+        self.waiters_lock = Lock()
+        self.waiters = {}  # task_id -> _Waiter
+
+    def publish(self, task_id, state, ttl):
+        """Store a new state for task_id and wake its waiters. Returns the new version."""
+        with self.lock:
+            self._maybe_sweep()
+            entry = self.progress.get(task_id)
+            version = (entry[0] if entry else 0) + 1
+            self.progress[task_id] = [version, state, time.time() + ttl]
+        self._wake(task_id)
+        return version
+
+    def read(self, task_id):
+        """(version, state) of a task, or None"""
+        with self.lock:
+            entry = self.progress.get(task_id)
+            if entry is None or entry[2] <= time.time():
+                return None
+            return entry[0], entry[1]
+
+    def wait(self, task_id, last_version, timeout=None):
+        """Block until the task has a version newer than last_version, or the timeout runs out"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waiter = self._watch(task_id)
+        try:
+            while True:
+                # Noted before reading, so a wakeup that comes in between isn't lost
+                with waiter.cond:
+                    seq = waiter.seq
+                current = self.read(task_id)
+                if current and current[0] > last_version:
+                    return current
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                with waiter.cond:
+                    waiter.cond.wait_for(lambda: waiter.seq != seq, remaining)
+        finally:
+            self._unwatch(task_id, waiter)
+
+    def _watch(self, task_id):
+        with self.waiters_lock:
+            waiter = self.waiters.get(task_id)
+            if waiter is None:
+                waiter = self.waiters[task_id] = _Waiter()
+            waiter.count += 1
+            return waiter
+
+    def _unwatch(self, task_id, waiter):
+        with self.waiters_lock:
+            waiter.count -= 1
+            if waiter.count == 0 and self.waiters.get(task_id) is waiter:
+                del self.waiters[task_id]
+
+    def _watched(self):
+        """Tasks that have waiters in this process"""
+        with self.waiters_lock:
+            return list(self.waiters)
+
+    def _wake(self, task_id):
+        """Wake the waiters of one task so they read its state again"""
+        with self.waiters_lock:
+            waiter = self.waiters.get(task_id)
+        if waiter is not None:
+            with waiter.cond:
+                waiter.seq += 1
+                waiter.cond.notify_all()
+
+    def _wake_all(self):
+        for task_id in self._watched():
+            self._wake(task_id)
+
+    def put(self, kind, key, value, ttl):
+        with self.lock:
+            self.records[(kind, key)] = (value, time.time() + ttl)
+
+    def get(self, kind, key):
+        with self.lock:
+            item = self.records.get((kind, key))
+            if item is None or item[1] <= time.time():
+                return None
+            return item[0]
+
+    def claim(self, kind, key, ttl):
+        """Store a record only if there is none yet. Returns True for the one caller that did."""
+        with self.lock:
+            if self.get(kind, key) is not None:
+                return False
+            self.put(kind, key, True, ttl)
+            return True
+
+    def delete(self, kind, key):
+        with self.lock:
+            self.records.pop((kind, key), None)
+
+    def reserve_slot(self, kind, key, interval, tolerance, ttl, max_delay=None):
+        """Book the next turn of a rate limit (GCRA) stored in a record. Returns when (epoch) it starts.
+
+        Turns are ``interval`` seconds apart; up to ``tolerance`` seconds of
+        them may be used up ahead of time, which allows bursts. The record
+        expires ``ttl`` seconds after the last booked turn. A turn starting
+        more than ``max_delay`` seconds from now isn't booked; the time
+        returned is still when it would have started.
+        """
+        with self.lock:
+            now = time.time()
+            due = max(self.get(kind, key) or now, now)
+            start = max(now, due - tolerance)
+            if max_delay is None or start - now <= max_delay:
+                self.records[(kind, key)] = (due + interval, due + interval + ttl)
+            return start
+
+    def _maybe_sweep(self):
+        """Drop expired entries. Caller holds the lock."""
+        now = time.time()
+        if now - self.last_sweep < self.sweep_interval:
+            return
+        self.last_sweep = now
+        for task_id in [t for t, entry in self.progress.items() if entry[2] <= now]:
+            del self.progress[task_id]
+        for key in [k for k, item in self.records.items() if item[1] <= now]:
+            del self.records[key]
+
+
+class SQLiteBackend(MemoryBackend):
+    """State in an SQLite database in WAL mode, shared by every process that opens it.
+
+    Writers in this process wake local waiters straight away. Updates from
+    other processes are picked up by one poller thread, which every
+    ``poll_interval`` seconds looks up the versions of all tasks waited on
+    here in one query and wakes only the waiters of those that changed.
+    Reads are plain SELECTs, which WAL lets run alongside a writer.
+    """
+
+    shared = True
+
+    # Task IDs per poll query, well below SQLite's limit on bound parameters
+    POLL_BATCH = 500
+
+    def __init__(self, path, poll_interval=0.25, sweep_interval=30):
+        super().__init__(sweep_interval)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.local = local()
+        self.poller = None
+        self.seen = {}  # task_id -> version the poller last saw
+        with self._db() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS progress ('
+                       'task_id TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL, expires REAL NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS records ('
+                       'kind TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, '
+                       'PRIMARY KEY (kind, key))')
+
+    def _conn(self):
+        """This thread's connection, in autocommit mode: a lone SELECT takes no write lock"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self.local.db = db
+        return db
+
+    def _db(self):
+        """A write transaction on this thread's connection"""
+        return _Transaction(self._conn())
+
+    def publish(self, task_id, state, ttl):
+        now = time.time()
+        with self._db() as db:
+            row = db.execute('INSERT INTO progress (task_id, version, state, expires) VALUES (?, 1, ?, ?) '
+                             'ON CONFLICT (task_id) DO UPDATE SET version = version + 1, '
+                             'state = excluded.state, expires = excluded.expires RETURNING version',
+                             (task_id, json.dumps(state), now + ttl)).fetchone()
+            if now - self.last_sweep >= self.sweep_interval:
+                self.last_sweep = now
+                db.execute('DELETE FROM progress WHERE expires <= ?', (now,))
+                db.execute('DELETE FROM records WHERE expires <= ?', (now,))
+        self._wake(task_id)
+        return row[0]
+
+    def read(self, task_id):
+        row = self._conn().execute('SELECT version, state FROM progress WHERE task_id = ? AND expires > ?',
+                                   (task_id, time.time())).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _watch(self, task_id):
+        waiter = super()._watch(task_id)
+        with self.waiters_lock:
+            if self.poller is None:
+                self.poller = Thread(target=self._poll, name='state-poller', daemon=True)
+                self.poller.start()
+        return waiter
+
+    def _poll(self):
+        """Wake the local waiters of tasks that another process has updated"""
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                watched = self._watched()
+                versions = {}
+                for i in range(0, len(watched), self.POLL_BATCH):
+                    batch = watched[i:i + self.POLL_BATCH]
+                    versions.update(self._conn().execute(
+                        f"SELECT task_id, version FROM progress WHERE task_id IN ({','.join('?' * len(batch))})",
+                        batch).fetchall())
+                for task_id in watched:
+                    version = versions.get(task_id)
+                    # A task seen for the first time may have changed since its waiter read it
+                    if task_id not in self.seen or self.seen[task_id] != version:
+                        self._wake(task_id)
+                self.seen = {task_id: versions.get(task_id) for task_id in watched}
+            except Exception as e:
+                log.warning("⚠️ Polling state failed", error=str(e))
+
+    def put(self, kind, key, value, ttl):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO records (kind, key, value, expires) VALUES (?, ?, ?, ?)',
+                       (kind, key, json.dumps(value), time.time() + ttl))
+
+    def get(self, kind, key):
+        row = self._conn().execute('SELECT value FROM records WHERE kind = ? AND key = ? AND expires > ?',
+                                   (kind, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def claim(self, kind, key, ttl):
+        now = time.time()
+        with self._db() as db:
+            db.execute('DELETE FROM records WHERE kind = ? AND key = ? AND expires <= ?', (kind, key, now))
+            cursor = db.execute('INSERT OR IGNORE INTO records (kind, key, value, expires) VALUES (?, ?, ?, ?)',
+                                (kind, key, 'true', now + ttl))
+            return cursor.rowcount == 1
+
+    def delete(self, kind, key):
+        with self._db() as db:
+            db.execute('DELETE FROM records WHERE kind = ? AND key = ?', (kind, key))
+
+    def reserve_slot(self, kind, key, interval, tolerance, ttl, max_delay=None):
+        with self._db() as db:
+            now = time.time()
+            row = db.execute('SELECT value FROM records WHERE kind = ? AND key = ? AND expires > ?',
+                             (kind, key, now)).fetchone()
+            due = max(json.loads(row[0]) if row else now, now)
+            start = max(now, due - tolerance)
+            if max_delay is None or start - now <= max_delay:
+                db.execute('INSERT OR REPLACE INTO records (kind, key, value, expires) VALUES (?, ?, ?, ?)',
+                           (kind, key, json.dumps(due + interval), due + interval + ttl))
+        return start
+
+
+class _Transaction:
+    """Run a block of statements as one IMMEDIATE transaction"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type else 'COMMIT')
+
+
+class RedisError(Exception):
+    pass
+
+
+class _RedisConnection:
+    """Just enough of the Redis protocol (RESP) for this backend"""
+
+    def __init__(self, host, port, password=None, db=0, timeout=10):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.file = self.sock.makefile('rb')
+        if password:
+            self.command('AUTH', password)
+        if db:
+            self.command('SELECT', db)
+
+    def send(self, *args):
+        out = [f'*{len(args)}\r\n'.encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+        self.sock.sendall(b''.join(out))
+
+    def reply(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Redis connection closed')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            raise RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self.file.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(rest)
+            return None if length < 0 else [self.reply() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+    def command(self, *args):
+        self.send(*args)
+        return self.reply()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+# RedisBackend.reserve_slot, run atomically by the server. Times are in ms.
+_RESERVE_SLOT_SCRIPT = '''
+local now, interval, tolerance, ttl = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local max_delay = tonumber(ARGV[5])
+local due = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local start = math.max(now, due - tolerance)
+if max_delay < 0 or start - now <= max_delay then
+    redis.call('SET', KEYS[1], string.format('%d', due + interval), 'PX', due + interval + ttl - now)
+end
+return start
+'''
+
+
+class RedisBackend(MemoryBackend):
+    """State in Redis (or anything speaking its protocol), shared by every worker and instance.
+
+    Every update is published on a channel with its task ID as the message.
+    One subscriber thread per process listens to it and wakes only the
+    waiters of that task. When the subscription has to be re-established
+    every waiter re-reads, in case it missed an update meanwhile.
+    """
+
+    shared = True
+
+    def __init__(self, host='localhost', port=6379, password=None, db=0):
+        super().__init__()
+        self.address = (host, port, password, db)
+        self.local = local()
+        self.channel = f'{REDIS_PREFIX}:progress'
+        self._conn().command('PING')
+        Thread(target=self._subscribe, name='state-subscriber', daemon=True).start()
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = _RedisConnection(*self.address)
+        return conn
+
+    def _command(self, *args):
+        """Run a command on this thread's connection, reconnecting once if it dropped"""
+        try:
+            return self._conn().command(*args)
+        except (OSError, ConnectionError):
+            self.local.conn = None
+            return self._conn().command(*args)
+
+    def _key(self, *parts):
+        return ':'.join((REDIS_PREFIX, *parts))
+
+    def _subscribe(self):
+        backoff = 1
+        while True:
+            try:
+                conn = _RedisConnection(*self.address, timeout=None)
+                conn.command('SUBSCRIBE', self.channel)
+                backoff = 1
+                self._wake_all()
+                while True:
+                    message = conn.reply()
+                    if message and message[0] == b'message':
+                        self._wake(message[2].decode())
+            except Exception as e:
+                log.warning("⚠️ State subscription lost, reconnecting", retry_in=backoff, error=str(e))
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def publish(self, task_id, state, ttl):
+        ttl = max(1, math.ceil(ttl))
+        version_key, state_key = self._key('progress', task_id, 'version'), self._key('progress', task_id)
+        conn = self._conn()
+        try:
+            for args in (('MULTI',), ('INCR', version_key), ('EXPIRE', version_key, ttl),
+                         ('SET', state_key, json.dumps(state), 'EX', ttl), ('PUBLISH', self.channel, task_id)):
+                conn.send(*args)
+            for _ in range(5):
+                conn.reply()
+            return conn.command('EXEC')[0]
+        except (OSError, ConnectionError):
+            self.local.conn = None
+            raise
+
+    def read(self, task_id):
+        version, state = self._command('MGET', self._key('progress', task_id, 'version'), self._key('progress', task_id))
+        if version is None or state is None:
+            return None
+        return int(version), json.loads(state)
+
+    def put(self, kind, key, value, ttl):
+        self._command('SET', self._key(kind, key), json.dumps(value), 'EX', max(1, math.ceil(ttl)))
+
+    def get(self, kind, key):
+        value = self._command('GET', self._key(kind, key))
+        return json.loads(value) if value is not None else None
+
+    def claim(self, kind, key, ttl):
+        return self._command('SET', self._key(kind, key), 'true', 'NX', 'EX', max(1, math.ceil(ttl))) is not None
+
+    def delete(self, kind, key):
+        self._command('DEL', self._key(kind, key))
+
+    def reserve_slot(self, kind, key, interval, tolerance, ttl, max_delay=None):
+        # In milliseconds, as Lua would print large floats in exponent notation
+        now = int(time.time() * 1000)
+        start = self._command('EVAL', _RESERVE_SLOT_SCRIPT, 1, self._key(kind, key),
+                              now, int(interval * 1000), int(tolerance * 1000), int(ttl * 1000),
+                              -1 if max_delay is None else int(max_delay * 1000))
+        return start / 1000
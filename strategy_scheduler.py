@@ -0,0 +1,141 @@
+import time
+from threading import Lock
+
+# Error classes we track separately. Anything else counts as 'other'.
+ERROR_CLASSES = ('forbidden', 'sign_in', 'format_unavailable', 'rate_limited', 'video_unavailable', 'other')
+
+# Errors that say something about the video rather than the strategy, so
+# they don't count against the strategy that hit them
+NEUTRAL_ERRORS = ('video_unavailable',)
+
+
+def classify_error(message):
+    """Map a yt-dlp error message to one of ERROR_CLASSES"""
+    text = (message or '').lower()
+    if '403' in text or 'forbidden' in text:
+        return 'forbidden'
+    if '429' in text or 'too many requests' in text:
+        return 'rate_limited'
+    if 'sign in' in text or 'login required' in text or 'confirm you' in text:
+        return 'sign_in'
+    if 'requested format is not available' in text or 'no video formats' in text:
+        return 'format_unavailable'
+    if 'video unavailable' in text or 'private video' in text or 'has been removed' in text:
+        return 'video_unavailable'
+    return 'other'
+
+
+class StrategyStats:
+    """Rolling statistics for one strategy"""
+
+    def __init__(self, name, prior):
+        self.name = name
+        self.success_rate = prior
+        self.latency = None  # seconds, exponentially weighted
+        self.error_rates = {cls: 0.0 for cls in ERROR_CLASSES}
+        self.attempts = 0
+        self.successes = 0
+        self.failures = 0
+        self.errors = {cls: 0 for cls in ERROR_CLASSES}
+        self.consecutive_failures = 0
+        self.backoff_until = 0.0
+        self.last_error = None
+
+    def to_dict(self, now):
+        return {
+            'name': self.name,
+            'success_rate': round(self.success_rate, 4),
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'error_rates': {cls: round(rate, 4) for cls, rate in self.error_rates.items()},
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'failures': self.failures,
+            'errors': dict(self.errors),
+            'consecutive_failures': self.consecutive_failures,
+            'backoff_remaining': round(max(self.backoff_until - now, 0.0), 1),
+            'last_error': self.last_error,
+        }
+
+
+class StrategyScheduler:
+    """Orders download strategies by how well they have been working lately.
+
+    Success rate, latency and per-error-class failure rates are exponentially
+    weighted moving averages, so recent attempts count the most. Strategies
+    that keep failing are backed off for an exponentially growing period and
+    only tried after the healthy ones. The configured order acts as a prior
+    and breaks ties.
+    """
+
+    def __init__(self, strategies, alpha=0.2, backoff_base=15.0, backoff_max=600.0):
+        self.strategies = list(strategies)
+        self.alpha = alpha
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lock = Lock()
+        # Small decreasing prior keeps the configured order until we learn otherwise
+        self.stats = {s['name']: StrategyStats(s['name'], 1.0 - 0.01 * i)
+                      for i, s in enumerate(self.strategies)}
+
+    def _score(self, stats, default_latency):
+        # Penalise slow strategies gently: every 10 s of latency halves the score.
+        # Untried strategies are assumed to be as fast as the average one.
+        latency = stats.latency if stats.latency is not None else default_latency
+        return stats.success_rate / (1.0 + latency / 10.0)
+
+    def order(self):
+        """Strategies to try, best first, with backed-off ones at the end"""
+        now = time.time()
+        with self.lock:
+            position = {s['name']: i for i, s in enumerate(self.strategies)}
+            known = [st.latency for st in self.stats.values() if st.latency is not None]
+            default_latency = sum(known) / len(known) if known else 0.0
+
+            def sort_key(strategy):
+                stats = self.stats[strategy['name']]
+                backed_off = stats.backoff_until > now
+                return (backed_off, -self._score(stats, default_latency), position[strategy['name']])
+
+            return sorted(self.strategies, key=sort_key)
+
+    def record(self, name, success, latency=None, error=None):
+        """Record the outcome of one attempt with a strategy"""
+        error_class = None if success else classify_error(error)
+        with self.lock:
+            stats = self.stats[name]
+            stats.attempts += 1
+            if latency is not None:
+                stats.latency = latency if stats.latency is None else \
+                    (1 - self.alpha) * stats.latency + self.alpha * latency
+
+            if success:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.backoff_until = 0.0
+            else:
+                stats.failures += 1
+                stats.errors[error_class] += 1
+                stats.last_error = error_class
+                if error_class in NEUTRAL_ERRORS:
+                    return error_class
+                stats.consecutive_failures += 1
+                # Being blocked is a strong signal, back off straight away
+                if stats.consecutive_failures >= 2 or error_class in ('forbidden', 'sign_in', 'rate_limited'):
+                    delay = self.backoff_base * 2 ** (stats.consecutive_failures - 1)
+                    stats.backoff_until = time.time() + min(delay, self.backoff_max)
+
+            stats.success_rate = (1 - self.alpha) * stats.success_rate + self.alpha * (1.0 if success else 0.0)
+            for cls in ERROR_CLASSES:
+                hit = 1.0 if cls == error_class else 0.0
+                stats.error_rates[cls] = (1 - self.alpha) * stats.error_rates[cls] + self.alpha * hit
+        return error_class
+
+    def snapshot(self):
+        """Current statistics, in the order strategies would be tried now"""
+        now = time.time()
+        order = [s['name'] for s in self.order()]
+        with self.lock:
+            return {
+                'order': order,
+                'strategies': [self.stats[name].to_dict(now) for name in order],
+            }
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import uuid
+import pytest
+
+# The app is a set of flat modules at the repository root, and yt-dlp finds
+# the benchmark media server's stub extractor as a plugin under benchmarks/
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(1, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def media_server(tmp_path_factory):
+    """Local media server (see benchmarks/media_server.py) with its videos generated once per run"""
+    from benchmarks.media_server import MediaServer
+    media_dir = os.environ.get('TEST_MEDIA_DIR') or str(tmp_path_factory.mktemp('media'))
+    server = MediaServer(media_dir=media_dir).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The app module, configured to work in temp directories and never wait for upstream turns"""
+    root = tmp_path_factory.mktemp('app')
+    os.environ.update({
+        'SCRATCH_DIR': str(root / 'scratch'),
+        'CACHE_DIR': str(root / 'cache'),
+        'SCRATCH_MIN_FREE_BYTES': '0',
+        'UPSTREAM_RATE': '0',
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'warning'),
+    })
+    os.environ.pop('STATE_BACKEND', None)
+    os.environ.pop('METRICS_DIR', None)
+    import app
+    assert app.pool_warm.wait(60)
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def video_url(media_server):
+    """URL of a fresh video on the media server, e.g. video_url('split', '2M')"""
+    def make(kind='progressive', size='2M'):
+        return f'{media_server.base_url}/bench/{kind}-{size}-{uuid.uuid4().hex[:12]}'
+    return make
+
+
+def wait_for_job(client, task_id, timeout=60):
+    """Poll a job until it has finished and return its final state"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f'/jobs/{task_id}').get_json()
+        if job['status'] in ('complete', 'error', 'cancelled'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'Job {task_id} did not finish within {timeout}s')
@@ -0,0 +1,178 @@
+import os
+import socket
+import subprocess
+import sys
+from collections import namedtuple
+import pytest
+import admission
+from admission import Overloaded, ScratchSpace, Slots, estimate_size
+
+MB = 1024 ** 2
+
+
+def test_estimate_size():
+    assert estimate_size({'filesize': 100}, 1) == 100
+    assert estimate_size({'requested_formats': [{'filesize': 100}, {'filesize_approx': 50}]}, 1) == 150
+    # 1000 kbit/s for 8 seconds
+    assert estimate_size({'tbr': 1000, 'duration': 8}, 1) == 1_000_000
+    assert estimate_size({'requested_formats': [{'filesize': 100}, {}]}, 7) == 7
+
+
+@pytest.fixture
+def disk(monkeypatch):
+    """A pretend 1 GB scratch disk with ``free`` bytes left"""
+    usage = {'free': 1024 * MB}
+    DiskUsage = namedtuple('DiskUsage', 'total used free')
+    monkeypatch.setattr(admission.shutil, 'disk_usage', lambda path: DiskUsage(1024 * MB, 0, usage['free']))
+    return usage
+
+
+def test_budget_is_shared_between_instances(tmp_path, disk):
+    # Two ScratchSpaces on one root stand in for two workers
+    first = ScratchSpace(str(tmp_path), max_bytes=100 * MB, wait_timeout=0)
+    second = ScratchSpace(str(tmp_path), max_bytes=100 * MB, wait_timeout=0)
+    a = first.create()
+    assert first.admit(a, 30 * MB) == 60 * MB
+    b = second.create()
+    with pytest.raises(Overloaded) as e:
+        second.admit(b, 30 * MB)
+    assert e.value.retry_after == 30
+    # Admitting the same directory again replaces its reservation
+    assert first.admit(a, 10 * MB) == 20 * MB
+    assert second.admit(b, 30 * MB) == 60 * MB
+    assert first.stats()['reserved_bytes'] == 20 * MB
+
+    first.release(a)
+    assert not os.path.exists(a)
+    assert first.stats()['reserved_dirs'] == 0
+
+
+def test_written_bytes_count_once_they_pass_the_estimate(tmp_path, disk):
+    space = ScratchSpace(str(tmp_path), max_bytes=100 * MB, wait_timeout=0)
+    path = space.create()
+    space.admit(path, 10 * MB)
+    with open(os.path.join(path, 'part'), 'wb') as f:
+        f.truncate(90 * MB)
+    # 20 MB reserved but 90 MB written: 12 MB more don't fit
+    with pytest.raises(Overloaded):
+        space.admit(space.create(), 6 * MB)
+
+
+def test_min_free_bytes(tmp_path, disk):
+    space = ScratchSpace(str(tmp_path), min_free_bytes=100 * MB, default_estimate=10 * MB, wait_timeout=0)
+    disk['free'] = 150 * MB
+    space.check()
+    path = space.create()
+    assert space.admit(path, 20 * MB) == 40 * MB
+    # The reserved 40 MB haven't been written yet but will come off the disk
+    with pytest.raises(Overloaded, match='free on the scratch disk'):
+        space.admit(space.create(), 10 * MB)
+    disk['free'] = 120 * MB
+    with pytest.raises(Overloaded):
+        space.check()
+
+
+def test_too_big_for_the_budget_fails_at_once(tmp_path, disk):
+    space = ScratchSpace(str(tmp_path), max_bytes=100 * MB)
+    with pytest.raises(Overloaded) as e:
+        space.admit(space.create(), 60 * MB)
+    assert e.value.retry_after is None
+
+
+def test_wait_for_room(tmp_path, disk, monkeypatch):
+    space = ScratchSpace(str(tmp_path), max_bytes=100 * MB)
+    held = space.create()
+    space.admit(held, 40 * MB)
+    monkeypatch.setattr(admission.time, 'sleep', lambda seconds: None)
+    reasons = []
+
+    def on_wait(reason):
+        reasons.append(reason)
+        if len(reasons) == 2:
+            space.release(held)
+
+    assert space.admit(space.create(), 40 * MB, on_wait=on_wait) == 80 * MB
+    assert len(reasons) == 2 and 'scratch space in use' in reasons[0]
+    # The 80 MB just admitted leave no room for another 80
+    assert space.admit(space.create(), 40 * MB, cancelled=lambda: True) is None
+
+
+def test_orphaned_directories_are_removed(tmp_path):
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True).stdout.strip()
+    orphan = tmp_path / f'{socket.gethostname()}-{dead}'
+    other_host = tmp_path / f'elsewhere-{dead}'
+    alive = tmp_path / f'{socket.gethostname()}-{os.getppid()}'
+    for path in (orphan, other_host, alive):
+        (path / 'tmp').mkdir(parents=True)
+    ScratchSpace(str(tmp_path))
+    assert not orphan.exists()
+    assert other_host.exists() and alive.exists()
+
+
+def test_slots(tmp_path):
+    # Two instances on one directory stand in for two workers
+    first = Slots(str(tmp_path), 'transcode', 2, wait_timeout=0, retry_after=5)
+    second = Slots(str(tmp_path), 'transcode', 2, wait_timeout=0, retry_after=5)
+    a = first.acquire()
+    b = second.acquire()
+    assert second.try_acquire() is None
+    assert second.acquire(cancelled=lambda: True) is None
+    with pytest.raises(Overloaded) as e:
+        first.acquire()
+    assert e.value.retry_after == 5
+    first.release(a)
+    c = second.acquire()
+    assert second.stats() == {'max': 2, 'held_here': 2}
+    second.release(b)
+    second.release(c)
+    assert Slots(str(tmp_path), 'unlimited', 0).acquire() is True
+
+
+def test_slot_of_a_dead_process_comes_free(tmp_path):
+    holder = subprocess.Popen([sys.executable, '-c', f'''
+import sys
+sys.path.insert(0, {os.path.dirname(admission.__file__)!r})
+from admission import Slots
+slot = Slots({str(tmp_path)!r}, 'transcode', 1).acquire()
+print('held', flush=True)
+sys.stdin.read()
+'''], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    assert holder.stdout.readline().strip() == 'held'
+    slots = Slots(str(tmp_path), 'transcode', 1)
+    assert slots.try_acquire() is None
+    holder.kill()
+    holder.wait()
+    assert slots.try_acquire() is not None
+
+
+def test_work_areas(tmp_path):
+    first = ScratchSpace(str(tmp_path))
+    second = ScratchSpace(str(tmp_path))
+    path = first.claim('video-1')
+    assert path == os.path.join(first.work_dir, 'video-1')
+    assert second.claim('video-1') is None
+    with open(os.path.join(path, 'x.part'), 'wb') as f:
+        f.write(b'partial')
+
+    # A kept work area goes to the next attempt with its files
+    first.keep(path)
+    assert second.claim('video-1') == path
+    assert os.listdir(path) == ['x.part']
+    second.release(path)
+    assert not os.path.exists(path)
+    assert first.claim('video-1') == path and os.listdir(path) == []
+
+
+def test_kept_work_areas_expire(tmp_path):
+    space = ScratchSpace(str(tmp_path), keep_ttl=3600)
+    kept, busy = space.claim('kept'), space.claim('busy')
+    space.keep(kept)
+    space.remove_expired()
+    assert os.path.exists(kept)
+
+    space.keep_ttl = 0
+    space.remove_expired()
+    assert not os.path.exists(kept) and not os.path.exists(f'{kept}.lock')
+    # One that is claimed right now stays
+    assert os.path.exists(busy)
@@ -0,0 +1,256 @@
+import io
+import os
+import re
+import subprocess
+import time
+import zipfile
+from threading import BoundedSemaphore
+import pytest
+from conftest import wait_for_job
+from rate_limit import RateLimiter, UpstreamBusy
+from state_backend import MemoryBackend
+
+
+def download(client, url, download_type='video', **params):
+    """Run a job to completion and return its final state"""
+    response = client.post('/jobs', json={'url': url, 'type': download_type, **params})
+    assert response.status_code == 202, response.get_json()
+    job = wait_for_job(client, response.get_json()['task_id'])
+    assert job['status'] == 'complete', job
+    return job
+
+
+def test_job_download(client, video_url):
+    job = download(client, video_url())
+    response = client.get(f"/jobs/{job['task_id']}/file")
+    assert response.status_code == 200
+    assert response.mimetype == 'video/mp4'
+    assert len(response.data) == job['size']
+    response.close()
+
+
+def test_cached_file_is_pinned_until_the_job_is_released(app_module, client, video_url):
+    job = download(client, video_url())
+    task_id = job['task_id']
+    path = app_module.job_queue.get(task_id).result['path']
+
+    # Another download pushing the cache over budget can't evict the unfetched file
+    cache = app_module.result_cache
+    max_bytes, cache.max_bytes = cache.max_bytes, 1
+    try:
+        with cache.lock:
+            cache._evict()
+        assert os.path.exists(path)
+        response = client.get(f'/jobs/{task_id}/file')
+        assert response.status_code == 200
+        response.close()
+
+        app_module.job_queue.discard(task_id)
+        assert not os.path.exists(path)
+    finally:
+        cache.max_bytes = max_bytes
+
+
+def test_file_gone_from_under_a_job_is_410(app_module, client, video_url):
+    job = download(client, video_url())
+    # As if another worker process had evicted it from the shared cache directory
+    os.remove(app_module.job_queue.get(job['task_id']).result['path'])
+    response = client.get(f"/jobs/{job['task_id']}/file")
+    assert response.status_code == 410
+    assert response.get_json()['error'] == 'The file is no longer available'
+
+
+def test_info_then_audio_download(app_module, client, media_server, video_url):
+    url = video_url('split')
+    info = client.get('/info', query_string={'url': url}).get_json()
+    assert [f['format_id'] for f in info['formats']] == ['video', 'audio']
+
+    # The audio download reuses the extraction but picks its own formats
+    sent = media_server.bytes_sent
+    job = download(client, url, 'audio')
+    assert job['filename'].endswith(('.m4a', '.mp3'))
+    # Only the audio stream is fetched (give or take a range probe)
+    sizes = media_server.library.get('2M')['sizes']
+    assert sizes['audio.m4a'] <= media_server.bytes_sent - sent < sizes['video.mp4']
+    assert app_module.info_cache.stats()['hits'] >= 1
+
+
+def test_audio_then_video_download(client, media_server, video_url):
+    url = video_url('split')
+    audio = download(client, url, 'audio')
+    video = download(client, url, 'video')
+    assert audio['filename'].endswith(('.m4a', '.mp3'))
+    assert video['filename'].endswith('.mp4')
+
+    response = client.get(f"/jobs/{video['task_id']}/file")
+    sizes = media_server.library.get('2M')['sizes']
+    # Merged from both streams rather than only the audio picked before
+    assert len(response.data) > sizes['video.mp4']
+    response.close()
+
+
+def test_progress_stream(client, video_url):
+    task_id = client.post('/jobs', json={'url': video_url()}).get_json()['task_id']
+    response = client.get(f'/progress/{task_id}')
+    assert response.mimetype == 'text/event-stream'
+    events = [block for block in response.get_data(as_text=True).split('\n\n') if block.startswith('id:')]
+    ids = [int(block.split('\n')[0][len('id: '):]) for block in events]
+    assert ids == sorted(ids)
+    assert '"status": "complete"' in events[-1]
+
+    # A reconnecting client only gets the events it missed
+    response = client.get(f'/progress/{task_id}', headers={'Last-Event-ID': str(ids[-2])})
+    assert response.get_data(as_text=True).startswith(f'id: {ids[-1]}\n')
+
+
+def test_progress_stream_of_an_unknown_task_ends(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, 'SSE_HEARTBEAT', 0.2)
+    response = client.get('/progress/no-such-task')
+    assert response.get_data(as_text=True) == 'data: {"status": "error", "message": "Unknown or expired task"}\n\n'
+
+
+def test_progress_streams_past_the_limit_get_503(app_module, client, monkeypatch, video_url):
+    monkeypatch.setattr(app_module, 'sse_slots', BoundedSemaphore(1))
+    task_id = client.post('/jobs', json={'url': video_url()}).get_json()['task_id']
+    first = client.get(f'/progress/{task_id}')
+    assert first.mimetype == 'text/event-stream'
+    busy = client.get(f'/progress/{task_id}')
+    assert busy.status_code == 503
+    assert busy.headers['Retry-After'] == str(app_module.SSE_HEARTBEAT)
+    # The slot is given back once the first stream closes
+    first.get_data()
+    first.close()
+    assert client.get(f'/progress/{task_id}').mimetype == 'text/event-stream'
+
+
+def probe_streams(data, tmp_path):
+    """Kinds of streams in a media file, as ffmpeg reports them"""
+    path = tmp_path / 'probe'
+    path.write_bytes(data)
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-i', str(path)], capture_output=True, text=True)
+    return sorted(re.findall(r'Stream #\S+.*?: (Audio|Video):', result.stderr))
+
+
+def test_audio_then_video_stream(client, video_url, tmp_path):
+    url = video_url('split')
+    audio = client.get('/download', query_string={'url': url, 'type': 'audio', 'stream': '1'})
+    assert audio.status_code == 200 and 'X-Stream-Mode' in audio.headers
+    assert audio.mimetype.startswith('audio/')
+    assert probe_streams(audio.data, tmp_path) == ['Audio']
+
+    # Reuses the extraction, but not the audio-only format picked for the first request
+    video = client.get('/download', query_string={'url': url, 'type': 'video', 'stream': '1'})
+    assert video.status_code == 200 and 'X-Stream-Mode' in video.headers
+    assert video.mimetype == 'video/mp4'
+    assert probe_streams(video.data, tmp_path) == ['Audio', 'Video']
+
+
+def test_processing_path_is_reported(client, video_url):
+    # The benchmark media is H.264/AAC already, so nothing gets re-encoded
+    progressive = download(client, video_url('progressive'), mode='compatible')
+    assert progressive['processing'] == 'direct'
+    merged = download(client, video_url('split'), mode='fast')
+    assert merged['processing'] in ('direct', 'remux')
+    response = client.get(f"/jobs/{merged['task_id']}/file")
+    assert response.headers['X-Processing-Path'] == merged['processing']
+    response.close()
+
+
+def test_batch_zip(client, media_server, video_url):
+    urls = [video_url(), video_url('split'), f'{media_server.base_url}/missing']
+    response = client.post('/batch', json={'urls': urls})
+    assert response.status_code == 202
+    batch_id = response.get_json()['batch_id']
+
+    response = client.get(f'/batch/{batch_id}/zip')
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.data))
+    names = archive.namelist()
+    assert sorted(names[:2]) == ['Benchmark progressive 2M.mp4', 'Benchmark split 2M.mp4']
+    assert names[2] == 'errors.txt'
+    assert urls[2] in archive.read('errors.txt').decode()
+    assert client.get(f'/batch/{batch_id}/zip').status_code == 409
+
+    batch = client.get(f'/batch/{batch_id}').get_json()
+    assert batch['counts'] == {'complete': 2, 'error': 1}
+
+
+def test_requests_without_a_turn_upstream_get_429(app_module, client, monkeypatch, media_server, video_url):
+    limiter = RateLimiter(MemoryBackend(), rate=1, burst=1, jitter=0)
+    monkeypatch.setattr(app_module, 'upstream_limiter', limiter)
+    host = media_server.base_url.split('//')[1].split(':')[0]
+
+    limiter.try_acquire(host)
+    for response in (client.get('/info', query_string={'url': video_url()}),
+                     client.post('/batch', json={'url': video_url()})):
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        assert response.get_json()['retry_after'] == 1
+
+    # Jobs run on workers, which wait for their turn instead
+    with pytest.raises(UpstreamBusy):
+        limiter.try_acquire(host)
+    job = download(client, video_url())
+    assert job['status'] == 'complete'
+
+    # and so does a live stream, falling back to the buffered path
+    while True:
+        try:
+            limiter.try_acquire(host)
+            break
+        except UpstreamBusy as e:
+            time.sleep(e.retry_after / 10)
+    response = client.get('/download', query_string={'url': video_url(), 'stream': '1'})
+    assert response.status_code == 200
+    assert 'X-Stream-Mode' not in response.headers
+    response.close()
+
+
+def test_cached_files_skip_the_queue(app_module, client, monkeypatch, video_url):
+    # Bench URLs stand in for URLs whose video ID is known without yt-dlp
+    monkeypatch.setattr(app_module, 'canonical_video_id',
+                        lambda url: ('bench', url.rsplit('-', 1)[1]) if '/bench/' in url else None)
+    url = video_url()
+    first = download(client, url)
+
+    def full(*args, **kwargs):
+        raise AssertionError('a cached file should not need the queue or the scratch disk')
+
+    monkeypatch.setattr(app_module, 'queue_job', full)
+    response = client.post('/jobs', json={'url': url})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['status'] == 'complete' and job['size'] == first['size']
+    response = client.get(f"/jobs/{job['task_id']}/file")
+    assert response.headers['X-Cache'] == 'HIT'
+    response.close()
+
+    for stream in ('0', '1'):
+        response = client.get('/download', query_string={'url': url, 'stream': stream})
+        assert response.status_code == 200 and response.headers['X-Cache'] == 'HIT'
+        assert len(response.data) == first['size']
+        response.close()
+
+
+def test_followers_take_no_worker(app_module, client, media_server, monkeypatch, video_url):
+    monkeypatch.setattr(media_server, 'bandwidth', 512 * 1024)
+    url = video_url()
+    leader = client.post('/jobs', json={'url': url}).get_json()['task_id']
+    while not app_module.download_flights.in_flight():
+        time.sleep(0.05)
+    running = app_module.job_queue.stats()['running']
+
+    follower, other = (client.post('/jobs', json={'url': url}).get_json() for _ in range(2))
+    assert follower['status'] == other['status'] == 'running'
+    assert app_module.job_queue.stats()['running'] == running
+    assert list(app_module.download_flights.in_flight().values()) == [3]
+
+    # Cancelling a follower ends it at once and leaves the download running for the others
+    client.delete(f"/jobs/{follower['task_id']}")
+    assert client.get(f"/jobs/{follower['task_id']}").get_json()['status'] == 'cancelled'
+
+    done = [wait_for_job(client, task_id) for task_id in (leader, other['task_id'])]
+    assert [job['status'] for job in done] == ['complete', 'complete']
+    response = client.get(f"/jobs/{other['task_id']}/file")
+    assert len(response.data) == done[1]['size']
+    response.close()
@@ -0,0 +1,93 @@
+import threading
+import time
+from batch import Batch
+from jobs import QueueFull
+
+ENTRIES = [{'url': f'https://example.com/{i}', 'title': f'Video {i}'} for i in range(5)]
+
+
+class FakeJob:
+    def __init__(self):
+        self.done = threading.Event()
+        self.status = 'queued'
+        self.error = None
+
+    def finish(self, status='complete', error=None):
+        self.status = status
+        self.error = error
+        self.done.set()
+
+
+class FakeQueue:
+    """Stands in for the job queue, tracking how many jobs a batch has in it at once"""
+
+    def __init__(self, full=0):
+        self.jobs = {}
+        self.full = full
+        self.cancelled = []
+        self.max_active = 0
+
+    def submit(self, item):
+        if self.full:
+            self.full -= 1
+            raise QueueFull(0)
+        self.jobs[item.task_id] = FakeJob()
+        active = sum(not job.done.is_set() for job in self.jobs.values())
+        self.max_active = max(self.max_active, active)
+        return self.jobs[item.task_id]
+
+    def cancel(self, item):
+        self.cancelled.append(item.task_id)
+        self.jobs[item.task_id].finish('cancelled', 'Download cancelled')
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_runs_a_few_at_a_time_and_hands_out_items_as_they_finish():
+    jobs = FakeQueue()
+    batch = Batch('b', ENTRIES, jobs.submit, jobs.cancel, concurrency=2).start()
+    finished = batch.completed()
+    for i in (1, 0, 2, 4, 3):
+        wait_until(lambda: f'b-{i}' in jobs.jobs)
+        jobs.jobs[f'b-{i}'].finish('error' if i == 4 else 'complete', 'boom' if i == 4 else None)
+        batch.wakeup.set()
+        wait_until(lambda: batch.items[i].finished)
+        if i in (1, 0):
+            item = next(finished)
+            assert item.index == i and item.status == 'complete'
+    rest = list(finished)
+    assert [item.index for item in rest] == [2, 4, 3]
+    assert rest[1].error == 'boom'
+    assert jobs.max_active <= 2
+    assert batch.counts() == {'complete': 4, 'error': 1}
+
+
+def test_waits_for_room_in_a_full_queue():
+    jobs = FakeQueue(full=1)
+    batch = Batch('b', ENTRIES[:1], jobs.submit, jobs.cancel).start()
+    wait_until(lambda: 'b-0' in jobs.jobs)
+    jobs.jobs['b-0'].finish()
+    batch.wakeup.set()
+    assert [item.status for item in batch.completed()] == ['complete']
+
+
+def test_cancel_stops_active_and_pending_items():
+    jobs = FakeQueue()
+    batch = Batch('b', ENTRIES, jobs.submit, jobs.cancel, concurrency=2).start()
+    wait_until(lambda: len(jobs.jobs) == 2)
+    batch.cancel()
+    items = list(batch.completed())
+    assert {item.status for item in items} == {'cancelled'}
+    assert sorted(jobs.cancelled) == ['b-0', 'b-1']
+    assert len(jobs.jobs) == 2
+
+
+def test_only_one_stream():
+    batch = Batch('b', ENTRIES, None, None)
+    assert batch.claim_stream()
+    assert not batch.claim_stream()
@@ -0,0 +1,98 @@
+import json
+import sys
+import urllib.error
+import urllib.request
+from threading import Thread
+import pytest
+import yt_dlp
+from werkzeug.serving import make_server
+from benchmarks import compare
+from benchmarks.load import distribution, percentile, run_load, summarize
+from benchmarks.media_server import parse_size
+
+
+def test_parse_size():
+    assert parse_size('10M') == 10 * 1024 * 1024
+    assert parse_size('1.5k') == 1536
+    assert parse_size('2GB') == 2 * 1024 ** 3
+    assert parse_size(4096) == 4096
+    with pytest.raises(ValueError):
+        parse_size('10X')
+
+
+def test_percentiles():
+    assert percentile([], 50) is None
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([0, 10], 95) == 9.5
+    assert distribution([None, None]) is None
+    assert distribution([1, None, 3]) == {'p50': 2, 'p95': 2.9, 'p99': 2.98, 'mean': 2, 'max': 3, 'count': 2}
+
+
+def fetch(url, **headers):
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+            return response.status, dict(response.headers), response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, dict(e.headers), e.read()
+
+
+def test_media_server_ranges(media_server):
+    url = f'{media_server.base_url}/media/2M/progressive.mp4'
+    size = media_server.library.get('2M')['sizes']['progressive.mp4']
+    with open(media_server.library.path('2M', 'progressive.mp4'), 'rb') as f:
+        data = f.read()
+
+    status, headers, body = fetch(url)
+    assert (status, body) == (200, data)
+    status, headers, body = fetch(url, Range='bytes=100-199')
+    assert (status, headers['Content-Range'], body) == (206, f'bytes 100-199/{size}', data[100:200])
+    status, headers, body = fetch(url, Range='bytes=-10')
+    assert (status, body) == (206, data[-10:])
+    status, headers, body = fetch(url, Range=f'bytes={size}-')
+    assert (status, headers['Content-Range']) == (416, f'bytes */{size}')
+    assert fetch(f'{media_server.base_url}/media/2M/missing.mp4')[0] == 404
+
+
+@pytest.mark.parametrize('kind', ['progressive', 'split', 'dash', 'hls'])
+def test_bench_extractor(video_url, kind):
+    with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+        info = ydl.extract_info(video_url(kind), download=False)
+    assert info['extractor'] == 'bench'
+    assert info['title'].startswith('Benchmark')
+    assert info['formats'] and all(f.get('url') for f in info['formats'])
+    assert info['format_id']
+
+
+@pytest.fixture
+def app_url(app_module):
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def test_load_run(app_url, video_url):
+    results = run_load(app_url, [video_url(), video_url('split')], {'type': 'video'}, concurrency=2, timeout=120)
+    assert [r['error'] for r in results] == [None, None]
+    assert all(r['status'] == 200 and r['bytes'] > 0 for r in results)
+    assert all(r['sse']['final_status'] == 'complete' for r in results)
+
+    summary = summarize(results, cpu_seconds=2.0, peak_rss=100, wall_seconds=4.0)
+    assert (summary['jobs'], summary['ok'], summary['failed']) == (2, 2, 0)
+    assert summary['bytes'] == sum(r['bytes'] for r in results)
+    assert summary['cpu_s_per_job'] == 1.0
+    assert summary['sse']['events_per_job']['count'] == 2
+
+
+def test_compare(tmp_path, monkeypatch, capsys):
+    paths = []
+    for commit, ttfb, config in (('aaa', 2.0, {'jobs': 4}), ('bbb', 1.5, {'jobs': 8})):
+        paths.append(tmp_path / f'{commit}.json')
+        paths[-1].write_text(json.dumps({'commit': commit, 'config': config,
+                                         'summary': {'ok': 4, 'ttfb_s': {'p50': ttfb}}}))
+    monkeypatch.setattr(sys, 'argv', ['compare', *map(str, paths)])
+    assert compare.main() == 0
+    out = capsys.readouterr().out
+    ttfb = next(line for line in out.splitlines() if line.startswith('ttfb p50'))
+    assert '2.000s' in ttfb and '1.500s (-25%)' in ttfb
+    assert 'different settings' in out
@@ -0,0 +1,158 @@
+import io
+import os
+import zipfile
+import pytest
+from flask import Flask
+from file_stream import parse_byte_ranges, send_download, zip_stream
+
+DATA = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def served(tmp_path):
+    """A Flask client serving DATA through send_download, and the list of on_close calls"""
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(DATA)
+    closed = []
+    app = Flask(__name__)
+
+    @app.route('/file')
+    def file():
+        return send_download(str(path), 'video.mp4', 'video/mp4', on_close=lambda: closed.append(True))
+
+    return app.test_client(), closed
+
+
+@pytest.mark.parametrize('header, expected', [
+    (None, None),
+    ('', None),
+    ('items=0-1', None),
+    ('bytes=', None),
+    ('bytes=abc', None),
+    ('bytes=5-2', None),
+    ('bytes=0-99', [(0, 100)]),
+    ('bytes=100-', [(100, 1000)]),
+    ('bytes=-100', [(900, 1000)]),
+    ('bytes=-5000', [(0, 1000)]),
+    ('bytes=900-5000', [(900, 1000)]),
+    ('bytes=0-9, 5-19, 20-29', [(0, 30)]),
+    ('bytes=500-599,0-9', [(0, 10), (500, 600)]),
+    ('bytes=1000-', []),
+    ('bytes=-0', []),
+])
+def test_parse_byte_ranges(header, expected):
+    assert parse_byte_ranges(header, 1000) == expected
+
+
+def test_full_response(served):
+    client, closed = served
+    response = client.get('/file')
+    assert response.status_code == 200
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert 'attachment; filename="video.mp4"' == response.headers['Content-Disposition']
+    assert response.data == DATA
+    response.close()
+    assert closed == [True]
+
+
+def test_single_range(served):
+    client, closed = served
+    response = client.get('/file', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+    assert response.headers['Content-Length'] == '100'
+    assert response.data == DATA[100:200]
+    response.close()
+    assert closed == [True]
+
+
+def test_tail_range(served):
+    client, _ = served
+    response = client.get('/file', headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206
+    assert response.data == DATA[-10:]
+
+
+def test_multiple_ranges(served):
+    client, _ = served
+    response = client.get('/file', headers={'Range': 'bytes=0-9,5000-5009'})
+    assert response.status_code == 206
+    content_type = response.headers['Content-Type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1]
+    body = response.get_data()
+    assert int(response.headers['Content-Length']) == len(body)
+
+    parts = body.split(f'--{boundary}'.encode())[1:-1]
+    assert len(parts) == 2
+    for part, (start, end) in zip(parts, [(0, 10), (5000, 5010)]):
+        head, _, payload = part.partition(b'\r\n\r\n')
+        assert f'Content-Range: bytes {start}-{end - 1}/{len(DATA)}'.encode() in head
+        assert payload[:-2] == DATA[start:end]
+
+
+def test_unsatisfiable_range(served):
+    client, closed = served
+    response = client.get('/file', headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+    # The file is closed and cleaned up straight away
+    assert closed == [True]
+
+
+def test_if_range(served):
+    client, _ = served
+    etag = client.get('/file').headers['ETag']
+
+    response = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.data == DATA[:10]
+
+    # A stale validator gets the whole file back
+    response = client.get('/file', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert response.data == DATA
+
+
+def test_missing_file_runs_cleanup(tmp_path):
+    closed = []
+    app = Flask(__name__)
+    with app.test_request_context('/file'):
+        with pytest.raises(FileNotFoundError):
+            send_download(os.path.join(tmp_path, 'gone.mp4'), 'gone.mp4', 'video/mp4',
+                          on_close=lambda: closed.append(True))
+    assert closed == [True]
+
+
+def test_zip_stream(tmp_path):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(DATA * 20)  # several read chunks
+    chunks = list(zip_stream(iter([('a.mp4', str(video)), ('errors.txt', b'x: failed\n')])))
+    assert len(chunks) > 2
+
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    assert archive.namelist() == ['a.mp4', 'errors.txt']
+    assert archive.read('a.mp4') == DATA * 20
+    assert archive.read('errors.txt') == b'x: failed\n'
+    assert archive.getinfo('a.mp4').compress_type == zipfile.ZIP_STORED
+
+
+def test_zip_stream_yields_each_member_as_it_arrives(tmp_path):
+    video = tmp_path / 'a.mp4'
+    video.write_bytes(DATA)
+    produced = []
+
+    def members():
+        produced.append('a')
+        yield 'a.mp4', str(video)
+        produced.append('b')
+        yield 'b.mp4', str(video)
+
+    stream = zip_stream(members())
+    next(stream)
+    # Bytes of the first member go out before the second is asked for
+    assert produced == ['a']
+    list(stream)
+    assert produced == ['a', 'b']
@@ -0,0 +1,150 @@
+import threading
+import pytest
+from jobs import Job, JobCancelled, JobQueue, QueueFull
+
+
+class Handler:
+    """Job handler that blocks until told to go on, recording what ran and what got released"""
+
+    def __init__(self):
+        self.go = threading.Event()
+        self.started = []
+        self.released = []
+
+    def __call__(self, job):
+        self.started.append(job.task_id)
+        self.go.wait(5)
+        if job.cancelled:
+            raise JobCancelled('Download cancelled')
+        if job.url == 'fail':
+            raise RuntimeError('boom')
+        result = {'path': '/tmp/x', 'filename': f'{job.task_id}.mp4', 'mimetype': 'video/mp4', 'size': 1}
+        return result, lambda: self.released.append(job.task_id)
+
+
+def test_runs_jobs_and_keeps_the_result():
+    handler = Handler()
+    queue = JobQueue(handler, workers=1)
+    handler.go.set()
+    job = queue.submit('a', 'url', 'video', mode='fast')
+    assert job.done.wait(5)
+    assert job.status == 'complete'
+    assert job.to_dict()['filename'] == 'a.mp4'
+    assert job.to_dict()['mode'] == 'fast'
+    assert queue.get('a') is job
+
+    queue.discard('a')
+    assert handler.released == ['a']
+    assert queue.get('a') is None
+
+
+def test_errors_are_recorded():
+    handler = Handler()
+    handler.go.set()
+    queue = JobQueue(handler, workers=1)
+    job = queue.submit('a', 'fail', 'video')
+    assert job.done.wait(5)
+    assert (job.status, job.error) == ('error', 'boom')
+
+
+def test_queue_limit():
+    handler = Handler()
+    queue = JobQueue(handler, workers=1, max_queued=2)
+    queue.submit('running', 'url', 'video')
+    while not handler.started:
+        pass
+    queue.submit('a', 'url', 'video')
+    queue.submit('b', 'url', 'video')
+    with pytest.raises(QueueFull) as e:
+        queue.submit('c', 'url', 'video')
+    assert 1 <= e.value.retry_after <= 300
+    assert queue.stats()['queued'] == 2 and queue.stats()['running'] == 1
+    handler.go.set()
+
+
+def test_submitting_a_running_task_id_returns_the_same_job():
+    handler = Handler()
+    queue = JobQueue(handler, workers=1)
+    job = queue.submit('a', 'url', 'video')
+    assert queue.submit('a', 'url', 'video') is job
+    handler.go.set()
+
+
+def test_cancelled_queued_job_never_runs():
+    handler = Handler()
+    queue = JobQueue(handler, workers=1)
+    first = queue.submit('first', 'url', 'video')
+    queued = queue.submit('queued', 'url', 'video')
+    queue.cancel('queued')
+    handler.go.set()
+    assert first.done.wait(5) and queued.done.wait(5)
+    assert queued.status == 'cancelled'
+    assert handler.started == ['first']
+
+
+def test_job_cancelled_while_finishing_releases_its_result():
+    running, go = threading.Event(), threading.Event()
+    released = []
+
+    def handler(job):
+        # Finishes without noticing it was cancelled
+        running.set()
+        go.wait(5)
+        return {'path': '', 'filename': '', 'mimetype': '', 'size': 0}, lambda: released.append(job.task_id)
+
+    queue = JobQueue(handler, workers=1)
+    job = queue.submit('a', 'url', 'video')
+    assert running.wait(5)
+    queue.cancel('a')
+    go.set()
+    assert job.done.wait(5)
+    assert job.status == 'cancelled'
+    assert released == ['a']
+
+
+def test_record_round_trip():
+    job = Job('a', 'url', 'audio', {'mode': 'compatible'})
+    job.status = 'complete'
+    job.started = job.finished = job.created
+    job.result = {'path': '/tmp/a.mp3', 'filename': 'a.mp3', 'mimetype': 'audio/mpeg', 'size': 3,
+                  'cache': 'MISS', 'processing': 'transcode', 'cleanup': print}
+
+    record = job.to_record()
+    assert 'cleanup' not in record['result']
+    copy = Job.from_record(record)
+    assert copy.remote and copy.done.is_set()
+    assert copy.to_dict() == job.to_dict()
+    assert copy.result['path'] == '/tmp/a.mp3'
+
+
+def test_jobs_without_a_worker():
+    handler = Handler()
+    finished = []
+    jobs = JobQueue(handler, workers=1, max_queued=0, on_finished=finished.append)
+    job = jobs.add('a', 'url', 'video', mode='fast')
+    assert job.status == 'running' and jobs.get('a') is job
+    assert jobs.add('a', 'url', 'video') is None
+    # Not queued, so a full queue doesn't matter
+    with pytest.raises(QueueFull):
+        jobs.submit('b', 'url', 'video')
+
+    released = []
+    jobs.finish(job, {'filename': 'a.mp4', 'size': 1}, lambda: released.append('a'))
+    jobs.finish(job, error='too late')
+    assert job.done.is_set() and (job.status, job.error) == ('complete', None)
+    assert finished == [job] and handler.started == []
+    jobs.discard('a')
+    assert released == ['a']
+
+
+def test_cancelled_job_without_a_worker():
+    jobs = JobQueue(Handler(), workers=1)
+    job = jobs.add('a', 'url', 'video')
+    job.cancel_event.set()
+    released = []
+    jobs.finish(job, {'filename': 'a.mp4', 'size': 1}, lambda: released.append('a'))
+    assert (job.status, released) == ('cancelled', ['a'])
+    other = jobs.add('b', 'url', 'video')
+    jobs.cancel('b')
+    jobs.finish(other, error='Download cancelled')
+    assert other.status == 'cancelled'
@@ -0,0 +1,38 @@
+import pytest
+from live_stream import plan_stream
+
+VIDEO = {'format_id': 'v', 'url': 'http://x/v.mp4', 'ext': 'mp4', 'protocol': 'https',
+         'vcodec': 'avc1.64001f', 'acodec': 'none'}
+AUDIO = {'format_id': 'a', 'url': 'http://x/a.m4a', 'ext': 'm4a', 'protocol': 'https',
+         'vcodec': 'none', 'acodec': 'mp4a.40.2'}
+MUXED = {'format_id': 'm', 'url': 'http://x/m.mp4', 'ext': 'mp4', 'protocol': 'https',
+         'vcodec': 'avc1.64001f', 'acodec': 'mp4a.40.2', 'filesize': 1234}
+
+
+def test_progressive_mp4_is_forwarded():
+    plan = plan_stream({**MUXED, 'title': 'T'}, 'video')
+    assert (plan['kind'], plan['ext'], plan['processing'], plan['size']) == ('direct', 'mp4', 'direct', 1234)
+    assert plan['format']['url'] == MUXED['url']
+
+
+def test_split_formats_are_merged_by_ffmpeg():
+    plan = plan_stream({'title': 'T', 'requested_formats': [VIDEO, AUDIO]}, 'video')
+    assert plan['kind'] == 'ffmpeg' and plan['ext'] == 'mp4'
+    cmd = plan['cmd']
+    assert cmd[cmd.index('-i') + 1] == VIDEO['url']
+    assert ['-map', '0:v:0', '-map', '1:a:0'] == cmd[cmd.index('-map'):cmd.index('-map') + 4]
+    assert cmd[-3:] == ['-f', 'mp4', 'pipe:1']
+    assert 'frag_keyframe+empty_moov+default_base_moof' in cmd
+
+
+def test_audio_for_an_audio_request():
+    plan = plan_stream(AUDIO, 'audio', 'fast')
+    assert plan['kind'] == 'direct' and plan['ext'] == 'm4a'
+
+
+@pytest.mark.parametrize('info', [
+    {'requested_formats': [VIDEO, {**AUDIO, 'protocol': 'http_dash_segments'}]},
+    {'formats': [VIDEO, AUDIO]},  # nothing selected yet
+])
+def test_unstreamable(info):
+    assert plan_stream(info, 'video') is None
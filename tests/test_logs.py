@@ -0,0 +1,69 @@
+import json
+import logging
+from logs import StructuredFormatter, YtDlpLogger, get_logger, log_context
+
+
+class Lines(logging.Handler):
+    """Keeps the formatted lines. Like the stdout handler it formats on emit, while the context is set."""
+
+    def __init__(self, json_lines=False):
+        super().__init__(logging.DEBUG)
+        self.setFormatter(StructuredFormatter(json_lines=json_lines))
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def capture(name, json_lines=False):
+    log = get_logger(name)
+    lines = Lines(json_lines)
+    log.logger.addHandler(lines)
+    log.logger.setLevel(logging.DEBUG)
+    return log, lines.lines
+
+
+def test_text_lines_carry_fields_and_context():
+    log, lines = capture('test.text')
+    with log_context(task_id='abc'):
+        log.info('✅ Done', size=123, title='two words', skipped=None)
+    log.info('plain')
+    first, second = lines
+    assert first.split(' ', 1)[1] == 'INFO    ✅ Done  task_id=abc size=123 title="two words"'
+    assert second.endswith('INFO    plain')
+
+
+def test_json_lines():
+    log, lines = capture('test.json', json_lines=True)
+    with log_context(task_id='abc'):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            log.exception('❌ Failed', url='http://x/?a=1')
+    data = json.loads(lines[0])
+    assert data['level'] == 'error'
+    assert data['logger'] == 'yt-dlp-web.test.json'
+    assert (data['msg'], data['task_id'], data['url']) == ('❌ Failed', 'abc', 'http://x/?a=1')
+    assert 'ValueError: boom' in data['exc']
+
+
+def test_nested_contexts():
+    log, lines = capture('test.nested', json_lines=True)
+    with log_context(task_id='outer', batch_id='b'):
+        with log_context(task_id='inner'):
+            log.info('a')
+        log.info('b')
+    log.info('c')
+    fields = [json.loads(line) for line in lines]
+    assert [(line.get('task_id'), line.get('batch_id')) for line in fields] == [('inner', 'b'), ('outer', 'b'), (None, None)]
+
+
+def test_yt_dlp_output_is_debug_level():
+    log, lines = capture('test.ytdlp')
+    logger = YtDlpLogger(log)
+    logger.debug('[debug] Invoking downloader')
+    logger.info('[download] 50%')
+    logger.warning('slow')
+    logger.error('broken')
+    assert [line.split(' ', 1)[1] for line in lines] == [
+        'DEBUG   Invoking downloader', 'DEBUG   [download] 50%', 'WARNING slow', 'ERROR   broken']
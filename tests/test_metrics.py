@@ -0,0 +1,98 @@
+import json
+import os
+import time
+import pytest
+from metrics import PhaseTimer, Registry
+
+
+def samples(text):
+    """{sample line without value: value} of a Prometheus text rendering"""
+    return {line.rsplit(' ', 1)[0]: line.rsplit(' ', 1)[1] for line in text.splitlines() if not line.startswith('#')}
+
+
+def test_render():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests', labels=('route',))
+    active = registry.gauge('active', 'Active')
+    sizes = registry.gauge('sizes', 'Sizes', labels=('kind',), collect=lambda: {('a"b',): 2.5})
+    durations = registry.histogram('duration_seconds', 'Durations', buckets=(1, 5))
+    requests.inc(route='/info')
+    requests.inc(2, route='/info')
+    active.inc()
+    active.inc()
+    active.dec()
+    durations.observe(0.5)
+    durations.observe(3)
+    durations.observe(10)
+
+    text = registry.render()
+    assert '# TYPE requests_total counter' in text
+    assert '# TYPE duration_seconds histogram' in text
+    assert samples(text) == {
+        'requests_total{route="/info"}': '3',
+        'active': '1',
+        'sizes{kind="a\\"b"}': '2.5',
+        'duration_seconds_bucket{le="1"}': '1',
+        'duration_seconds_bucket{le="5"}': '2',
+        'duration_seconds_bucket{le="+Inf"}': '3',
+        'duration_seconds_sum': '13.5',
+        'duration_seconds_count': '3',
+    }
+
+
+def test_failing_collector_renders_no_samples():
+    registry = Registry()
+    registry.gauge('broken', 'Broken', labels=('x',), collect=lambda: 1 / 0)
+    assert samples(registry.render()) == {}
+
+
+def make_registry(shared_dir):
+    registry = Registry(shared_dir=str(shared_dir), write_interval=3600)
+    registry.counter('jobs_total', 'Jobs').inc(2)
+    registry.gauge('running', 'Running').set(1)
+    registry.histogram('wait_seconds', 'Waits', buckets=(1,)).observe(0.5)
+    return registry
+
+
+@pytest.mark.parametrize('alive', [True, False])
+def test_workers_are_added_up(tmp_path, alive):
+    registry = make_registry(tmp_path)
+    # Another worker's snapshot, as its own registry would have written it
+    other = os.getppid() if alive else 2 ** 22 + 1
+    with open(tmp_path / f'{other}.json', 'w') as f:
+        json.dump({'snapshot': {'jobs_total': {'[]': 3}, 'running': {'[]': 4}, 'wait_seconds': {'[]': [[0], 2.0, 1]}},
+                   'written': time.time()}, f)
+
+    rendered = samples(registry.render())
+    assert rendered['jobs_total'] == '5'
+    assert rendered['wait_seconds_count'] == '2'
+    assert rendered['wait_seconds_bucket{le="1"}'] == '1'
+    # Gauges of workers that have exited are dropped, their counters stay
+    assert rendered['running'] == ('5' if alive else '1')
+    assert os.path.exists(tmp_path / f'{os.getpid()}.json')
+
+
+def test_phase_timer(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    registry = Registry()
+    phases = registry.histogram('phase_seconds', 'Phases', labels=('phase', 'outcome', 'kind'), buckets=(1, 10))
+    throughput = registry.histogram('throughput', 'Rates', labels=('phase',), buckets=(1000,))
+    transferred = registry.counter('bytes_total', 'Bytes', labels=('phase',))
+
+    timer = PhaseTimer(phases, throughput, transferred, kind='video')
+    timer.enter('extract')
+    now[0] += 0.5
+    timer.enter('download', bytes=4000)
+    now[0] += 2
+    with pytest.raises(RuntimeError):
+        with timer:
+            raise RuntimeError
+    assert timer.end() is None
+
+    rendered = samples(registry.render())
+    assert rendered['phase_seconds_count{phase="extract",outcome="ok",kind="video"}'] == '1'
+    assert rendered['phase_seconds_count{phase="download",outcome="error",kind="video"}'] == '1'
+    assert rendered['phase_seconds_bucket{phase="download",outcome="error",kind="video",le="1"}'] == '0'
+    assert rendered['throughput_sum{phase="download"}'] == '2000.0'
+    assert rendered['bytes_total{phase="download"}'] == '4000'
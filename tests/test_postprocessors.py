@@ -0,0 +1,78 @@
+import shutil
+import subprocess
+import pytest
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+from admission import Slots
+from postprocessors import ProcessingPP
+
+
+def ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-y', '-v', 'error', *args], check=True)
+
+
+@pytest.fixture(scope='module')
+def sources(tmp_path_factory):
+    """A second of H.264/AAC in MKV and MP4, and of Opus audio in WebM"""
+    root = tmp_path_factory.mktemp('sources')
+    ffmpeg('-f', 'lavfi', '-i', 'testsrc2=size=160x90:rate=10', '-f', 'lavfi', '-i', 'sine', '-t', '1',
+           '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p', '-c:a', 'aac', str(root / 'h264.mkv'))
+    ffmpeg('-i', str(root / 'h264.mkv'), '-c', 'copy', str(root / 'h264.mp4'))
+    ffmpeg('-f', 'lavfi', '-i', 'sine', '-t', '1', '-c:a', 'libopus', str(root / 'opus.webm'))
+    return root
+
+
+def run(sources, tmp_path, name, download_type, mode, **kwargs):
+    path = tmp_path / name
+    shutil.copy(sources / name, path)
+    pp = ProcessingPP(YoutubeDL({'quiet': True}), download_type, mode, **kwargs)
+    files_to_delete, info = pp.run({'filepath': str(path), 'ext': path.suffix[1:]})
+    return pp, files_to_delete, info
+
+
+def test_remux_into_mp4(sources, tmp_path):
+    started = []
+    pp, files_to_delete, info = run(sources, tmp_path, 'h264.mkv', 'video', 'compatible', on_start=started.append)
+    assert (pp.path, info['ext'], started) == ('remux', 'mp4', ['remux'])
+    assert pp.filepath == info['filepath'] == str(tmp_path / 'h264.mp4')
+    assert files_to_delete == [str(tmp_path / 'h264.mkv')]
+
+
+def test_fast_audio_keeps_opus(sources, tmp_path):
+    pp, _, info = run(sources, tmp_path, 'opus.webm', 'audio', 'fast')
+    assert (pp.path, info['ext']) == ('remux', 'opus')
+
+
+def test_transcode_takes_an_encoder_slot(sources, tmp_path):
+    class Slots:
+        taken = []
+
+        def acquire(self, on_wait=None, cancelled=None):
+            self.taken.append('acquire')
+            return 'slot'
+
+        def release(self, slot):
+            self.taken.append(slot)
+
+    slots = Slots()
+    pp, _, info = run(sources, tmp_path, 'opus.webm', 'audio', 'compatible', transcodes=slots)
+    assert (pp.path, info['ext']) == ('transcode', 'mp3')
+    assert slots.taken == ['acquire', 'slot']
+
+
+def test_cancel_while_waiting_for_an_encoder(sources, tmp_path):
+    slots = Slots(str(tmp_path / 'slots'), 'transcode', 1)
+    held = slots.try_acquire()
+    waited = []
+    with pytest.raises(DownloadCancelled):
+        run(sources, tmp_path, 'opus.webm', 'audio', 'compatible', transcodes=slots,
+            on_wait=lambda: waited.append(True), cancelled=lambda: bool(waited))
+    assert waited == [True]
+    assert not (tmp_path / 'opus.mp3').exists()
+    slots.release(held)
+    assert slots.stats()['held_here'] == 0
+
+
+def test_direct_leaves_the_file_alone(sources, tmp_path):
+    pp, files_to_delete, info = run(sources, tmp_path, 'h264.mp4', 'video', 'compatible')
+    assert (pp.path, files_to_delete, info['filepath']) == ('direct', [], str(tmp_path / 'h264.mp4'))
@@ -0,0 +1,71 @@
+import pytest
+from processing import codec_family, format_selector, format_sort, normalize_mode, plan_output
+
+
+@pytest.mark.parametrize('codec, family', [
+    ('avc1.64001F', 'h264'), ('h264', 'h264'), ('hev1.1.6.L93.B0', 'hevc'),
+    ('av01.0.08M.08', 'av1'), ('vp09.00.40.08', 'vp9'), ('vp9', 'vp9'),
+    ('mp4a.40.2', 'aac'), ('opus', 'opus'), ('ec-3', 'eac3'),
+    ('none', 'none'), (None, None), ('', None), ('theora', 'theora'),
+])
+def test_codec_family(codec, family):
+    assert codec_family(codec) == family
+
+
+def test_normalize_mode():
+    assert normalize_mode('FAST') == 'fast'
+    assert normalize_mode('bogus') == 'compatible'
+    assert normalize_mode(None, 'fast') == 'fast'
+
+
+def test_format_selector_prefers_copyable_formats():
+    assert format_selector('audio', 'fast').startswith('bestaudio[acodec^=mp4a]')
+    assert format_selector('video', 'fast').endswith('/bestvideo*+bestaudio/best')
+
+
+@pytest.mark.parametrize('heights, chosen', [
+    ((1080, 2160), '2160-vp9+aac'),  # no H.264 at 4K, so no 1080p cap
+    ((1080,), '1080-avc1+aac'),      # same resolution: the copyable one
+])
+def test_compatible_formats_keep_the_best_resolution(heights, chosen):
+    import yt_dlp
+    formats = [{'format_id': 'aac', 'url': 'http://x/aac', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'tbr': 128},
+               {'format_id': 'opus', 'url': 'http://x/opus', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'tbr': 160}]
+    for height in heights:
+        for vcodec, ext, tbr in (('avc1.640028', 'mp4', 4000), ('vp9', 'webm', 3000)):
+            if vcodec.startswith('avc1') and height > 1080:
+                continue
+            formats.append({'format_id': f'{height}-{vcodec[:4]}', 'url': 'http://x/v', 'ext': ext,
+                            'vcodec': vcodec, 'acodec': 'none', 'height': height, 'width': height * 16 // 9,
+                            'tbr': tbr * height // 1080})
+    ydl = yt_dlp.YoutubeDL({'format': format_selector('video', 'compatible'),
+                            'format_sort': format_sort('video', 'compatible'), 'quiet': True})
+    info = ydl.process_ie_result({'id': 'x', 'title': 'x', 'extractor': 'generic', 'extractor_key': 'Generic',
+                                  'webpage_url': 'http://x', 'formats': formats}, download=False)
+    assert info['format_id'] == chosen
+
+
+@pytest.mark.parametrize('download_type, mode, vcodec, acodec, ext, path, target', [
+    # Compatible mode: H.264/AAC MP4 and MP3
+    ('video', 'compatible', 'avc1', 'mp4a.40.2', 'mp4', 'direct', 'mp4'),
+    ('video', 'compatible', 'h264', 'aac', 'mkv', 'remux', 'mp4'),
+    ('video', 'compatible', 'vp9', 'opus', 'webm', 'transcode', 'mp4'),
+    ('video', 'compatible', 'avc1', 'opus', 'webm', 'transcode', 'mp4'),
+    ('audio', 'compatible', 'none', 'opus', 'webm', 'transcode', 'mp3'),
+    ('audio', 'compatible', 'none', 'mp3', 'mp3', 'direct', 'mp3'),
+    # Fast mode: copy streams into whatever holds them
+    ('video', 'fast', 'vp9', 'opus', 'webm', 'remux', 'mp4'),
+    ('video', 'fast', 'vp8', 'vorbis', 'webm', 'direct', 'webm'),
+    ('video', 'fast', 'vp8', 'vorbis', 'flv', 'remux', 'mkv'),
+    ('audio', 'fast', 'none', 'mp4a.40.2', 'm4a', 'direct', 'm4a'),
+    ('audio', 'fast', 'none', 'opus', 'webm', 'remux', 'opus'),
+])
+def test_plan_output(download_type, mode, vcodec, acodec, ext, path, target):
+    assert plan_output(download_type, mode, vcodec, acodec, ext)[:2] == (path, target)
+
+
+def test_plan_output_only_reencodes_what_it_must():
+    _, _, args = plan_output('video', 'compatible', 'avc1', 'opus', 'webm')
+    assert args == ['-c:v', 'copy', '-c:a', 'aac', '-b:a', '192k']
+    _, _, args = plan_output('audio', 'fast', 'none', 'opus', 'webm')
+    assert args == ['-vn', '-c:a', 'copy']
@@ -0,0 +1,56 @@
+import threading
+import time
+from progress import ProgressStore
+
+
+def test_updates_bump_the_version():
+    store = ProgressStore(min_interval=0)
+    store.set('t', 'downloading', 'Downloading...', 10, speed='1MiB/s')
+    store.set('t', 'downloading', 'Downloading...', 20)
+    assert store.get('t') == {'status': 'downloading', 'message': 'Downloading...', 'progress': 20}
+    assert store.wait('t', 0, timeout=0)[0] == 2
+    assert store.get('unknown') == {}
+
+
+def test_repeated_status_is_throttled():
+    store = ProgressStore(min_interval=60)
+    assert store.set('t', 'downloading', '', 10)
+    assert not store.set('t', 'downloading', '', 11)
+    # A new status, a forced update or a final one always go through
+    assert store.set('t', 'processing', '', 90)
+    assert store.set('t', 'processing', '', 91, force=True)
+    assert store.set('t', 'complete', '', 100)
+    assert store.get('t')['status'] == 'complete'
+
+
+def test_wait_returns_when_the_state_changes():
+    store = ProgressStore(min_interval=0)
+    store.set('t', 'queued', '', 0)
+    version = store.wait('t', 0, timeout=0)[0]
+
+    timer = threading.Timer(0.1, store.set, ('t', 'downloading', '', 50))
+    timer.start()
+    started = time.monotonic()
+    version, state = store.wait('t', version, timeout=5)
+    assert time.monotonic() - started < 2
+    assert (version, state['progress']) == (2, 50)
+
+
+def test_wait_times_out():
+    store = ProgressStore()
+    store.set('t', 'queued', '', 0)
+    assert store.wait('t', 1, timeout=0.05) is None
+
+
+def test_version_from_the_future_starts_over():
+    # e.g. Last-Event-ID from before a restart
+    store = ProgressStore()
+    store.set('t', 'queued', '', 0)
+    assert store.wait('t', 99, timeout=0) == (1, {'status': 'queued', 'message': '', 'progress': 0})
+
+
+def test_copy():
+    store = ProgressStore()
+    store.set('a', 'downloading', 'Downloading...', 42)
+    store.copy('a', 'b')
+    assert store.get('b') == store.get('a')
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+import pytest
+from yt_dlp import YoutubeDL
+from yt_dlp.utils import DownloadCancelled
+from range_download import ConnectionLimiter, ParallelYoutubeDL, ProgressTally, RangeFD
+
+SIZE_LABEL = '5M'
+
+
+@pytest.fixture(scope='module')
+def source(media_server):
+    """URL and local path of a progressive file big enough to split into ranges"""
+    media_server.library.get(SIZE_LABEL)
+    return (f'{media_server.base_url}/media/{SIZE_LABEL}/progressive.mp4',
+            media_server.library.path(SIZE_LABEL, 'progressive.mp4'))
+
+
+def fetch(url, path, connections=4, **params):
+    """Download url to path with RangeFD, returning the progress reports"""
+    reports = []
+    ydl = YoutubeDL({'quiet': True, 'noprogress': True, 'http_chunk_size': 1024 * 1024, **params})
+    fd = RangeFD(ydl, {**ydl.params, 'range_connections': connections})
+    fd.add_progress_hook(reports.append)
+    assert fd.download(str(path), {'id': 'x', 'url': url, 'ext': 'mp4', 'http_headers': {}})
+    return reports
+
+
+def settled_bytes_sent(media_server):
+    """Bytes the media server has sent, once responses still going out have finished"""
+    sent = None
+    while sent != media_server.bytes_sent:
+        sent = media_server.bytes_sent
+        time.sleep(0.2)
+    return sent
+
+
+def test_connection_limiter_shares_what_is_free(tmp_path):
+    # Two instances on one directory stand in for two workers
+    first = ConnectionLimiter(str(tmp_path), 4)
+    second = ConnectionLimiter(str(tmp_path), 4)
+    three = first.acquire(3)
+    assert len(three) == 3
+    # Only one left: take it rather than wait for three
+    one = second.acquire(3)
+    assert len(one) == 1
+
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(second.acquire(2)))
+    waiter.start()
+    waiter.join(0.1)
+    assert granted == []
+    first.release(three)
+    waiter.join(5)
+    assert len(granted[0]) == 2
+    assert first.stats() == {'max_connections': 4, 'held_here': 0}
+    assert second.stats() == {'max_connections': 4, 'held_here': 3}
+
+
+def test_waiting_for_a_connection_stops_when_cancelled(tmp_path):
+    limiter = ConnectionLimiter(str(tmp_path), 1)
+    held = limiter.acquire(1)
+    cancelled = threading.Event()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(limiter.acquire(1, cancelled=cancelled.is_set)))
+    waiter.start()
+    cancelled.set()
+    waiter.join(5)
+    assert result == [None]
+
+    ydl = ParallelYoutubeDL({'quiet': True, 'outtmpl': str(tmp_path / '%(id)s.%(ext)s')},
+                            limiter=limiter, cancelled=lambda: True)
+    with pytest.raises(DownloadCancelled):
+        ydl.dl(str(tmp_path / 'x.mp4'), {'id': 'x', 'url': 'http://127.0.0.1:9/x', 'ext': 'mp4'})
+    limiter.release(held)
+    assert limiter.stats()['held_here'] == 0
+
+
+def test_parallel_ranges_rebuild_the_file(source, tmp_path, monkeypatch):
+    url, original = source
+    split = []
+    download_pieces = RangeFD._download_pieces
+
+    def record(self, fd, filename, info_dict, pieces, size, connections, resumed=0):
+        split.append((len(pieces), connections))
+        return download_pieces(self, fd, filename, info_dict, pieces, size, connections, resumed)
+
+    monkeypatch.setattr(RangeFD, '_download_pieces', record)
+    out = tmp_path / 'out.mp4'
+    reports = fetch(url, out)
+    assert out.read_bytes() == open(original, 'rb').read()
+    assert split and split[0][0] >= 4 and split[0][1] == 4
+    assert reports[-1]['status'] == 'finished'
+    assert not (tmp_path / 'out.mp4.part.ranges').exists()
+
+
+def test_interrupted_download_resumes_the_missing_ranges(source, media_server, tmp_path, monkeypatch):
+    url, original = source
+    size = os.path.getsize(original)
+    out = tmp_path / 'out.mp4'
+    pwrite = os.pwrite
+    writes = []
+    lock = threading.Lock()
+
+    def failing_pwrite(fd, data, offset):
+        with lock:
+            writes.append(len(data))
+            if len(writes) > 20:
+                raise OSError('disk went away')
+        return pwrite(fd, data, offset)
+
+    monkeypatch.setattr(os, 'pwrite', failing_pwrite)
+    with pytest.raises(OSError):
+        fetch(url, out, retries=0)
+    monkeypatch.setattr(os, 'pwrite', pwrite)
+    with open(tmp_path / 'out.mp4.part.ranges') as f:
+        state = json.load(f)
+    missing = sum(end - start + 1 for start, end in state['remaining'])
+    assert state['size'] == size and 0 < missing < size
+
+    sent = settled_bytes_sent(media_server)
+    fetch(url, out)
+    assert out.read_bytes() == open(original, 'rb').read()
+    # Only the missing ranges are fetched again, plus the byte probing the size
+    assert media_server.bytes_sent - sent == missing + 1
+    assert not (tmp_path / 'out.mp4.part.ranges').exists()
+
+
+def test_partial_file_for_another_size_starts_over(source, tmp_path):
+    url, original = source
+    out = tmp_path / 'out.mp4'
+    (tmp_path / 'out.mp4.part').write_bytes(b'stale')
+    (tmp_path / 'out.mp4.part.ranges').write_text(json.dumps({'size': 5, 'remaining': []}))
+    fetch(url, out)
+    assert out.read_bytes() == open(original, 'rb').read()
+
+
+def test_single_connection_uses_plain_http(source, tmp_path):
+    url, original = source
+    out = tmp_path / 'out.mp4'
+    fetch(url, out, connections=1)
+    assert out.read_bytes() == open(original, 'rb').read()
+
+
+def test_parallel_youtubedl_takes_connections_from_the_limiter(source, tmp_path):
+    url, original = source
+    limiter = ConnectionLimiter(str(tmp_path / 'slots'), 2)
+    ydl = ParallelYoutubeDL({'quiet': True, 'noprogress': True, 'http_chunk_size': 1024 * 1024,
+                             'outtmpl': str(tmp_path / '%(id)s.%(ext)s')},
+                            limiter=limiter, connections=8)
+    seen = []
+    ydl.add_progress_hook(lambda d: seen.append(limiter.stats()['held_here']))
+    ydl.process_ie_result({'id': 'x', 'title': 'x', 'url': url, 'ext': 'mp4', 'extractor': 'test',
+                           'extractor_key': 'Test', 'webpage_url': url}, download=True)
+    assert (tmp_path / 'x.mp4').read_bytes() == open(original, 'rb').read()
+    assert max(seen) == 2
+    assert limiter.stats()['held_here'] == 0
+
+
+def test_progress_tally_combines_parts():
+    tally = ProgressTally()
+    tally.expect({'requested_formats': [{'format_id': 'v', 'filesize': 300}, {'format_id': 'a', 'filesize': 100}]})
+    assert tally.update({'status': 'downloading', 'downloaded_bytes': 150, 'info_dict': {'format_id': 'v'}}) == 150 / 400
+    assert tally.update({'status': 'finished', 'info_dict': {'format_id': 'v'}}) == 300 / 400
+    # Fragmented downloads only say how many fragments are done
+    assert tally.update({'status': 'downloading', 'fragment_index': 1, 'fragment_count': 2,
+                         'info_dict': {'format_id': 'a'}}) == 350 / 400
+    assert tally.downloaded() == 350
+
+
+def test_progress_tally_unknown_sizes():
+    tally = ProgressTally()
+    tally.expect({'format_id': 'v'})
+    assert tally.update({'status': 'downloading', 'downloaded_bytes': 10, 'info_dict': {'format_id': 'v'}}) is None
+    assert tally.update({'status': 'downloading', 'downloaded_bytes': 10, 'total_bytes': 40,
+                         'info_dict': {'format_id': 'v'}}) == 0.25
@@ -0,0 +1,53 @@
+import time
+import pytest
+import rate_limit
+from rate_limit import RateLimiter, UpstreamBusy, upstream_host
+from state_backend import MemoryBackend
+
+
+def test_upstream_host():
+    assert upstream_host('https://www.youtube.com/watch?v=x') == 'youtube.com'
+    assert upstream_host('https://youtu.be/x') == 'youtube.com'
+    assert upstream_host('https://m.Example.org/a') == 'example.org'
+    assert upstream_host('not a url') == ''
+
+
+def test_try_acquire_never_waits():
+    limiter = RateLimiter(MemoryBackend(), rate=0.5, burst=2, jitter=0)
+    limiter.try_acquire('a')
+    limiter.try_acquire('a')
+    with pytest.raises(UpstreamBusy) as e:
+        limiter.try_acquire('a')
+    assert (e.value.host, e.value.retry_after) == ('a', 2)
+    # A refused request books nothing, so the next one is told the same
+    with pytest.raises(UpstreamBusy) as e:
+        limiter.try_acquire('a')
+    assert e.value.retry_after == 2
+    limiter.try_acquire('b')
+    RateLimiter(MemoryBackend(), rate=0).try_acquire('a')
+
+
+def test_acquire_waits_its_turn(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    monkeypatch.setattr(rate_limit.time, 'sleep', lambda seconds: now.__setitem__(0, now[0] + seconds))
+    limiter = RateLimiter(MemoryBackend(), rate=1, burst=1, jitter=0)
+    assert limiter.acquire('a') == 0.0
+    waits = []
+    assert limiter.acquire('a', on_wait=waits.append) == 1.0
+    assert waits == [1.0]
+    assert limiter.acquire('a', cancelled=lambda: True) is None
+
+
+def test_penalize_slows_down_and_recovers(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    limiter = RateLimiter(MemoryBackend(), rate=1, burst=1, jitter=0, max_slowdown=4, recovery=60)
+    assert [limiter.penalize('a') for _ in range(3)] == [2, 4, 4]
+    assert limiter.slowdown('b') == 1.0
+    limiter.try_acquire('a')
+    with pytest.raises(UpstreamBusy) as e:
+        limiter.try_acquire('a')
+    assert e.value.retry_after == 4
+    now[0] += 60
+    assert limiter.slowdown('a') == pytest.approx(2)
@@ -0,0 +1,140 @@
+import json
+import os
+import pytest
+from result_cache import ResultCache, cache_key, canonical_video_id
+
+
+def make_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b'x' * size)
+    return str(path)
+
+
+@pytest.mark.parametrize('url, expected', [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://youtube.com/watch?v=dQw4w9WgXcQ&t=42&list=PL123', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://youtu.be/dQw4w9WgXcQ?si=abc', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', ('youtube', 'dQw4w9WgXcQ')),
+    ('https://www.youtube.com/watch?v=short', None),
+    ('https://www.youtube.com/playlist?list=PL123', None),
+    ('https://vimeo.com/123456', None),
+    ('not a url', None),
+])
+def test_canonical_video_id(url, expected):
+    assert canonical_video_id(url) == expected
+
+
+def test_cache_key_depends_on_type_and_settings():
+    base = cache_key('youtube', 'dQw4w9WgXcQ', 'video', {'mode': 'fast'})
+    assert base == cache_key('YouTube', 'dQw4w9WgXcQ', 'video', {'mode': 'fast'})
+    assert base != cache_key('youtube', 'dQw4w9WgXcQ', 'audio', {'mode': 'fast'})
+    assert base != cache_key('youtube', 'dQw4w9WgXcQ', 'video', {'mode': 'compatible'})
+
+
+def test_publish_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    src = make_file(tmp_path, 'a.mp4', 100)
+
+    entry = cache.publish('a', src, 'a.mp4', 'video/mp4', extra={'title': 'A'})
+    assert not os.path.exists(src)
+    assert entry['filename'] == 'a.mp4' and entry['size'] == 100 and entry['title'] == 'A'
+
+    found = cache.get('a')
+    assert found['path'] == entry['path']
+    assert open(found['path'], 'rb').read() == b'x' * 100
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['bytes']) == (1, 1, 1, 100)
+
+
+def test_lru_eviction(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 250)
+    for key in 'abc':
+        if key == 'c':
+            # Touch a so b is the least recently used
+            assert cache.get('a')
+        cache.publish(key, make_file(tmp_path, key, 100), key, 'video/mp4')
+
+    assert cache.get('b') is None
+    assert cache.get('a') and cache.get('c')
+    assert not os.path.exists(os.path.join(cache.root, 'b.data'))
+    assert cache.stats()['evictions'] == 1
+
+
+def test_too_large_is_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 50)
+    src = make_file(tmp_path, 'big', 100)
+    assert cache.publish('big', src, 'big.mp4', 'video/mp4') is None
+    assert os.path.exists(src)
+
+
+def test_disabled(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 0)
+    assert not cache.enabled
+    assert cache.publish('a', make_file(tmp_path, 'a', 10), 'a.mp4', 'video/mp4') is None
+    assert cache.get('a') is None
+
+
+def test_rebuild_restores_entries_and_drops_broken_ones(tmp_path):
+    root = str(tmp_path / 'cache')
+    cache = ResultCache(root, 1000)
+    cache.publish('good', make_file(tmp_path, 'good', 100), 'good.mp4', 'video/mp4')
+    cache.publish('short', make_file(tmp_path, 'short', 100), 'short.mp4', 'video/mp4')
+    # A data file that lost bytes, and metadata whose data never arrived
+    with open(os.path.join(root, 'short.data'), 'wb') as f:
+        f.write(b'x' * 10)
+    with open(os.path.join(root, 'nodata.json'), 'w') as f:
+        json.dump({'filename': 'n.mp4', 'mimetype': 'video/mp4', 'size': 5}, f)
+
+    rebuilt = ResultCache(root, 1000)
+    assert rebuilt.get('good')['filename'] == 'good.mp4'
+    assert rebuilt.get('short') is None
+    assert rebuilt.get('nodata') is None
+    assert sorted(os.listdir(root)) == ['good.data', 'good.json', 'tmp']
+
+
+def test_entry_published_by_another_process(tmp_path):
+    root = str(tmp_path / 'cache')
+    first = ResultCache(root, 1000)
+    second = ResultCache(root, 1000)
+    first.publish('a', make_file(tmp_path, 'a', 100), 'a.mp4', 'video/mp4')
+    assert second.get('a')['size'] == 100
+
+
+def test_missing_data_file_is_a_miss(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 1000)
+    entry = cache.publish('a', make_file(tmp_path, 'a', 100), 'a.mp4', 'video/mp4')
+    os.remove(entry['path'])
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 0
+
+
+def test_pinned_entries_are_not_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), 250)
+    cache.publish('a', make_file(tmp_path, 'a', 100), 'a.mp4', 'video/mp4', pin=True)
+    assert cache.get('a', pin=True)
+    cache.publish('b', make_file(tmp_path, 'b', 100), 'b.mp4', 'video/mp4')
+    cache.publish('c', make_file(tmp_path, 'c', 100), 'c.mp4', 'video/mp4')
+
+    # a is the least recently used but pinned, so b goes instead
+    assert cache.get('b') is None
+    assert cache.stats()['pinned'] == 1
+
+    # A new entry is never evicted by its own publish, even over budget
+    cache.publish('d', make_file(tmp_path, 'd', 200), 'd.mp4', 'video/mp4')
+    assert os.path.exists(os.path.join(cache.root, 'a.data'))
+    assert cache.get('d') and cache.get('c') is None
+    assert cache.stats()['bytes'] > cache.max_bytes
+
+    # Still one holder left after the first unpin, which brings the cache back within budget
+    cache.unpin('a')
+    assert cache.get('d') is None
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    cache.unpin('a')
+    assert cache.stats()['pinned'] == 0
+
+    # Unpinned, a is evicted like any other entry
+    cache.publish('e', make_file(tmp_path, 'e', 200), 'e.mp4', 'video/mp4')
+    assert not os.path.exists(os.path.join(cache.root, 'a.data'))
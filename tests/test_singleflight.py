@@ -0,0 +1,116 @@
+import threading
+from singleflight import SingleFlight
+
+
+def test_first_task_leads_and_others_follow():
+    flights = SingleFlight()
+    leader, is_leader = flights.join('k', 'a')
+    follower, follows = flights.join('k', 'b')
+    assert is_leader and not follows
+    assert follower is leader
+    assert flights.in_flight() == {'k': 2}
+
+    flights.finish(leader, result='done')
+    assert leader.wait(0) and leader.result == 'done'
+    assert flights.in_flight() == {}
+
+    # Later requests start a new flight
+    fresh, is_leader = flights.join('k', 'c')
+    assert is_leader and fresh is not leader
+
+
+def test_followers_wait_for_the_result():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    results = []
+
+    def follower(task_id):
+        joined, is_leader = flights.join('k', task_id)
+        assert not is_leader
+        joined.wait(5)
+        results.append(joined.result)
+
+    threads = [threading.Thread(target=follower, args=(f't{i}',)) for i in range(4)]
+    for t in threads:
+        t.start()
+    while flights.in_flight()['k'] < 5:
+        pass
+    flights.finish(flight, result=42)
+    for t in threads:
+        t.join(5)
+    assert results == [42] * 4
+
+
+def test_cleanup_runs_after_the_last_release():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    flights.join('k', 'b')
+    released = []
+    flights.finish(flight, result='file', on_release=lambda: released.append(True))
+
+    flight.release()
+    assert released == []
+    flight.release()
+    assert released == [True]
+    flight.release()
+    assert released == [True]
+
+
+def test_leaving_before_the_result():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    flights.join('k', 'b')
+    assert flights.leave(flight, 'b')
+    assert not flight.cancelled
+    assert flights.leave(flight, 'a')
+    assert flight.cancelled
+
+    # Nobody is waiting, so the next request starts over
+    fresh, is_leader = flights.join('k', 'c')
+    assert is_leader and fresh is not flight
+
+
+def test_leaving_after_the_result_keeps_the_reference():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    released = []
+    flights.finish(flight, result='file', on_release=lambda: released.append(True))
+    assert not flights.leave(flight, 'a')
+    assert released == []
+    flight.release()
+    assert released == [True]
+
+
+def test_errors_are_shared():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    flights.join('k', 'b')
+    error = RuntimeError('boom')
+    flights.finish(flight, error=error)
+    assert flight.error is error and flight.result is None
+
+
+def test_cleanup_runs_when_everyone_left_before_the_result():
+    flights = SingleFlight()
+    flight, _ = flights.join('k', 'a')
+    flights.join('k', 'b')
+    flights.leave(flight, 'a')
+    flights.leave(flight, 'b')
+    released = []
+    flights.finish(flight, result='file', on_release=lambda: released.append(True))
+    assert released == [True]
+    assert flight.wait(0)
+
+
+def test_following_a_flight():
+    flights = SingleFlight()
+    assert flights.follow('k', 'a') is None
+    flight, _ = flights.join('k', 'a')
+    assert flights.follow('k', 'b') is flight
+    outcomes = []
+    flight.add_done_callback(lambda f: outcomes.append(('early', f.result)))
+    flights.finish(flight, result='done')
+    flight.add_done_callback(lambda f: outcomes.append(('late', f.result)))
+    assert outcomes == [('early', 'done'), ('late', 'done')]
+    # A finished flight takes no more followers
+    assert flights.follow('k', 'c') is None
@@ -0,0 +1,156 @@
+import sqlite3
+import threading
+import time
+import pytest
+from state_backend import MemoryBackend, RedisBackend, SQLiteBackend, create_backend
+
+
+@pytest.fixture(scope='module')
+def redis_server():
+    """A local stand-in for Redis that also runs Lua scripts"""
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('lupa')
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def make_backend(request, tmp_path):
+    """Factory for backends of one kind; the shared kinds all see the same state"""
+    if request.param == 'memory':
+        backend = MemoryBackend()
+        yield lambda: backend
+    elif request.param == 'sqlite':
+        path = str(tmp_path / 'state.db')
+        yield lambda: SQLiteBackend(path, poll_interval=0.05)
+    else:
+        host, port = request.getfixturevalue('redis_server')
+        RedisBackend(host, port)._command('FLUSHDB')
+        yield lambda: RedisBackend(host, port)
+
+
+@pytest.fixture
+def backend(make_backend):
+    return make_backend()
+
+
+def test_publish_and_read(backend):
+    assert backend.read('t') is None
+    assert backend.publish('t', {'progress': 1}, 60) == 1
+    assert backend.publish('t', {'progress': 2}, 60) == 2
+    assert backend.read('t') == (2, {'progress': 2})
+
+
+def test_progress_expires(backend):
+    backend.publish('t', {'progress': 1}, 1)
+    time.sleep(1.1)
+    assert backend.read('t') is None
+
+
+def test_wait(backend):
+    backend.publish('t', {'progress': 1}, 60)
+    assert backend.wait('t', 0, timeout=0) == (1, {'progress': 1})
+    started = time.monotonic()
+    assert backend.wait('t', 1, timeout=0.2) is None
+    assert time.monotonic() - started >= 0.2
+
+
+def test_wait_wakes_on_publish(make_backend):
+    waiting, writing = make_backend(), make_backend()
+    waiting.publish('t', {'progress': 1}, 60)
+    threading.Timer(0.2, writing.publish, ('t', {'progress': 2}, 60)).start()
+    started = time.monotonic()
+    assert waiting.wait('t', 1, timeout=5) == (2, {'progress': 2})
+    assert time.monotonic() - started < 1
+
+
+def test_updates_only_wake_their_own_task(make_backend):
+    waiting, writing = make_backend(), make_backend()
+    reads = []
+    read = waiting.read
+    waiting.read = lambda task_id: reads.append(task_id) or read(task_id)
+
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: (waiting.wait('a', 0, timeout=5), done.set()))
+    thread.start()
+    time.sleep(0.1)
+    for i in range(20):
+        writing.publish('b', {'progress': i}, 60)
+        time.sleep(0.01)
+    time.sleep(0.2)
+    assert not done.is_set()
+    # The first read, and at most one more when a poller first sees the task
+    assert reads.count('a') <= 2
+
+    writing.publish('a', {'progress': 1}, 60)
+    assert done.wait(5)
+    thread.join()
+
+
+def test_records(backend):
+    assert backend.get('job', 'x') is None
+    backend.put('job', 'x', {'status': 'queued'}, 60)
+    assert backend.get('job', 'x') == {'status': 'queued'}
+    backend.delete('job', 'x')
+    assert backend.get('job', 'x') is None
+
+    backend.put('cancel', 'y', True, 1)
+    time.sleep(1.1)
+    assert backend.get('cancel', 'y') is None
+
+
+def test_claim_is_granted_once(make_backend):
+    first, second = make_backend(), make_backend()
+    assert first.claim('zip', 'b', 60)
+    assert not second.claim('zip', 'b', 60)
+    assert not first.claim('zip', 'b', 60)
+
+
+def test_reserve_slot(make_backend):
+    first, second = make_backend(), make_backend()
+    now = time.time()
+    # Two turns may go at once, then they are a second apart
+    starts = [backend.reserve_slot('rate', 'host', 1.0, 1.0, 60) for backend in (first, second, first, second)]
+    assert starts[0] == pytest.approx(now, abs=0.1)
+    assert starts[1] == pytest.approx(now, abs=0.1)
+    assert starts[2] == pytest.approx(now + 1, abs=0.1)
+    assert starts[3] == pytest.approx(now + 2, abs=0.1)
+
+
+def test_reserve_slot_only_books_within_max_delay(make_backend):
+    first, second = make_backend(), make_backend()
+    now = time.time()
+    assert first.reserve_slot('rate', 'host', 1.0, 0.0, 60, max_delay=0) == pytest.approx(now, abs=0.1)
+    # Not booked, so asking again gives the same turn
+    for backend in (second, first):
+        assert backend.reserve_slot('rate', 'host', 1.0, 0.0, 60, max_delay=0) == pytest.approx(now + 1, abs=0.1)
+    assert second.reserve_slot('rate', 'host', 1.0, 0.0, 60, max_delay=2) == pytest.approx(now + 1, abs=0.1)
+    assert first.reserve_slot('rate', 'host', 1.0, 0.0, 60) == pytest.approx(now + 2, abs=0.1)
+
+
+def test_sqlite_reads_do_not_wait_for_writers(tmp_path):
+    path = str(tmp_path / 'state.db')
+    backend = SQLiteBackend(path)
+    backend.publish('t', {'progress': 1}, 60)
+    backend.put('job', 'x', 1, 60)
+
+    writer = sqlite3.connect(path, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        started = time.monotonic()
+        assert backend.read('t') == (1, {'progress': 1})
+        assert backend.get('job', 'x') == 1
+        assert time.monotonic() - started < 1
+    finally:
+        writer.execute('ROLLBACK')
+
+
+def test_create_backend(tmp_path):
+    assert type(create_backend(None)) is MemoryBackend
+    assert isinstance(create_backend(f'sqlite:///{tmp_path}/state.db'), SQLiteBackend)
+    with pytest.raises(ValueError):
+        create_backend('postgres://db')
@@ -0,0 +1,65 @@
+import time
+import pytest
+from strategy_scheduler import StrategyScheduler, classify_error
+
+STRATEGIES = [{'name': 'a'}, {'name': 'b'}, {'name': 'c'}]
+
+
+def names(scheduler):
+    return [s['name'] for s in scheduler.order()]
+
+
+@pytest.mark.parametrize('message, expected', [
+    ('HTTP Error 403: Forbidden', 'forbidden'),
+    ('HTTP Error 429: Too Many Requests', 'rate_limited'),
+    ('Sign in to confirm you’re not a bot', 'sign_in'),
+    ('Requested format is not available', 'format_unavailable'),
+    ('Video unavailable. This video is private', 'video_unavailable'),
+    ('Connection reset by peer', 'other'),
+    (None, 'other'),
+])
+def test_classify_error(message, expected):
+    assert classify_error(message) == expected
+
+
+def test_configured_order_until_something_is_learned():
+    assert names(StrategyScheduler(STRATEGIES)) == ['a', 'b', 'c']
+
+
+def test_blocked_strategy_is_backed_off():
+    scheduler = StrategyScheduler(STRATEGIES)
+    assert scheduler.record('a', False, error='HTTP Error 403: Forbidden') == 'forbidden'
+    assert names(scheduler) == ['b', 'c', 'a']
+    stats = scheduler.snapshot()['strategies'][-1]
+    assert stats['name'] == 'a' and stats['backoff_remaining'] > 0
+
+    # One success clears the backoff
+    scheduler.record('a', True, latency=1.0)
+    assert scheduler.snapshot()['strategies'][-1]['backoff_remaining'] == 0
+
+
+def test_repeated_failures_back_off_longer(monkeypatch):
+    scheduler = StrategyScheduler(STRATEGIES, backoff_base=10, backoff_max=25)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now)
+    scheduler.record('a', False, error='timeout')
+    assert scheduler.stats['a'].backoff_until == 0
+    scheduler.record('a', False, error='timeout')
+    assert scheduler.stats['a'].backoff_until == now + 20
+    scheduler.record('a', False, error='timeout')
+    assert scheduler.stats['a'].backoff_until == now + 25
+
+
+def test_video_errors_do_not_count_against_a_strategy():
+    scheduler = StrategyScheduler(STRATEGIES)
+    for _ in range(3):
+        scheduler.record('a', False, error='Video unavailable')
+    assert names(scheduler) == ['a', 'b', 'c']
+    assert scheduler.stats['a'].errors['video_unavailable'] == 3
+
+
+def test_faster_strategy_moves_up():
+    scheduler = StrategyScheduler(STRATEGIES)
+    scheduler.record('a', True, latency=20.0)
+    scheduler.record('b', True, latency=1.0)
+    assert names(scheduler)[0] == 'b'
@@ -0,0 +1,30 @@
+import time
+from ttl_cache import TTLCache
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    now[0] += 10
+    assert cache.get('a') is None
+    assert cache.stats() == {'entries': 0, 'ttl': 10, 'hits': 1, 'misses': 1}
+
+
+def test_oldest_entry_makes_room():
+    cache = TTLCache(ttl=10, max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.set('a', 3)
+    cache.set('c', 4)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (3, 4)
+    assert sorted(cache.values()) == [3, 4]
+
+
+def test_zero_ttl_disables():
+    cache = TTLCache(ttl=0)
+    cache.set('a', 1)
+    assert cache.get('a') is None
@@ -0,0 +1,83 @@
+import time
+import pytest
+from yt_dlp.postprocessor.common import PostProcessor
+from ydl_pool import PooledYoutubeDL, YoutubeDLPool
+
+
+@pytest.fixture
+def pool():
+    pool = YoutubeDLPool(lambda key: PooledYoutubeDL({'quiet': True, 'format': 'best'}), max_idle=1, max_uses=3)
+    yield pool
+    for instances in pool.idle.values():
+        for ydl in instances:
+            ydl.shutdown()
+
+
+def test_instances_are_reused_per_key(pool):
+    with pool.acquire('a') as first:
+        pass
+    with pool.acquire('a') as second:
+        assert pool.stats()['in_use'] == 1
+    with pool.acquire('b') as other:
+        pass
+    assert second is first and other is not first
+    assert pool.stats() == {'idle': {'a': 1, 'b': 1}, 'in_use': 0, 'created': 2, 'reused': 1, 'dropped': 0}
+
+
+def test_request_options_are_undone(pool):
+    hooked = []
+    with pool.acquire('a', format='bestaudio', outtmpl='/tmp/x.%(ext)s', extract_flat=True,
+                      progress_hooks=[hooked.append]) as ydl:
+        ydl.add_post_processor(PostProcessor(), when='post_process')
+        assert ydl.params['format'] == 'bestaudio' and ydl.params['extract_flat'] is True
+        assert ydl.params['outtmpl']['default'] == '/tmp/x.%(ext)s'
+        ydl._progress_hook({'status': 'downloading'})
+    assert hooked == [{'status': 'downloading'}]
+
+    with pool.acquire('a', format=None) as again:
+        assert again is ydl
+        assert 'format' not in again.params and 'extract_flat' not in again.params
+        assert again.params['outtmpl']['default'] != '/tmp/x.%(ext)s'
+        assert again._pps['post_process'] == []
+        again._progress_hook({'status': 'finished'})
+    assert len(hooked) == 1
+    with pool.acquire('a') as ydl:
+        assert ydl.params['format'] == 'best'
+
+
+def test_instances_are_dropped(pool):
+    # After a failed request
+    with pytest.raises(RuntimeError):
+        with pool.acquire('a') as failed:
+            raise RuntimeError
+    assert pool.acquire('a') is not failed
+
+    # After max_uses requests
+    first = pool.acquire('b')
+    first.close()
+    pool.acquire('b').close()
+    pool.acquire('b').close()
+    assert pool.acquire('b') is not first
+
+    # Past max_idle
+    c1, c2 = pool.acquire('c'), pool.acquire('c')
+    c1.close()
+    c2.close()
+    assert pool.stats()['idle']['c'] == 1
+
+
+def test_idle_instances_expire(pool, monkeypatch):
+    pool.acquire('a').close()
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + pool.idle_ttl + 1)
+    pool.acquire('b').close()
+    assert pool.stats()['idle'] == {'a': 0, 'b': 1}
+
+
+def test_warm(pool):
+    pool.warm(['a', 'b'], ie_keys=['Generic'])
+    pool.warm(['a'])
+    assert pool.stats()['created'] == 2
+    with pool.acquire('a') as ydl:
+        assert 'Generic' in ydl._ies_instances
+    assert pool.stats()['reused'] == 1
@@ -0,0 +1,54 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class TTLCache:
+    """Small in-memory cache whose entries expire after a fixed time.
+
+    Once ``max_entries`` is reached the oldest entry is dropped to make room.
+    """
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value):
+        if self.ttl <= 0:
+            return
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def values(self):
+        """Entries that haven't expired yet"""
+        now = time.monotonic()
+        with self.lock:
+            return [value for expires, value in self.entries.values() if expires > now]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,212 @@
+import time
+from threading import Lock
+from range_download import ParallelYoutubeDL
+from logs import get_logger
+
+log = get_logger('ydl_pool')
+
+# Marks an option that wasn't set before a request set it
+_MISSING = object()
+
+
+class PooledYoutubeDL(ParallelYoutubeDL):
+    """ParallelYoutubeDL that goes back to its pool when closed instead of shutting down.
+
+    A pooled instance keeps what makes a warm YoutubeDL worth having:
+    initialised extractors with their cached player code and signature
+    functions, cookies, and the HTTP handler's open keep-alive connections.
+
+    Requests bring their own options through ``begin()``: any runtime
+    option (format, outtmpl, extract_flat, ...), progress and postprocessor
+    hooks, a ``cancelled`` callback, and postprocessors added with
+    add_post_processor() while in use.
+    ``close()`` (or leaving a ``with`` block) undoes all of it and returns
+    the instance to the pool; ``shutdown()`` really closes it. Options read
+    when YoutubeDL is built (headers, extractor_args, logger) are fixed per
+    pool key.
+    """
+
+    def __init__(self, params=None, *args, **kwargs):
+        self.request_progress_hooks = []
+        self.request_postprocessor_hooks = []
+        params = {**(params or {}),
+                  'progress_hooks': [self._progress_hook],
+                  'postprocessor_hooks': [self._postprocessor_hook]}
+        super().__init__(params, *args, **kwargs)
+        self.pool = None
+        self.key = None
+        self.uses = 0
+        self.idle_since = None
+        self.reusable = True
+        self.leased = False
+        self._saved = None
+
+    def _progress_hook(self, d):
+        for hook in self.request_progress_hooks:
+            hook(d)
+
+    def _postprocessor_hook(self, d):
+        for hook in self.request_postprocessor_hooks:
+            hook(d)
+
+    def begin(self, progress_hooks=(), postprocessor_hooks=(), cancelled=None, **params):
+        """Apply one request's options. ``None`` values unset an option for this request."""
+        self._saved = {
+            'params': {name: self.params.get(name, _MISSING) for name in params if name != 'outtmpl'},
+            'outtmpl': dict(self.params['outtmpl']),
+            'format_selector': self.format_selector,
+            'pps': {when: list(pps) for when, pps in self._pps.items()},
+        }
+        for name, value in params.items():
+            if name == 'outtmpl':
+                self.params['outtmpl'] = {**self.params['outtmpl'], 'default': value}
+            elif value is None:
+                self.params.pop(name, None)
+            else:
+                self.params[name] = value
+        if 'format' in params:
+            self.format_selector = self.build_format_selector(params['format']) if params['format'] else None
+        self.request_progress_hooks = list(progress_hooks)
+        self.request_postprocessor_hooks = list(postprocessor_hooks)
+        self.cancelled = cancelled
+        self.uses += 1
+        self.leased = True
+        return self
+
+    def end(self):
+        """Undo begin() and whatever the request left behind"""
+        saved, self._saved = self._saved, None
+        self.request_progress_hooks = []
+        self.request_postprocessor_hooks = []
+        self.cancelled = None
+        if saved is None:
+            return
+        for name, value in saved['params'].items():
+            if value is _MISSING:
+                self.params.pop(name, None)
+            else:
+                self.params[name] = value
+        self.params['outtmpl'] = saved['outtmpl']
+        self.format_selector = saved['format_selector']
+        self._pps = saved['pps']
+        self._download_retcode = 0
+        self._num_downloads = 0
+
+    def __exit__(self, exc_type, *args):
+        # A session that just failed (blocked, throttled, ...) isn't one to keep
+        if exc_type is not None:
+            self.reusable = False
+        super().__exit__(exc_type, *args)
+
+    def close(self):
+        if self.pool is None:
+            self.shutdown()
+        elif self.leased:
+            self.leased = False
+            self.pool.release(self)
+
+    def shutdown(self):
+        super().close()
+
+
+class YoutubeDLPool:
+    """Warm PooledYoutubeDL instances, kept per key (a download strategy) between requests.
+
+    ``create(key)`` builds a new instance. Up to ``max_idle`` idle
+    instances are kept per key; an instance is dropped after ``max_uses``
+    requests, after ``idle_ttl`` seconds without one, or when a request
+    using it failed. ``warm(keys)`` builds one instance per key ahead of
+    the first request.
+    """
+
+    def __init__(self, create, max_idle=4, idle_ttl=600, max_uses=100):
+        self.create = create
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.max_uses = max_uses
+        self.lock = Lock()
+        self.idle = {}  # key -> [instance, ...], most recently used last
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.dropped = 0
+
+    def _new(self, key):
+        ydl = self.create(key)
+        ydl.pool = self
+        ydl.key = key
+        with self.lock:
+            self.created += 1
+        return ydl
+
+    def acquire(self, key, **options):
+        """An instance for ``key`` with the request's options applied (see PooledYoutubeDL.begin).
+
+        Close it, or use it in a ``with`` block, to hand it back.
+        """
+        expired = []
+        ydl = None
+        with self.lock:
+            now = time.monotonic()
+            for instances in self.idle.values():
+                while instances and now - instances[0].idle_since > self.idle_ttl:
+                    expired.append(instances.pop(0))
+            if self.idle.get(key):
+                ydl = self.idle[key].pop()
+                self.reused += 1
+            self.dropped += len(expired)
+            self.in_use += 1
+        for old in expired:
+            old.shutdown()
+        try:
+            if ydl is None:
+                ydl = self._new(key)
+            return ydl.begin(**options)
+        except BaseException:
+            with self.lock:
+                self.in_use -= 1
+            raise
+
+    def release(self, ydl):
+        """Take an instance back after a request (PooledYoutubeDL.close() calls this)"""
+        try:
+            ydl.end()
+        except Exception as e:
+            log.warning("⚠️ Could not reset a pooled YoutubeDL", error=str(e))
+            ydl.reusable = False
+        with self.lock:
+            self.in_use -= 1
+            instances = self.idle.setdefault(ydl.key, [])
+            keep = ydl.reusable and ydl.uses < self.max_uses and len(instances) < self.max_idle
+            if keep:
+                ydl.idle_since = time.monotonic()
+                instances.append(ydl)
+            else:
+                self.dropped += 1
+        if not keep:
+            ydl.shutdown()
+
+    def warm(self, keys, ie_keys=()):
+        """Build an idle instance for every key that has none, with the ``ie_keys`` extractors loaded"""
+        for key in keys:
+            with self.lock:
+                if self.idle.get(key):
+                    continue
+            started = time.monotonic()
+            ydl = self._new(key)
+            for ie_key in ie_keys:
+                ydl.get_info_extractor(ie_key)
+            ydl.idle_since = time.monotonic()
+            with self.lock:
+                self.idle.setdefault(key, []).append(ydl)
+            log.info("🔥 Warmed up YoutubeDL", key=key, duration_ms=round((time.monotonic() - started) * 1000, 1))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'idle': {key: len(instances) for key, instances in self.idle.items()},
+                'in_use': self.in_use,
+                'created': self.created,
+                'reused': self.reused,
+                'dropped': self.dropped,
+            }